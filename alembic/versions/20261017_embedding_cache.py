@@ -0,0 +1,33 @@
+# Alembic migration — FT9 Intelligence
+# Cache persistente de embeddings: tabela embedding_cache (modelo + sha256 do
+# texto normalizado → float32 little-endian)
+#
+# Instalações anteriores já têm a tabela (criada pelo próprio serviço).
+
+from alembic import op
+import sqlalchemy as sa
+
+# Revisão
+revision = 'embedding_cache'
+down_revision = 'knowledge_list_keyset'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table('embedding_cache'):
+        return
+
+    op.create_table(
+        'embedding_cache',
+        sa.Column('model', sa.String(100), primary_key=True),
+        sa.Column('text_hash', sa.String(64), primary_key=True),
+        sa.Column('embedding', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('CURRENT_TIMESTAMP'))
+    )
+
+
+def downgrade():
+    if sa.inspect(op.get_bind()).has_table('embedding_cache'):
+        op.drop_table('embedding_cache')
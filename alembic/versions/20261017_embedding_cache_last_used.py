@@ -0,0 +1,42 @@
+# Alembic migration — FT9 Intelligence
+# Cache persistente de embeddings: último uso de cada entrada (last_used_at,
+# indexado) para a limpeza por idade / teto de linhas
+
+from alembic import op
+import sqlalchemy as sa
+
+# Revisão
+revision = 'embedding_cache_last_used'
+down_revision = 'knowledge_legacy_embedding'
+branch_labels = None
+depends_on = None
+
+
+def _columns():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('embedding_cache'):
+        return None
+    return [column['name'] for column in inspector.get_columns('embedding_cache')]
+
+
+def upgrade():
+    columns = _columns()
+    if columns is None or 'last_used_at' in columns:
+        return
+
+    # Entradas existentes contam como usadas agora (não saem na primeira limpeza)
+    op.add_column(
+        'embedding_cache',
+        sa.Column('last_used_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('CURRENT_TIMESTAMP'))
+    )
+    op.create_index('ix_embedding_cache_last_used', 'embedding_cache', ['last_used_at'])
+
+
+def downgrade():
+    columns = _columns()
+    if columns is None or 'last_used_at' not in columns:
+        return
+
+    op.drop_index('ix_embedding_cache_last_used', table_name='embedding_cache')
+    op.drop_column('embedding_cache', 'last_used_at')
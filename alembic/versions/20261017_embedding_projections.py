@@ -0,0 +1,42 @@
+# Alembic migration — FT9 Intelligence
+# Embeddings com dimensão reduzida: projeções PCA por organização
+# + projeção do espaço ativo / alvo em knowledge_embedding_versions
+
+from alembic import op
+import sqlalchemy as sa
+
+# Revisão
+revision = 'embedding_projections'
+down_revision = 'embedding_versions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'knowledge_embedding_projections',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('organization_id', sa.Integer,
+                  sa.ForeignKey('organizations.id'), nullable=False),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('source_dimensions', sa.Integer, nullable=False),
+        sa.Column('dimensions', sa.Integer, nullable=False),
+        sa.Column('mean', sa.LargeBinary(), nullable=False),
+        sa.Column('components', sa.LargeBinary(), nullable=False),
+        sa.Column('explained_variance', sa.Float, nullable=False),
+        sa.Column('sample_size', sa.Integer, nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('CURRENT_TIMESTAMP'))
+    )
+    op.create_index('ix_knowledge_embedding_projections_id', 'knowledge_embedding_projections', ['id'])
+    op.create_index('ix_knowledge_embedding_projections_organization_id',
+                    'knowledge_embedding_projections', ['organization_id'])
+
+    op.add_column('knowledge_embedding_versions', sa.Column('projection_id', sa.Integer, nullable=True))
+    op.add_column('knowledge_embedding_versions', sa.Column('target_projection_id', sa.Integer, nullable=True))
+
+
+def downgrade():
+    op.drop_column('knowledge_embedding_versions', 'target_projection_id')
+    op.drop_column('knowledge_embedding_versions', 'projection_id')
+    op.drop_table('knowledge_embedding_projections')
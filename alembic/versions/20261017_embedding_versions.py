@@ -0,0 +1,71 @@
+# Alembic migration — FT9 Intelligence
+# Embeddings versionadas: modelo + dimensão em cada vetor (knowledge_chunks /
+# knowledge_base), coluna sombra para re-embedding e espaço ativo por organização
+#
+# Todos os vetores existentes saíram do EmbeddingService (text-embedding-ada-002);
+# a dimensão é lida do próprio bytea (4 bytes por float32).
+
+from alembic import op
+import sqlalchemy as sa
+
+# Revisão
+revision = 'embedding_versions'
+down_revision = 'knowledge_ingest_jobs'
+branch_labels = None
+depends_on = None
+
+LEGACY_MODEL = 'text-embedding-ada-002'
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if inspector.has_table('knowledge_chunks'):
+        op.add_column('knowledge_chunks', sa.Column('embedding_model', sa.String(100), nullable=True))
+        op.add_column('knowledge_chunks', sa.Column('embedding_dim', sa.Integer, nullable=True))
+        op.add_column('knowledge_chunks', sa.Column('shadow_embedding_vec', sa.LargeBinary(), nullable=True))
+        op.add_column('knowledge_chunks', sa.Column('shadow_embedding_model', sa.String(100), nullable=True))
+        op.add_column('knowledge_chunks', sa.Column('shadow_embedding_dim', sa.Integer, nullable=True))
+
+        op.execute(
+            f"UPDATE knowledge_chunks SET embedding_model = '{LEGACY_MODEL}', "
+            f"embedding_dim = length(embedding_vec) / 4 WHERE embedding_vec IS NOT NULL"
+        )
+
+    if inspector.has_table('knowledge_base'):
+        op.add_column('knowledge_base', sa.Column('embedding_model', sa.String(100), nullable=True))
+        op.add_column('knowledge_base', sa.Column('embedding_dim', sa.Integer, nullable=True))
+
+        op.execute(
+            f"UPDATE knowledge_base SET embedding_model = '{LEGACY_MODEL}', "
+            f"embedding_dim = length(embedding_vec) / 4 WHERE embedding_vec IS NOT NULL"
+        )
+
+    op.create_table(
+        'knowledge_embedding_versions',
+        sa.Column('organization_id', sa.Integer,
+                  sa.ForeignKey('organizations.id'), primary_key=True),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('dimensions', sa.Integer, nullable=False),
+        sa.Column('version', sa.Integer, nullable=False, server_default='1'),
+        sa.Column('status', sa.String(20), nullable=False, server_default='active'),
+        sa.Column('target_model', sa.String(100), nullable=True),
+        sa.Column('target_dimensions', sa.Integer, nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.Column('switched_at', sa.DateTime(timezone=True), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_table('knowledge_embedding_versions')
+
+    inspector = sa.inspect(op.get_bind())
+    if inspector.has_table('knowledge_base'):
+        op.drop_column('knowledge_base', 'embedding_dim')
+        op.drop_column('knowledge_base', 'embedding_model')
+
+    if inspector.has_table('knowledge_chunks'):
+        for column in ('shadow_embedding_dim', 'shadow_embedding_model', 'shadow_embedding_vec',
+                       'embedding_dim', 'embedding_model'):
+            op.drop_column('knowledge_chunks', column)
@@ -0,0 +1,93 @@
+# Alembic migration — FT9 Intelligence
+# Ingestão em trechos: tabela knowledge_chunks (filhos de knowledge)
+# + um trecho por documento existente, reaproveitando a embedding atual
+# (documentos longos podem ser redivididos com scripts/rechunk_knowledge.py)
+#
+# Documentos só com o JSON legado (knowledge.embedding sem embedding_vec,
+# gravados depois de knowledge_embedding_bytea) têm o JSON convertido antes.
+# JSON inválido ou vazio deixa o trecho sem vetor: fica fora da busca até
+# scripts/rechunk_knowledge.py, que também re-embedda esses documentos.
+
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+import json
+
+# Revisão
+revision = 'knowledge_chunks'
+down_revision = 'knowledge_tags'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def _backfill_legacy_json():
+    """
+    knowledge.embedding (JSON) → embedding_vec onde ainda falta, em lotes
+    """
+    bind = op.get_bind()
+    select_batch = sa.text(
+        "SELECT id, embedding::text FROM knowledge "
+        "WHERE embedding IS NOT NULL AND embedding_vec IS NULL AND id > :last_id "
+        "ORDER BY id LIMIT :limit"
+    )
+    update_row = sa.text("UPDATE knowledge SET embedding_vec = :vec WHERE id = :id")
+
+    last_id = 0
+    while True:
+        rows = bind.execute(select_batch, {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+
+        params = []
+        for row_id, raw in rows:
+            try:
+                values = json.loads(raw)
+            except ValueError:
+                continue
+            if not values:
+                continue
+            params.append({"id": row_id, "vec": np.asarray(values, dtype='<f4').tobytes()})
+
+        if params:
+            bind.execute(update_row, params)
+
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('knowledge'):
+        return
+
+    op.create_table(
+        'knowledge_chunks',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('knowledge_id', sa.Integer,
+                  sa.ForeignKey('knowledge.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('organization_id', sa.Integer, nullable=False),
+        sa.Column('chunk_index', sa.Integer, nullable=False),
+        sa.Column('content', sa.Text, nullable=False),
+        sa.Column('token_count', sa.Integer, nullable=False),
+        sa.Column('embedding_vec', sa.LargeBinary(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('CURRENT_TIMESTAMP'))
+    )
+    op.create_index('ix_knowledge_chunks_id', 'knowledge_chunks', ['id'])
+    op.create_index('ix_knowledge_chunks_knowledge_id', 'knowledge_chunks', ['knowledge_id'])
+    op.create_index('ix_knowledge_chunks_organization_id', 'knowledge_chunks', ['organization_id'])
+
+    _backfill_legacy_json()
+
+    # Documentos existentes: um trecho com o conteúdo e a embedding inteiros
+    op.execute(
+        "INSERT INTO knowledge_chunks "
+        "(knowledge_id, organization_id, chunk_index, content, token_count, embedding_vec) "
+        "SELECT id, organization_id, 0, content, length(content) / 3 + 1, embedding_vec "
+        "FROM knowledge ORDER BY id"
+    )
+
+
+def downgrade():
+    if sa.inspect(op.get_bind()).has_table('knowledge_chunks'):
+        op.drop_table('knowledge_chunks')
@@ -0,0 +1,108 @@
+# Alembic migration — FT9 Intelligence
+# Embeddings binárias: coluna embedding_vec (bytea, float32 little-endian)
+# + backfill em lotes a partir do JSON legado em knowledge / knowledge_base
+#
+# knowledge.embedding continua preenchida: knowledge_router_v2 (main_ft9_engine*)
+# ainda ranqueia por `embedding <=> :query_emb::vector`, e v2 / populate_knowledge_ptc
+# gravam as duas colunas. Só knowledge_base, sem leitores do JSON, é limpa.
+
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+import json
+
+# Revisão
+revision = 'knowledge_embedding_bytea'
+down_revision = 'knowledge_table_ai9'
+branch_labels = None
+depends_on = None
+
+TABLES = ('knowledge', 'knowledge_base')
+BATCH_SIZE = 500
+
+# Tabelas cujo JSON legado ainda é lido (não limpar até o leitor sair)
+LEGACY_READERS = ('knowledge',)
+
+
+def _existing_tables():
+    inspector = sa.inspect(op.get_bind())
+    return [t for t in TABLES if inspector.has_table(t)]
+
+
+def _backfill(table: str):
+    """
+    Converter JSON → float32 em lotes (keyset por id) e limpar o JSON legado
+    (exceto em LEGACY_READERS)
+    """
+    bind = op.get_bind()
+    clear_legacy = ", embedding = NULL" if table not in LEGACY_READERS else ""
+    select_batch = sa.text(
+        f"SELECT id, embedding::text FROM {table} "
+        f"WHERE embedding IS NOT NULL AND embedding_vec IS NULL AND id > :last_id "
+        f"ORDER BY id LIMIT :limit"
+    )
+    update_row = sa.text(
+        f"UPDATE {table} SET embedding_vec = :vec{clear_legacy} WHERE id = :id"
+    )
+
+    last_id = 0
+    while True:
+        rows = bind.execute(select_batch, {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+
+        params = []
+        for row_id, raw in rows:
+            try:
+                values = json.loads(raw)
+            except ValueError:
+                continue
+            if not values:
+                continue
+            params.append({
+                "id": row_id,
+                "vec": np.asarray(values, dtype='<f4').tobytes()
+            })
+
+        if params:
+            bind.execute(update_row, params)
+
+        last_id = rows[-1][0]
+
+
+def _restore_json(table: str):
+    """
+    Regravar o JSON legado a partir da coluna binária (downgrade)
+    """
+    bind = op.get_bind()
+    select_batch = sa.text(
+        f"SELECT id, embedding_vec FROM {table} "
+        f"WHERE embedding_vec IS NOT NULL AND id > :last_id "
+        f"ORDER BY id LIMIT :limit"
+    )
+    update_row = sa.text(f"UPDATE {table} SET embedding = :emb WHERE id = :id")
+
+    last_id = 0
+    while True:
+        rows = bind.execute(select_batch, {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+
+        bind.execute(update_row, [
+            {"id": row_id, "emb": json.dumps(np.frombuffer(blob, dtype='<f4').tolist())}
+            for row_id, blob in rows
+        ])
+
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    for table in _existing_tables():
+        op.add_column(table, sa.Column('embedding_vec', sa.LargeBinary(), nullable=True))
+        _backfill(table)
+
+
+def downgrade():
+    for table in _existing_tables():
+        _restore_json(table)
+        op.drop_column(table, 'embedding_vec')
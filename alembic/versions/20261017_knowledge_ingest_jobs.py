@@ -0,0 +1,58 @@
+# Alembic migration — FT9 Intelligence
+# Ingestão em segundo plano: jobs duráveis (status, contagens, cursor)
+# + itens enfileirados, consumidos em lotes pelos workers
+
+from alembic import op
+import sqlalchemy as sa
+
+# Revisão
+revision = 'knowledge_ingest_jobs'
+down_revision = 'knowledge_chunks'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'knowledge_ingest_jobs',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('organization_id', sa.Integer,
+                  sa.ForeignKey('organizations.id'), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False, server_default='pending'),
+        sa.Column('total', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('processed', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('inserted', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('failed', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('chunks', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('tokens', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('cursor', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('errors', sa.Text, nullable=True),
+        sa.Column('error', sa.Text, nullable=True),
+        sa.Column('worker_id', sa.String(100), nullable=True),
+        sa.Column('attempts', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('elapsed_seconds', sa.Float, nullable=False, server_default='0'),
+        sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True)
+    )
+    op.create_index('ix_knowledge_ingest_jobs_id', 'knowledge_ingest_jobs', ['id'])
+    op.create_index('ix_knowledge_ingest_jobs_organization_id', 'knowledge_ingest_jobs', ['organization_id'])
+    op.create_index('ix_knowledge_ingest_jobs_status', 'knowledge_ingest_jobs', ['status'])
+
+    op.create_table(
+        'knowledge_ingest_items',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('job_id', sa.Integer,
+                  sa.ForeignKey('knowledge_ingest_jobs.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('seq', sa.Integer, nullable=False),
+        sa.Column('ref', sa.String(255), nullable=False),
+        sa.Column('payload', sa.Text, nullable=False),
+        sa.UniqueConstraint('job_id', 'seq', name='uq_knowledge_ingest_items_job_seq')
+    )
+
+
+def downgrade():
+    op.drop_table('knowledge_ingest_items')
+    op.drop_table('knowledge_ingest_jobs')
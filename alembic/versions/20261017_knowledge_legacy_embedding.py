@@ -0,0 +1,48 @@
+# Alembic migration — FT9 Intelligence
+# Regravar knowledge.embedding (JSON legado) a partir de embedding_vec onde a
+# migration knowledge_embedding_bytea já tinha limpado — knowledge_router_v2
+# ainda busca por essa coluna
+
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+import json
+
+# Revisão
+revision = 'knowledge_legacy_embedding'
+down_revision = 'embedding_cache'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('knowledge'):
+        return
+
+    bind = op.get_bind()
+    select_batch = sa.text(
+        "SELECT id, embedding_vec FROM knowledge "
+        "WHERE embedding IS NULL AND embedding_vec IS NOT NULL AND id > :last_id "
+        "ORDER BY id LIMIT :limit"
+    )
+    update_row = sa.text("UPDATE knowledge SET embedding = :emb WHERE id = :id")
+
+    last_id = 0
+    while True:
+        rows = bind.execute(select_batch, {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+
+        bind.execute(update_row, [
+            {"id": row_id, "emb": json.dumps(np.frombuffer(blob, dtype='<f4').tolist())}
+            for row_id, blob in rows
+        ])
+
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    # Nada a desfazer: o JSON é a cópia legada de embedding_vec
+    pass
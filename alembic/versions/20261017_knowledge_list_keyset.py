@@ -0,0 +1,33 @@
+# Alembic migration — FT9 Intelligence
+# Paginação por cursor das listagens da knowledge: índices (created_at, id)
+# por organização (/list) e global (/list-all)
+#
+# O cursor precisa de created_at em todas as linhas: NULLs (inserções que
+# sobrescreveram o default) recebem a data da migração e a coluna vira NOT NULL.
+
+from alembic import op
+import sqlalchemy as sa
+
+# Revisão
+revision = 'knowledge_list_keyset'
+down_revision = 'embedding_projections'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('knowledge'):
+        return
+
+    op.execute("UPDATE knowledge SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    op.alter_column('knowledge', 'created_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+
+    op.create_index('ix_knowledge_org_created_id', 'knowledge', ['organization_id', 'created_at', 'id'])
+    op.create_index('ix_knowledge_created_id', 'knowledge', ['created_at', 'id'])
+
+
+def downgrade():
+    if sa.inspect(op.get_bind()).has_table('knowledge'):
+        op.drop_index('ix_knowledge_created_id', table_name='knowledge')
+        op.drop_index('ix_knowledge_org_created_id', table_name='knowledge')
+        op.alter_column('knowledge', 'created_at', existing_type=sa.DateTime(timezone=True), nullable=True)
@@ -0,0 +1,82 @@
+# Alembic migration — FT9 Intelligence
+# Tags normalizadas: tabela knowledge_tags (uma linha por tag) com índice
+# (organization_id, tag) + backfill em lotes a partir do JSON em knowledge_base.tags
+
+from alembic import op
+import sqlalchemy as sa
+import json
+
+# Revisão
+revision = 'knowledge_tags'
+down_revision = 'knowledge_embedding_bytea'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def _backfill():
+    """
+    Expandir o JSON de tags em linhas de knowledge_tags (keyset por id)
+    """
+    bind = op.get_bind()
+    select_batch = sa.text(
+        "SELECT id, organization_id, tags FROM knowledge_base "
+        "WHERE tags IS NOT NULL AND id > :last_id "
+        "ORDER BY id LIMIT :limit"
+    )
+    insert_tag = sa.text(
+        "INSERT INTO knowledge_tags (knowledge_id, tag, organization_id) "
+        "VALUES (:knowledge_id, :tag, :organization_id) ON CONFLICT DO NOTHING"
+    )
+
+    last_id = 0
+    while True:
+        rows = bind.execute(select_batch, {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+
+        params = []
+        for row_id, organization_id, raw in rows:
+            try:
+                tags = json.loads(raw)
+            except ValueError:
+                continue
+            if not isinstance(tags, list):
+                continue
+            params.extend(
+                {"knowledge_id": row_id, "tag": str(tag)[:255], "organization_id": organization_id}
+                for tag in dict.fromkeys(tags) if tag
+            )
+
+        if params:
+            bind.execute(insert_tag, params)
+
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('knowledge_base'):
+        return
+
+    op.create_table(
+        'knowledge_tags',
+        sa.Column('knowledge_id', sa.Integer,
+                  sa.ForeignKey('knowledge_base.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('tag', sa.String(255), primary_key=True),
+        sa.Column('organization_id', sa.Integer, nullable=False),
+    )
+
+    # Busca por tag dentro da organização: index-only scan até o knowledge_id
+    op.create_index(
+        'ix_knowledge_tags_org_tag', 'knowledge_tags',
+        ['organization_id', 'tag', 'knowledge_id']
+    )
+
+    _backfill()
+
+
+def downgrade():
+    if sa.inspect(op.get_bind()).has_table('knowledge_tags'):
+        op.drop_index('ix_knowledge_tags_org_tag', table_name='knowledge_tags')
+        op.drop_table('knowledge_tags')
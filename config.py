@@ -41,6 +41,104 @@ class Settings:
         self.openai_api_key = os.getenv('OPENAI_API_KEY', '')
         self.openai_model = os.getenv('OPENAI_MODEL', 'gpt-5.1')
         
+        # Modelo de embeddings padrão (organizações sem versão registrada / novas)
+        # EMBEDDING_DIMENSIONS 0 = dimensão nativa do modelo
+        self.embedding_model = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+        self.embedding_dimensions = int(os.getenv('EMBEDDING_DIMENSIONS', '0'))
+        # Re-embedding em segundo plano (coluna sombra): trechos por lote
+        self.embedding_reembed_batch = int(os.getenv('EMBEDDING_REEMBED_BATCH', '200'))
+        # Dimensão reduzida: amostra para ajustar o PCA e comparação recall@k das dimensões candidatas
+        self.embedding_pca_sample = int(os.getenv('EMBEDDING_PCA_SAMPLE', '5000'))
+        self.embedding_recall_dimensions = [
+            int(d) for d in os.getenv('EMBEDDING_RECALL_DIMENSIONS', '64,128,256,512,768').split(',') if d.strip()
+        ]
+        self.embedding_recall_target = float(os.getenv('EMBEDDING_RECALL_TARGET', '0.95'))
+        
+        # Cache de embeddings (LRU em memória + tabela persistente)
+        # EMBEDDING_CACHE_URL vazio → usa o DATABASE_URL (driver síncrono); "disabled" desliga
+        self.embedding_cache_size = int(os.getenv('EMBEDDING_CACHE_SIZE', '2048'))
+        self.embedding_cache_url = os.getenv('EMBEDDING_CACHE_URL', '')
+        # Limpeza da tabela persistente: entradas sem uso há N dias, teto de linhas
+        # (0 desliga cada limite) e intervalo da limpeza periódica em segundos
+        self.embedding_cache_max_age_days = int(os.getenv('EMBEDDING_CACHE_MAX_AGE_DAYS', '90'))
+        self.embedding_cache_max_rows = int(os.getenv('EMBEDDING_CACHE_MAX_ROWS', '1000000'))
+        self.embedding_cache_prune_interval = int(os.getenv('EMBEDDING_CACHE_PRUNE_INTERVAL', '21600'))
+        
+        # Embeddings em lote (limites por requisição e concorrência)
+        self.embedding_batch_size = int(os.getenv('EMBEDDING_BATCH_SIZE', '256'))
+        self.embedding_batch_tokens = int(os.getenv('EMBEDDING_BATCH_TOKENS', '100000'))
+        self.embedding_concurrency = int(os.getenv('EMBEDDING_CONCURRENCY', '4'))
+        self.embedding_max_retries = int(os.getenv('EMBEDDING_MAX_RETRIES', '3'))
+        
+        # Cliente HTTP assíncrono das embeddings (pool com keep-alive / HTTP/2)
+        self.embedding_http_timeout = float(os.getenv('EMBEDDING_HTTP_TIMEOUT', '30'))
+        self.embedding_http_max_connections = int(os.getenv('EMBEDDING_HTTP_MAX_CONNECTIONS', '20'))
+        self.embedding_http_max_keepalive = int(os.getenv('EMBEDDING_HTTP_MAX_KEEPALIVE', '10'))
+        self.embedding_http_keepalive_expiry = float(os.getenv('EMBEDDING_HTTP_KEEPALIVE_EXPIRY', '60'))
+        
+        # Vector store FAISS (um shard por organização)
+        self.vector_store_dir = os.getenv('VECTOR_STORE_DIR', '/home/ubuntu/ft9-whatsapp/data/faiss_shards')
+        self.vector_store_max_shards = int(os.getenv('VECTOR_STORE_MAX_SHARDS', '64'))
+        # Compactação: reconstruir o shard quando os tombstones passarem de
+        # max(VECTOR_STORE_COMPACT_MIN, VECTOR_STORE_COMPACT_RATIO * vetores)
+        self.vector_store_compact_ratio = float(os.getenv('VECTOR_STORE_COMPACT_RATIO', '0.2'))
+        self.vector_store_compact_min = int(os.getenv('VECTOR_STORE_COMPACT_MIN', '32'))
+        # Índice aproximado (ivf | hnsw | flat) a partir de VECTOR_STORE_ANN_THRESHOLD vetores
+        self.vector_store_ann_type = os.getenv('VECTOR_STORE_ANN_TYPE', 'hnsw').lower()
+        self.vector_store_ann_threshold = int(os.getenv('VECTOR_STORE_ANN_THRESHOLD', '20000'))
+        self.vector_store_train_sample = int(os.getenv('VECTOR_STORE_TRAIN_SAMPLE', '50000'))
+        self.vector_store_ivf_nlist = int(os.getenv('VECTOR_STORE_IVF_NLIST', '0'))  # 0 = automático
+        self.vector_store_nprobe = int(os.getenv('VECTOR_STORE_NPROBE', '16'))
+        self.vector_store_hnsw_m = int(os.getenv('VECTOR_STORE_HNSW_M', '32'))
+        self.vector_store_ef_construction = int(os.getenv('VECTOR_STORE_EF_CONSTRUCTION', '80'))
+        self.vector_store_ef_search = int(os.getenv('VECTOR_STORE_EF_SEARCH', '64'))
+        # Quantização dos vetores (none | sq8 | pq) a partir de VECTOR_STORE_QUANTIZE_MIN vetores
+        self.vector_store_quantization = os.getenv('VECTOR_STORE_QUANTIZATION', 'none').lower()
+        self.vector_store_quantize_min = int(os.getenv('VECTOR_STORE_QUANTIZE_MIN', '256'))
+        self.vector_store_pq_m = int(os.getenv('VECTOR_STORE_PQ_M', '0'))  # 0 = dimensão / 4
+        self.vector_store_rescore_factor = int(os.getenv('VECTOR_STORE_RESCORE_FACTOR', '4'))
+        # WAL por shard: checkpoint ao passar do tamanho ou do intervalo (segundos)
+        self.vector_store_wal_max_bytes = int(os.getenv('VECTOR_STORE_WAL_MAX_BYTES', str(64 * 1024 * 1024)))
+        self.vector_store_checkpoint_interval = int(os.getenv('VECTOR_STORE_CHECKPOINT_INTERVAL', '300'))
+        self.vector_store_wal_fsync = os.getenv('VECTOR_STORE_WAL_FSYNC', 'true').lower() == 'true'
+        # Índice base aberto com mmap somente leitura (compartilhado entre workers)
+        self.vector_store_mmap = os.getenv('VECTOR_STORE_MMAP', 'true').lower() == 'true'
+        # Busca com filtro de tags: até N candidatos (knowledge_tags) são
+        # ranqueados de forma exata; acima disso, busca no shard + filtro SQL
+        self.rag_tag_prefilter_max = int(os.getenv('RAG_TAG_PREFILTER_MAX', '2000'))
+        # Busca híbrida na knowledge: BM25 + vetorial combinados por RRF
+        self.knowledge_hybrid_search = os.getenv('KNOWLEDGE_HYBRID_SEARCH', 'true').lower() == 'true'
+        self.knowledge_hybrid_fetch_factor = int(os.getenv('KNOWLEDGE_HYBRID_FETCH_FACTOR', '4'))
+        self.knowledge_rrf_k = int(os.getenv('KNOWLEDGE_RRF_K', '60'))
+        # Re-ranking MMR (diversidade) por endpoint: 1.0 = desligado (só relevância);
+        # opcional — ex. 0.7 para evitar trechos quase iguais no contexto do RAG
+        self.knowledge_mmr_lambda_internal = float(os.getenv('KNOWLEDGE_MMR_LAMBDA_INTERNAL', '1.0'))
+        self.knowledge_mmr_lambda_search = float(os.getenv('KNOWLEDGE_MMR_LAMBDA_SEARCH', '1.0'))
+        self.knowledge_mmr_lambda_rag = float(os.getenv('KNOWLEDGE_MMR_LAMBDA_RAG', '1.0'))
+        # Ingestão em trechos: tamanho máximo e sobreposição (tokens estimados)
+        self.knowledge_chunk_tokens = int(os.getenv('KNOWLEDGE_CHUNK_TOKENS', '400'))
+        self.knowledge_chunk_overlap = int(os.getenv('KNOWLEDGE_CHUNK_OVERLAP', '60'))
+        # Ingestão em massa (/knowledge/bulk): documentos por lote/transação e erros reportados
+        self.knowledge_bulk_batch_docs = int(os.getenv('KNOWLEDGE_BULK_BATCH_DOCS', '50'))
+        self.knowledge_bulk_max_errors = int(os.getenv('KNOWLEDGE_BULK_MAX_ERRORS', '100'))
+        # Jobs de ingestão em segundo plano: workers por processo (0 = desligado), intervalo de
+        # consulta da fila e tempo sem heartbeat até outro worker retomar o job (segundos)
+        self.knowledge_job_workers = int(os.getenv('KNOWLEDGE_JOB_WORKERS', '2'))
+        self.knowledge_job_poll_seconds = float(os.getenv('KNOWLEDGE_JOB_POLL_SECONDS', '2'))
+        self.knowledge_job_stale_seconds = int(os.getenv('KNOWLEDGE_JOB_STALE_SECONDS', '300'))
+        # Listagem da knowledge (/list, /list-all): itens por página (padrão e máximo)
+        self.knowledge_list_page_size = int(os.getenv('KNOWLEDGE_LIST_PAGE_SIZE', '50'))
+        self.knowledge_list_max_page_size = int(os.getenv('KNOWLEDGE_LIST_MAX_PAGE_SIZE', '200'))
+        # Cache semântico de respostas do /knowledge/rag (por organização)
+        self.knowledge_answer_cache = os.getenv('KNOWLEDGE_ANSWER_CACHE', 'true').lower() == 'true'
+        self.knowledge_answer_cache_threshold = float(os.getenv('KNOWLEDGE_ANSWER_CACHE_THRESHOLD', '0.95'))
+        self.knowledge_answer_cache_size = int(os.getenv('KNOWLEDGE_ANSWER_CACHE_SIZE', '500'))
+        self.knowledge_answer_cache_ttl = int(os.getenv('KNOWLEDGE_ANSWER_CACHE_TTL', '86400'))  # 0 = sem expiração
+        # Contexto dos prompts RAG: orçamento total, limite por trecho e sobra mínima útil (tokens)
+        self.rag_context_tokens = int(os.getenv('RAG_CONTEXT_TOKENS', '1500'))
+        self.rag_passage_max_tokens = int(os.getenv('RAG_PASSAGE_MAX_TOKENS', '600'))
+        self.rag_context_min_tokens = int(os.getenv('RAG_CONTEXT_MIN_TOKENS', '40'))
+        
         # Database
         database_url = os.getenv(
             'DATABASE_URL',
@@ -19,6 +19,7 @@ from .models import (
     Conversation,
     Message,
     KnowledgeBase,
+    KnowledgeTag,
     UserRole,
     SubscriptionPlan,
     SubscriptionStatus,
@@ -36,6 +37,7 @@ __all__ = [
     "Conversation",
     "Message",
     "KnowledgeBase",
+    "KnowledgeTag",
     "UserRole",
     "SubscriptionPlan",
     "SubscriptionStatus",
@@ -2,7 +2,7 @@
 Modelo Knowledge para Base de Conhecimento com pgvector
 Implementado conforme especificação dos programadores - 15/11/2025
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, func
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, LargeBinary, func
 from sqlalchemy.dialects.postgresql import VECTOR
 from sqlalchemy.orm import relationship
 from database.models import Base
@@ -23,6 +23,9 @@ class Knowledge(Base):
     # Embedding vetorial (1536 dimensões para text-embedding-ada-002)
     embedding = Column(VECTOR(1536), nullable=True)
     
+    # Mesma embedding em float32 little-endian cru (bytea) para leitura sem parse
+    embedding_vec = Column(LargeBinary, nullable=True)
+    
     # Multi-tenant: cada documento pertence a uma organização
     organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False, index=True)
     
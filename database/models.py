@@ -2,7 +2,7 @@
 Modelos de banco de dados para sistema multi-tenant FT9
 """
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, LargeBinary, Index, Enum as SQLEnum
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.sql import func
 import enum
@@ -192,12 +192,15 @@ class KnowledgeBase(Base):
     content = Column(Text, nullable=False)
     source = Column(String(500))  # URL, arquivo, etc.
     
-    # Embeddings (armazenado como JSON string)
+    # Embeddings (armazenado como JSON string — legado)
     embedding = Column(Text)  # Será usado com FAISS/Milvus
+    embedding_vec = Column(LargeBinary)  # float32 little-endian (bytea)
+    embedding_model = Column(String(100))  # modelo + dimensão que geraram o vetor
+    embedding_dim = Column(Integer)
     
     # Categorização
     category = Column(String(100))
-    tags = Column(Text)  # JSON array de tags
+    tags = Column(Text)  # JSON array de tags (cópia; busca usa knowledge_tags)
     
     # Metadata
     is_active = Column(Boolean, default=True)
@@ -206,3 +209,21 @@ class KnowledgeBase(Base):
     
     def __repr__(self):
         return f"<KnowledgeBase {self.title} (Org: {self.organization_id})>"
+
+
+class KnowledgeTag(Base):
+    """
+    Tags da base de conhecimento (uma linha por tag), indexadas por
+    organização + tag para filtrar candidatos antes da busca vetorial
+    """
+    __tablename__ = "knowledge_tags"
+    __table_args__ = (
+        Index("ix_knowledge_tags_org_tag", "organization_id", "tag", "knowledge_id"),
+    )
+    
+    knowledge_id = Column(Integer, ForeignKey("knowledge_base.id", ondelete="CASCADE"), primary_key=True)
+    tag = Column(String(255), primary_key=True)
+    organization_id = Column(Integer, nullable=False)
+    
+    def __repr__(self):
+        return f"<KnowledgeTag {self.tag} (Knowledge: {self.knowledge_id})>"
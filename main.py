@@ -17,6 +17,7 @@ from routers.funnel import router as funnel_router
 from routers.broadcast_router import router as broadcast_router
 from routers.zapi_webhook_router import router as zapi_webhook_router
 from routers.mini_cinthya_router import router as mini_cinthya_router
+from services.app_lifecycle import start_services, stop_services
 
 # ------------------------------------------------------
 # LOGGING (IMPORTANTE PARA DIAGNÓSTICO NO RAILWAY)
@@ -71,6 +72,20 @@ app.include_router(broadcast_router, prefix="/api/v1")
 app.include_router(zapi_webhook_router)
 app.include_router(mini_cinthya_router)
 
+# ------------------------------------------------------
+# STARTUP — workers de ingestão em segundo plano
+# ------------------------------------------------------
+@app.on_event("startup")
+async def start_workers():
+    await start_services()
+
+# ------------------------------------------------------
+# SHUTDOWN — parar workers, fechar clientes HTTP, checkpoint FAISS
+# ------------------------------------------------------
+@app.on_event("shutdown")
+async def shutdown_clients():
+    await stop_services()
+
 # ------------------------------------------------------
 # RODAR LOCALMENTE (Railway ignora)
 # ------------------------------------------------------
@@ -9,6 +9,7 @@ from contextlib import asynccontextmanager
 import logging
 from config import settings
 from database import init_db
+from services.app_lifecycle import start_services, stop_services
 from routers import auth_router, organization_router, billing_router, knowledge_router, automation_router, whatsapp_router
 from routers.temp_update_org import router as temp_update_router
 from routers.admin_router import router as admin_router
@@ -44,10 +45,14 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Erro ao inicializar banco de dados: {e}")
     
+    # Workers de ingestão em segundo plano (/knowledge/jobs)
+    await start_services()
+    
     yield
     
     # Shutdown
     logger.info("Encerrando FT9 Intelligence...")
+    await stop_services()
 
 
 # Criar aplicação FastAPI
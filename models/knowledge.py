@@ -1,11 +1,16 @@
 # models/knowledge.py — FT9 Intelligence
 # Versão AI9 Patch 3 — VECTOR removido (pgvector não disponível no Railway)
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, func
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, ForeignKey, Index, LargeBinary, UniqueConstraint, func
 from database import Base
 
 class Knowledge(Base):
     __tablename__ = "knowledge"
+    # Paginação por cursor (created_at, id) em /list (por organização) e /list-all
+    __table_args__ = (
+        Index("ix_knowledge_org_created_id", "organization_id", "created_at", "id"),
+        Index("ix_knowledge_created_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(255), nullable=False)
@@ -14,7 +19,127 @@ class Knowledge(Base):
 
     # REMOVIDO: pgvector → não suportado no Railway
     # embedding = Column(VECTOR(1536))
-    embedding = Column(Text)  # JSON string ou lista serializada
+    embedding = Column(Text)  # JSON string (legado — ver embedding_vec)
+
+    # float32 little-endian cru (bytea) — lido com np.frombuffer, sem parse de JSON
+    # (documentos novos: embeddings por trecho em KnowledgeChunk; aqui a média deles)
+    embedding_vec = Column(LargeBinary, nullable=True)
 
     organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False)
+    # NOT NULL: chave do cursor das listagens (created_at, id)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class KnowledgeChunk(Base):
+    __tablename__ = "knowledge_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    knowledge_id = Column(Integer, ForeignKey("knowledge.id", ondelete="CASCADE"), nullable=False, index=True)
+    organization_id = Column(Integer, nullable=False, index=True)
+
+    # Posição do trecho no documento (0..n-1)
+    chunk_index = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=False)
+
+    # float32 little-endian (bytea) — embedding do trecho + espaço que a gerou
+    embedding_vec = Column(LargeBinary, nullable=True)
+    embedding_model = Column(String(100), nullable=True)
+    embedding_dim = Column(Integer, nullable=True)
+
+    # Coluna sombra: re-embedding para o próximo espaço da organização, preenchida
+    # em lotes enquanto a busca segue na embedding_vec (ver embedding_version_service)
+    shadow_embedding_vec = Column(LargeBinary, nullable=True)
+    shadow_embedding_model = Column(String(100), nullable=True)
+    shadow_embedding_dim = Column(Integer, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class KnowledgeEmbeddingVersion(Base):
+    """Espaço de embeddings ativo de cada organização (e a troca em andamento)"""
+    __tablename__ = "knowledge_embedding_versions"
+
+    organization_id = Column(Integer, ForeignKey("organizations.id"), primary_key=True)
+
+    # Espaço usado pela busca (consultas + matriz) e pelos trechos novos
+    model = Column(String(100), nullable=False)
+    dimensions = Column(Integer, nullable=False)
+    projection_id = Column(Integer, nullable=True)  # PCA (knowledge_embedding_projections)
+    version = Column(Integer, nullable=False, default=1)  # incrementada a cada troca
+
+    # Troca em andamento: active | reembedding
+    status = Column(String(20), nullable=False, default="active")
+    target_model = Column(String(100), nullable=True)
+    target_dimensions = Column(Integer, nullable=True)
+    target_projection_id = Column(Integer, nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    switched_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class KnowledgeIngestJob(Base):
+    """Ingestão em segundo plano (ver services/ingestion_job_service.py)"""
+    __tablename__ = "knowledge_ingest_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False, index=True)
+
+    # pending → running → completed | failed | cancelled
+    status = Column(String(20), nullable=False, default="pending", index=True)
+
+    # Registros enfileirados (válidos) e já processados (gravados ou com erro)
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    inserted = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    chunks = Column(Integer, nullable=False, default=0)
+    tokens = Column(Integer, nullable=False, default=0)
+
+    # seq do último item confirmado — a retomada continua a partir dele
+    cursor = Column(Integer, nullable=False, default=0)
+
+    errors = Column(Text, nullable=True)  # JSON: [{"row", "error"}] (limitado)
+    error = Column(Text, nullable=True)   # falha fatal do job
+
+    worker_id = Column(String(100), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    elapsed_seconds = Column(Float, nullable=False, default=0.0)  # tempo de processamento
+
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class KnowledgeIngestItem(Base):
+    """Registro enfileirado de um job (removido quando o lote é confirmado)"""
+    __tablename__ = "knowledge_ingest_items"
+    __table_args__ = (UniqueConstraint("job_id", "seq", name="uq_knowledge_ingest_items_job_seq"),)
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("knowledge_ingest_jobs.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(Integer, nullable=False)
+    ref = Column(String(255), nullable=False)  # "arquivo:linha" para os erros
+    payload = Column(Text, nullable=False)     # JSON {"title", "category", "content"}
+
+
+class KnowledgeEmbeddingProjection(Base):
+    """Projeção PCA ajustada nos vetores de uma organização (dimensão reduzida)"""
+    __tablename__ = "knowledge_embedding_projections"
+
+    id = Column(Integer, primary_key=True, index=True)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False, index=True)
+
+    # Espaço de origem (modelo na dimensão nativa) → `dimensions` componentes
+    model = Column(String(100), nullable=False)
+    source_dimensions = Column(Integer, nullable=False)
+    dimensions = Column(Integer, nullable=False)
+
+    # float32 little-endian: média (D) e componentes (k x D, por linha)
+    mean = Column(LargeBinary, nullable=False)
+    components = Column(LargeBinary, nullable=False)
+
+    explained_variance = Column(Float, nullable=False)  # fração da variância mantida
+    sample_size = Column(Integer, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -5,8 +5,8 @@ Implementado conforme especificação dos programadores - 15/11/2025
 Este script:
 1. Conecta ao banco de dados PostgreSQL
 2. Lê as aulas do PTC da pasta knowledge_base/
-3. Gera embeddings para cada aula
-4. Insere na tabela knowledge
+3. Divide as aulas em trechos e gera as embeddings em lotes concorrentes
+4. Insere na tabela knowledge (+ knowledge_chunks) em transações por lote
 
 Uso:
     python populate_knowledge_ptc.py --org-id 1
@@ -25,9 +25,9 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 from sqlalchemy import select
 from database.database import AsyncSessionLocal, init_db
-from database.knowledge_model import Knowledge
+from models.knowledge import Knowledge
 from database.models import Organization
-from services.embedding_service import embedding_service
+from services.knowledge_ingestion_service import knowledge_ingestion_service
 
 logging.basicConfig(
     level=logging.INFO,
@@ -103,45 +103,34 @@ async def populate_knowledge(org_id: int, lessons: List[Dict[str, str]]):
             
             logger.info(f"🏢 Organização: {org.name}")
             
-            # Processar cada aula
-            for i, lesson in enumerate(lessons, 1):
-                logger.info(f"\n📝 [{i}/{len(lessons)}] Processando: {lesson['title']}")
-                
-                # Verificar se já existe
-                result = await session.execute(
-                    select(Knowledge).where(
-                        Knowledge.title == lesson['title'],
-                        Knowledge.organization_id == org_id
-                    )
-                )
-                existing = result.scalar_one_or_none()
-                
-                if existing:
-                    logger.warning(f"⚠️  Aula já existe, pulando...")
-                    continue
-                
-                # Gerar embedding
-                logger.info(f"🔄 Gerando embedding ({len(lesson['content'])} caracteres)...")
-                embedding = embedding_service.generate_embedding(lesson['content'])
-                
-                if not embedding:
-                    logger.error(f"❌ Falha ao gerar embedding, pulando...")
-                    continue
-                
-                # Criar documento
-                doc = Knowledge(
-                    title=lesson['title'],
-                    category=lesson['category'],
-                    content=lesson['content'],
-                    source=lesson.get('source'),
-                    embedding=embedding,
-                    organization_id=org_id
-                )
-                
-                session.add(doc)
-                await session.commit()
-                
-                logger.info(f"✅ Aula adicionada com sucesso!")
+            # Filtrar aulas que já existem (uma consulta só)
+            result = await session.execute(
+                select(Knowledge.title).where(Knowledge.organization_id == org_id)
+            )
+            existing_titles = set(result.scalars().all())
+            
+            new_lessons = [l for l in lessons if l['title'] not in existing_titles]
+            skipped = len(lessons) - len(new_lessons)
+            if skipped:
+                logger.warning(f"⚠️  {skipped} aulas já existem, pulando...")
+            
+            # Trechos + embeddings em lotes concorrentes, gravação por lote
+            logger.info(f"🔄 Ingerindo {len(new_lessons)} aulas em lotes...")
+            
+            async def records():
+                for lesson in new_lessons:
+                    yield lesson['source'], {
+                        "title": lesson['title'],
+                        "category": lesson['category'],
+                        "content": lesson['content']
+                    }
+            
+            report = await knowledge_ingestion_service.ingest(session, org_id, records())
+            
+            for error in report['errors']:
+                logger.error(f"❌ {error['row']}: {error['error']}")
+            
+            logger.info(f"✅ {report['inserted']} aulas adicionadas com sucesso ({report['chunks']} trechos)!")
             
             logger.info(f"\n🎉 População completa! {len(lessons)} aulas processadas.")
             
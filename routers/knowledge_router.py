@@ -1,17 +1,34 @@
 # knowledge_router.py — FT9 Intelligence
 # Versão AI9 — Rotas completas: ADD, SEARCH, RAG, COUNT
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import defer, load_only
+from datetime import datetime
 import sqlalchemy as sa
 import openai
+import base64
+import time
 
-from database import get_async_session, User
-from models.knowledge import Knowledge
-from services.embedding_service import generate_embedding
-from schemas.knowledge_schemas import KnowledgeCreate, KnowledgeOut
-from auth import get_current_active_user
+from database import get_async_session, User, UserRole
+from models.knowledge import Knowledge, KnowledgeChunk, KnowledgeIngestJob
+from services.embedding_service import EmbeddingSpace, embedding_service, generate_embedding
+from services.embedding_version_service import embedding_version_service
+from services.embedding_reduction_service import embedding_reduction_service
+from services.knowledge_chunk_service import knowledge_chunk_service
+from services.knowledge_ingestion_service import knowledge_ingestion_service, iter_uploads
+from services.ingestion_job_service import ingestion_job_service
+from services.knowledge_index_service import knowledge_matrix_cache
+from services.bm25_index_service import bm25_index_cache, reciprocal_rank_fusion
+from services.answer_cache_service import answer_cache
+from services.org_cache import chunk_version
+from services.context_assembler import context_assembler
+from services.streaming_service import sse_event, sse_response, stream_chat_completion, stream_answer_events
+from config import settings
+from schemas.knowledge_schemas import KnowledgeCreate, KnowledgeOut, KnowledgePage
+from auth import get_current_active_user, require_role
 
 router = APIRouter(prefix="/api/v1/knowledge", tags=["Knowledge"])
 
@@ -24,39 +41,207 @@ async def add_knowledge(
     current_user: User = Depends(get_current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    # Gerar embedding
-    embedding = await generate_embedding(payload.content)
-    
-    # Converter embedding para JSON string
-    import json
-    embedding_json = json.dumps(embedding) if embedding else None
-    
     new_doc = Knowledge(
         title=payload.title,
         category=payload.category,
         content=payload.content,
-        embedding=embedding_json,
         organization_id=current_user.organization_id
     )
     
     session.add(new_doc)
+    await session.flush()
+    
+    # Trechos com sobreposição + embeddings em lote (filhos do documento)
+    space = await embedding_version_service.pin_space(session, new_doc.organization_id)
+    chunks = await knowledge_chunk_service.create_chunks(session, new_doc, space)
+    
     await session.commit()
     await session.refresh(new_doc)
     
+    knowledge_matrix_cache.add_chunks(
+        new_doc.organization_id,
+        [(chunk.id, embedding) for chunk, embedding in chunks],
+        space
+    )
+    bm25_index_cache.add_chunks(
+        new_doc.organization_id, new_doc.title, new_doc.category,
+        [(chunk.id, chunk.content) for chunk, _ in chunks]
+    )
+    
     return new_doc
 
 # -----------------------------------------------------
-# 1.1) LIST — listar documentos da organização
+# 1.0) BULK — ingestão em massa (JSONL ou arquivos markdown)
 # -----------------------------------------------------
-@router.get("/list", response_model=list[KnowledgeOut])
+@router.post("/bulk")
+async def bulk_add_knowledge(
+    files: List[UploadFile] = File(...),
+    category: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    .jsonl: um documento por linha ({"title", "content", "category"?});
+    .md/.txt: um documento por arquivo (título = primeiro `# `).
+    Embeddings em lotes concorrentes, gravação em transações por lote.
+    Para uploads grandes use /jobs (processamento em segundo plano).
+    """
+    return await knowledge_ingestion_service.ingest(
+        session,
+        current_user.organization_id,
+        iter_uploads(files, default_category=category)
+    )
+
+# -----------------------------------------------------
+# 1.0.1) JOBS — ingestão em segundo plano (retomável)
+# -----------------------------------------------------
+async def _get_job(session: AsyncSession, job_id: int, organization_id: int) -> KnowledgeIngestJob:
+    job = await session.get(KnowledgeIngestJob, job_id)
+    if not job or job.organization_id != organization_id:
+        raise HTTPException(404, "Job não encontrado")
+    return job
+
+
+@router.post("/jobs", status_code=202)
+async def create_ingest_job(
+    files: List[UploadFile] = File(...),
+    category: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Mesmos formatos do /bulk; os registros são enfileirados e processados
+    pelos workers. Acompanhe em GET /jobs/{job_id}.
+    """
+    job = await ingestion_job_service.create_job(
+        session,
+        current_user.organization_id,
+        iter_uploads(files, default_category=category)
+    )
+    return ingestion_job_service.get_status(job)
+
+
+@router.get("/jobs")
+async def list_ingest_jobs(
+    limit: int = 20,
+    current_user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    stmt = (
+        select(KnowledgeIngestJob)
+        .where(KnowledgeIngestJob.organization_id == current_user.organization_id)
+        .order_by(KnowledgeIngestJob.id.desc())
+        .limit(min(limit, 100))
+    )
+    jobs = (await session.execute(stmt)).scalars().all()
+    return [ingestion_job_service.get_status(job) for job in jobs]
+
+
+@router.get("/jobs/{job_id}")
+async def get_ingest_job(
+    job_id: int,
+    current_user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Progresso, vazão (docs/s, tokens/s) e ETA"""
+    job = await _get_job(session, job_id, current_user.organization_id)
+    return ingestion_job_service.get_status(job)
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_ingest_job(
+    job_id: int,
+    current_user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    job = await _get_job(session, job_id, current_user.organization_id)
+    if not await ingestion_job_service.cancel_job(session, job):
+        raise HTTPException(409, f"Job já finalizado ({job.status})")
+    return ingestion_job_service.get_status(job)
+
+# -----------------------------------------------------
+# 1.1) LIST — listar documentos da organização (paginado por cursor)
+# -----------------------------------------------------
+LIST_PREVIEW_CHARS = 200
+
+
+def _encode_cursor(created_at: datetime, doc_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{doc_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, doc_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(doc_id)
+    except ValueError:
+        raise HTTPException(400, "Cursor inválido")
+
+
+async def _list_page(session: AsyncSession, cursor: Optional[str], limit: int, *criteria, columns=()):
+    """
+    Página de documentos em ordem (created_at, id) decrescente, a partir do cursor
+
+    Só as colunas de metadados são carregadas; a prévia do conteúdo é cortada
+    no banco (substr) e content / embedding nunca saem do Postgres.
+
+    Returns:
+        (linhas (Knowledge, content_preview, *columns), cursor da próxima página ou None)
+    """
+    stmt = (
+        select(
+            Knowledge,
+            sa.func.substr(Knowledge.content, 1, LIST_PREVIEW_CHARS).label("content_preview"),
+            *columns
+        )
+        .options(load_only(
+            Knowledge.id, Knowledge.title, Knowledge.category,
+            Knowledge.organization_id, Knowledge.created_at
+        ))
+        .where(*criteria)
+        .order_by(Knowledge.created_at.desc(), Knowledge.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        stmt = stmt.where(sa.tuple_(Knowledge.created_at, Knowledge.id) < _decode_cursor(cursor))
+
+    rows = (await session.execute(stmt)).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1][0]
+    return rows, _encode_cursor(last.created_at, last.id)
+
+
+@router.get("/list", response_model=KnowledgePage)
 async def list_knowledge(
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.knowledge_list_page_size, ge=1, le=settings.knowledge_list_max_page_size),
     current_user: User = Depends(get_current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    stmt = select(Knowledge).where(Knowledge.organization_id == current_user.organization_id)
-    result = await session.execute(stmt)
-    docs = result.scalars().all()
-    return docs
+    """
+    Documentos da organização, mais recentes primeiro, com prévia do conteúdo.
+    Para a próxima página, repassar `next_cursor` como `cursor` (null = fim).
+    """
+    rows, next_cursor = await _list_page(
+        session, cursor, limit, Knowledge.organization_id == current_user.organization_id
+    )
+    return {
+        "items": [
+            {
+                "id": doc.id,
+                "title": doc.title,
+                "category": doc.category,
+                "content_preview": preview,
+                "created_at": doc.created_at
+            }
+            for doc, preview in rows
+        ],
+        "next_cursor": next_cursor
+    }
 
 # -----------------------------------------------------
 # 2) COUNT — contar documentos
@@ -68,83 +253,221 @@ async def count_knowledge(
     q = await session.execute(select(sa.func.count(Knowledge.id)))
     return {"count": q.scalar()}
 
+# -----------------------------------------------------
+# 2.0) STATS — métricas dos caches de embeddings
+# -----------------------------------------------------
+@router.get("/stats")
+async def knowledge_stats(
+    current_user: User = Depends(get_current_active_user)
+):
+    return {
+        "embedding_cache": embedding_service.get_cache_stats(),
+        "matrix_cache": knowledge_matrix_cache.get_stats(),
+        "bm25_index": bm25_index_cache.get_stats(),
+        "answer_cache": answer_cache.get_stats()
+    }
+
+# -----------------------------------------------------
+# 2.0.1) EMBEDDINGS — espaço ativo e re-embedding (troca de modelo)
+# -----------------------------------------------------
+@router.get("/embeddings")
+async def embedding_status(
+    current_user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Modelo/dimensão ativos, versão e cobertura de um re-embedding em andamento"""
+    return await embedding_version_service.get_status(session, current_user.organization_id)
+
+
+@router.post("/embeddings/reembed", status_code=202)
+async def start_reembed(
+    model: str,
+    dimensions: Optional[int] = None,
+    current_user: User = Depends(require_role([UserRole.ORG_ADMIN])),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Gerar as embeddings de todos os trechos no novo modelo (coluna sombra) e
+    trocar o espaço da organização com 100% de cobertura. A busca segue no
+    modelo atual até a troca; chamar de novo retoma um re-embedding parado.
+
+    `dimensions` abaixo da nativa: parâmetro da API (text-embedding-3) ou
+    projeção PCA ajustada nos vetores atuais (demais modelos; ver /embeddings/recall).
+    """
+    try:
+        target = await embedding_reduction_service.target_space(
+            session, current_user.organization_id, model, dimensions
+        )
+        await embedding_version_service.start_reembed(session, current_user.organization_id, target)
+    except ValueError as e:
+        raise HTTPException(409, str(e))
+
+    return await embedding_version_service.get_status(session, current_user.organization_id)
+
+
+@router.get("/embeddings/recall")
+async def embedding_recall(
+    dimensions: Optional[List[int]] = Query(None),
+    k: int = 10,
+    queries: int = 200,
+    current_user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Recall@k de dimensões reduzidas contra o espaço ativo completo
+    (padrão EMBEDDING_RECALL_DIMENSIONS), com bytes por vetor de cada uma
+    """
+    return await embedding_reduction_service.dimension_report(
+        session, current_user.organization_id, dimensions, k=k, n_queries=queries
+    )
+
 # -----------------------------------------------------
 # 2.1) LIST ALL (DEBUG) — listar todos os documentos
 # -----------------------------------------------------
 @router.get("/list-all")
 async def list_all_knowledge(
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.knowledge_list_page_size, ge=1, le=settings.knowledge_list_max_page_size),
     session: AsyncSession = Depends(get_async_session)
 ):
-    result = await session.execute(select(Knowledge))
-    docs = result.scalars().all()
+    # Onde está a embedding, decidido no SQL sem trazer os vetores:
+    # bytea / json legados no documento ou nos trechos (ingestão atual)
+    chunk_embedded = sa.exists().where(
+        KnowledgeChunk.knowledge_id == Knowledge.id,
+        KnowledgeChunk.embedding_vec.isnot(None)
+    )
+    embedding_type = sa.case(
+        (Knowledge.embedding_vec.isnot(None), "bytea"),
+        (Knowledge.embedding.isnot(None), "json"),
+        (chunk_embedded, "chunks"),
+        else_=None
+    ).label("embedding_type")
+
+    rows, next_cursor = await _list_page(session, cursor, limit, columns=(embedding_type,))
+    
+    return {
+        "items": [
+            {
+                "id": doc.id,
+                "title": doc.title,
+                "category": doc.category,
+                "organization_id": doc.organization_id,
+                "content_preview": preview,
+                "has_embedding": kind is not None,
+                "embedding_type": kind,
+                "created_at": doc.created_at
+            }
+            for doc, preview, kind in rows
+        ],
+        "next_cursor": next_cursor
+    }
+
+# -----------------------------------------------------
+# 2.2) RANK — trechos: vetorial (matriz em memória) + BM25, fundidos por RRF
+# -----------------------------------------------------
+async def _rank_knowledge(
+    query_emb,
+    organization_id: int,
+    session: AsyncSession,
+    top_k: int,
+    query: str = None,
+    mmr_lambda: float = 1.0,
+    space: EmbeddingSpace = None
+) -> list:
+    """
+    Ranquear os trechos da organização pela similaridade com a query
+
+    Com KNOWLEDGE_HYBRID_SEARCH (e o texto da query), os rankings vetorial e
+    BM25 são combinados por Reciprocal Rank Fusion; o score passa a ser o RRF.
+    Com mmr_lambda < 1, os candidatos extras são reordenados por MMR para
+    evitar trechos quase iguais (ex.: versões da mesma aula).
+    `space` é o espaço em que query_emb foi gerada (ver _embed_query).
+
+    Returns:
+        Lista de tuplas (Knowledge, KnowledgeChunk, score) em ordem decrescente
+        de score; o conteúdo do documento não é carregado, só o do trecho
+    """
+    diversify = mmr_lambda < 1.0
+    fetch = top_k * settings.knowledge_hybrid_fetch_factor
+    
+    if settings.knowledge_hybrid_search and query:
+        vector_ranked = await knowledge_matrix_cache.search(session, organization_id, query_emb, fetch, space)
+        lexical_ranked = await bm25_index_cache.search(session, organization_id, query, fetch)
+        
+        ranked = reciprocal_rank_fusion(
+            [vector_ranked, lexical_ranked], k=settings.knowledge_rrf_k
+        )[:fetch if diversify else top_k]
+    else:
+        ranked = await knowledge_matrix_cache.search(
+            session, organization_id, query_emb, fetch if diversify else top_k, space
+        )
+    
+    if diversify:
+        ranked = knowledge_matrix_cache.rerank_mmr(organization_id, ranked, top_k, mmr_lambda)
+    
+    if not ranked:
+        return []
+    
+    # Buscar somente os trechos vencedores + documento pai (sem embeddings nem conteúdo completo)
+    stmt = (
+        select(KnowledgeChunk, Knowledge)
+        .join(Knowledge, Knowledge.id == KnowledgeChunk.knowledge_id)
+        .options(
+            defer(KnowledgeChunk.embedding_vec),
+            defer(Knowledge.content),
+            defer(Knowledge.embedding),
+            defer(Knowledge.embedding_vec)
+        )
+        .where(KnowledgeChunk.id.in_([chunk_id for chunk_id, _ in ranked]))
+    )
+    result = await session.execute(stmt)
+    rows_by_id = {chunk.id: (doc, chunk) for chunk, doc in result.all()}
     
     return [
-        {
-            "id": doc.id,
-            "title": doc.title,
-            "category": doc.category,
-            "organization_id": doc.organization_id,
-            "content_preview": doc.content[:200] if doc.content else None,
-            "has_embedding": doc.embedding is not None,
-            "embedding_type": str(type(doc.embedding)),
-            "created_at": doc.created_at
-        }
-        for doc in docs
+        (*rows_by_id[chunk_id], score)
+        for chunk_id, score in ranked
+        if chunk_id in rows_by_id
     ]
 
+async def _embed_query(session: AsyncSession, organization_id: int, text: str):
+    """Embedding da consulta no espaço ativo da organização → (space, embedding)"""
+    space = await embedding_version_service.get_space(session, organization_id)
+    return space, await generate_embedding(text, space=space)
+
 # -----------------------------------------------------
-# 2.2) SEARCH INTERNAL — função interna para uso por outros routers
+# 2.3) SEARCH INTERNAL — função interna para uso por outros routers
 # -----------------------------------------------------
 async def search_knowledge_internal(
     query: str,
     organization_id: int,
     session: AsyncSession,
-    top_k: int = 5
+    top_k: int = 5,
+    mmr_lambda: float = None
 ) -> list:
     """
     Internal function to search knowledge base
     Used by other routers (e.g., WhatsApp)
     
+    mmr_lambda: MMR trade-off (1.0 = relevance only); default KNOWLEDGE_MMR_LAMBDA_INTERNAL
+    
     Returns:
-        List of dicts with title, content, score
+        List of dicts with title, content (matching chunk), category, score
     """
-    import json
-    import numpy as np
-    
-    query_emb = await generate_embedding(query)
-    
-    # Buscar todos os documentos da organização
-    stmt = select(Knowledge).where(Knowledge.organization_id == organization_id)
-    result = await session.execute(stmt)
-    docs = result.scalars().all()
-    
-    if not docs:
-        return []
+    space, query_emb = await _embed_query(session, organization_id, query)
     
-    # Calcular similaridade de cosseno em Python
-    def cosine_similarity(a, b):
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    if mmr_lambda is None:
+        mmr_lambda = settings.knowledge_mmr_lambda_internal
     
-    scored_docs = []
-    for doc in docs:
-        if doc.embedding:
-            # Converter JSON string para lista
-            doc_emb = json.loads(doc.embedding) if isinstance(doc.embedding, str) else doc.embedding
-            score = cosine_similarity(query_emb, doc_emb)
-            scored_docs.append((doc, score))
-    
-    # Ordenar por score (maior primeiro) e pegar top_k
-    scored_docs.sort(key=lambda x: x[1], reverse=True)
-    top_docs = scored_docs[:top_k]
+    top_chunks = await _rank_knowledge(query_emb, organization_id, session, top_k, query, mmr_lambda, space)
     
     return [
         {
             "title": doc.title,
-            "content": doc.content,
+            "content": chunk.content,
             "category": doc.category,
             "score": float(score)
         }
-        for doc, score in top_docs
+        for doc, chunk, score in top_chunks
     ]
 
 # -----------------------------------------------------
@@ -156,44 +479,23 @@ async def search_knowledge(
     current_user: User = Depends(get_current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    import json
-    import numpy as np
-    
-    query_emb = await generate_embedding(query)
-    
-    # Buscar todos os documentos da organização
-    stmt = select(Knowledge).where(Knowledge.organization_id == current_user.organization_id)
-    result = await session.execute(stmt)
-    docs = result.scalars().all()
-    
-    if not docs:
-        return []
-    
-    # Calcular similaridade de cosseno em Python
-    def cosine_similarity(a, b):
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    space, query_emb = await _embed_query(session, current_user.organization_id, query)
     
-    scored_docs = []
-    for doc in docs:
-        if doc.embedding:
-            # Converter JSON string para lista
-            doc_emb = json.loads(doc.embedding) if isinstance(doc.embedding, str) else doc.embedding
-            score = cosine_similarity(query_emb, doc_emb)
-            scored_docs.append((doc, score))
-    
-    # Ordenar por score (maior primeiro) e pegar top 5
-    scored_docs.sort(key=lambda x: x[1], reverse=True)
-    top_docs = [doc for doc, score in scored_docs[:5]]
+    top_chunks = await _rank_knowledge(
+        query_emb, current_user.organization_id, session, 5, query,
+        mmr_lambda=settings.knowledge_mmr_lambda_search, space=space
+    )
     
+    # Conteúdo = trecho encontrado (id/título do documento pai)
     return [
         KnowledgeOut(
             id=doc.id,
             title=doc.title,
             category=doc.category,
-            content=doc.content,
+            content=chunk.content,
             created_at=doc.created_at
         )
-        for doc in top_docs
+        for doc, chunk, score in top_chunks
     ]
 
 # -----------------------------------------------------
@@ -202,46 +504,45 @@ async def search_knowledge(
 @router.post("/rag")
 async def ask_rag(
     question: str,
+    stream: bool = False,
     current_user: User = Depends(get_current_active_user),
     session: AsyncSession = Depends(get_async_session)
 ):
-    import json
-    import numpy as np
-    
-    # 1) Buscar contexto (inline para evitar dependência circular)
-    query_emb = await generate_embedding(question)
-    
-    # Buscar todos os documentos da organização
-    stmt = select(Knowledge).where(Knowledge.organization_id == current_user.organization_id)
-    result = await session.execute(stmt)
-    docs = result.scalars().all()
-    
-    if not docs:
-        raise HTTPException(404, "Nenhum documento encontrado na base de conhecimento.")
-    
-    # Calcular similaridade de cosseno
-    def cosine_similarity(a, b):
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-    
-    scored_docs = []
-    for doc in docs:
-        if doc.embedding:
-            doc_emb = json.loads(doc.embedding) if isinstance(doc.embedding, str) else doc.embedding
-            score = cosine_similarity(query_emb, doc_emb)
-            scored_docs.append((doc, score))
+    organization_id = current_user.organization_id
+    space, query_emb = await _embed_query(session, organization_id, question)
+    
+    # 0) Pergunta equivalente já respondida sobre o mesmo conteúdo (versão dos trechos)
+    content = await chunk_version(session, organization_id)
+    cached = answer_cache.lookup(organization_id, query_emb, space, content)
+    if cached is not None:
+        answer_cache.record_hit(cached)
+        
+        if stream:
+            return sse_response(_cached_answer_events(cached))
+        return {"answer": cached.answer, "cached": True}
+    
+    started = time.perf_counter()
+    
+    # 1) Buscar contexto
+    scored_chunks = await _rank_knowledge(
+        query_emb, organization_id, session, 3, question,
+        mmr_lambda=settings.knowledge_mmr_lambda_rag, space=space
+    )
     
-    if not scored_docs:
+    if not scored_chunks:
         raise HTTPException(404, "Nenhum documento com embedding encontrado.")
     
-    # Ordenar por score e pegar top 3 para RAG
-    scored_docs.sort(key=lambda x: x[1], reverse=True)
-    context_docs = [doc for doc, score in scored_docs[:3]]
-    
-    if not context_docs:
-        raise HTTPException(404, "Nenhum documento encontrado para RAG.")
-    
-    # 2) Montar contexto
-    context_text = "\n---\n".join([doc.content for doc in context_docs])
+    # 2) Montar contexto (trechos encontrados, sem repetição, dentro do orçamento de tokens)
+    context = context_assembler.assemble(
+        question,
+        [
+            {"content": chunk.content, "ranked": (doc, chunk, score)}
+            for doc, chunk, score in scored_chunks
+        ],
+        formatter=lambda title, content: content
+    )
+    context_text = context.text("\n---\n")
+    scored_chunks = [passage["ranked"] for passage in context.passages]
     
     prompt = f"""
 Responda a seguinte pergunta usando SOMENTE o contexto abaixo
@@ -256,6 +557,26 @@ Contexto:
 Resposta:
 """
     
+    doc_ids = [doc.id for doc, chunk, score in scored_chunks]
+    
+    # 3a) Streaming (SSE): tokens conforme chegam + evento final com as fontes
+    if stream:
+        def store_answer(answer: str):
+            answer_cache.store(
+                organization_id, query_emb, question, answer,
+                doc_ids=doc_ids, latency=time.perf_counter() - started, space=space, content=content
+            )
+        
+        tokens = stream_chat_completion(
+            [{"role": "user", "content": prompt}],
+            model="gpt-4.1-mini", temperature=0.2, max_tokens=400
+        )
+        return sse_response(stream_answer_events(
+            tokens,
+            final={"sources": _sources(scored_chunks), "cached": False, **context.stats()},
+            on_complete=store_answer
+        ))
+    
     # 3) Chamar OpenAI
     from openai import OpenAI
     client = OpenAI()  # API key vem de OPENAI_API_KEY env var
@@ -267,4 +588,34 @@ Resposta:
         max_tokens=400
     )
     
-    return {"answer": resp.choices[0].message.content}
+    answer = resp.choices[0].message.content
+    
+    answer_cache.store(
+        organization_id, query_emb, question, answer,
+        doc_ids=doc_ids, latency=time.perf_counter() - started, space=space, content=content
+    )
+    
+    return {"answer": answer, "cached": False, **context.stats()}
+
+
+def _sources(scored_chunks: list) -> list:
+    """Fontes de uma resposta RAG (documento + trecho usado)"""
+    return [
+        {
+            "id": doc.id,
+            "title": doc.title,
+            "category": doc.category,
+            "chunk_id": chunk.id,
+            "score": float(score)
+        }
+        for doc, chunk, score in scored_chunks
+    ]
+
+
+async def _cached_answer_events(cached):
+    """Resposta do cache no mesmo formato SSE do streaming"""
+    yield sse_event({"content": cached.answer}, event="token")
+    yield sse_event(
+        {"sources": [{"id": doc_id} for doc_id in cached.doc_ids], "cached": True, "answer": cached.answer},
+        event="done"
+    )
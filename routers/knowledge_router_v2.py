@@ -14,7 +14,7 @@ from database.database import get_db
 from database.models import User, Organization
 from database.knowledge_model import Knowledge
 from auth.security import get_current_active_user
-from services.embedding_service import embedding_service
+from services.embedding_service import embedding_service, encode_embedding
 from config import settings
 
 logger = logging.getLogger(__name__)
@@ -123,6 +123,7 @@ async def add_knowledge(
             content=item.content,
             source=item.source,
             embedding=embedding,
+            embedding_vec=encode_embedding(embedding),
             organization_id=current_org.id
         )
         
@@ -8,6 +8,8 @@ from typing import List
 import os
 from pathlib import Path
 
+from services.streaming_service import sse_response, stream_chat_completion, stream_answer_events
+
 router = APIRouter(tags=["Mini Cinthya"])
 
 # Modelos de dados
@@ -18,6 +20,7 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     history: List[ChatMessage] = []
+    stream: bool = False  # True → SSE (eventos token + done)
 
 class ChatResponse(BaseModel):
     response: str
@@ -27,6 +30,7 @@ async def mini_cinthya_chat(payload: ChatRequest):
     """
     Endpoint de chat com a Mini Cinthya
     Recebe mensagem e histórico, retorna resposta via OpenAI API
+    (com `stream: true`, os tokens chegam por SSE conforme são gerados)
     """
     try:
         # Importar OpenAI
@@ -37,40 +41,13 @@ async def mini_cinthya_chat(payload: ChatRequest):
         if not api_key:
             raise HTTPException(status_code=500, detail="OPENAI_API_KEY não configurada")
         
-        client = OpenAI(api_key=api_key)
-        
-        # Carregar persona
-        persona_path = Path("/app/kdb/cinthya/persona_mestre_mini_cinthya.md")
-        if not persona_path.exists():
-            # Fallback para ambiente local
-            persona_path = Path(__file__).parent.parent / "kdb" / "cinthya" / "persona_mestre_mini_cinthya.md"
-        
-        if not persona_path.exists():
-            raise HTTPException(status_code=500, detail="Arquivo de persona não encontrado")
-        
-        with open(persona_path, 'r', encoding='utf-8') as f:
-            system_prompt = f.read()
-        
-        # Patch AI9 v1.1 - Respostas curtas e bem formatadas
-        system_prompt += "\n\n---\n\n**INSTRUÇÕES DE FORMATAÇÃO:**\n"
-        system_prompt += "A partir de agora, responda sempre de forma curta, clara e organizada.\n"
-        system_prompt += "Use no máximo 3 a 5 linhas por resposta.\n"
-        system_prompt += "Use quebras de linha.\n"
-        system_prompt += "Não use parágrafos longos.\n"
-        system_prompt += "Nunca envie blocos extensos de texto.\n"
-        system_prompt += "Esteja sempre suave, elegante e objetiva."
+        messages = _build_messages(payload)
         
-        # Preparar mensagens
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
+        if payload.stream:
+            tokens = stream_chat_completion(messages, model="gpt-4o", temperature=0.5)
+            return sse_response(stream_answer_events(tokens, final={"model": "gpt-4o"}))
         
-        # Adicionar histórico
-        for msg in payload.history:
-            messages.append({"role": msg.role, "content": msg.content})
-        
-        # Adicionar mensagem atual
-        messages.append({"role": "user", "content": payload.message})
+        client = OpenAI(api_key=api_key)
         
         # Chamar OpenAI API
         completion = client.chat.completions.create(
@@ -89,6 +66,45 @@ async def mini_cinthya_chat(payload: ChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao processar chat: {str(e)}")
 
+def _build_messages(payload: ChatRequest) -> List[dict]:
+    """
+    Persona + instruções de formatação + histórico + mensagem atual
+    """
+    # Carregar persona
+    persona_path = Path("/app/kdb/cinthya/persona_mestre_mini_cinthya.md")
+    if not persona_path.exists():
+        # Fallback para ambiente local
+        persona_path = Path(__file__).parent.parent / "kdb" / "cinthya" / "persona_mestre_mini_cinthya.md"
+    
+    if not persona_path.exists():
+        raise HTTPException(status_code=500, detail="Arquivo de persona não encontrado")
+    
+    with open(persona_path, 'r', encoding='utf-8') as f:
+        system_prompt = f.read()
+    
+    # Patch AI9 v1.1 - Respostas curtas e bem formatadas
+    system_prompt += "\n\n---\n\n**INSTRUÇÕES DE FORMATAÇÃO:**\n"
+    system_prompt += "A partir de agora, responda sempre de forma curta, clara e organizada.\n"
+    system_prompt += "Use no máximo 3 a 5 linhas por resposta.\n"
+    system_prompt += "Use quebras de linha.\n"
+    system_prompt += "Não use parágrafos longos.\n"
+    system_prompt += "Nunca envie blocos extensos de texto.\n"
+    system_prompt += "Esteja sempre suave, elegante e objetiva."
+    
+    # Preparar mensagens
+    messages = [
+        {"role": "system", "content": system_prompt}
+    ]
+    
+    # Adicionar histórico
+    for msg in payload.history:
+        messages.append({"role": msg.role, "content": msg.content})
+    
+    # Adicionar mensagem atual
+    messages.append({"role": "user", "content": payload.message})
+    
+    return messages
+
 @router.get("/health")
 async def health_check():
     """Health check do serviço Mini Cinthya"""
@@ -16,6 +16,7 @@ from database import get_async_session
 from database.models import Organization, Conversation, Message, User
 from config import settings
 from openai import AsyncOpenAI
+from services.context_assembler import context_assembler
 
 logger = logging.getLogger(__name__)
 
@@ -240,11 +241,11 @@ async def search_knowledge_base(
         )
         
         if results:
-            context = "\n\n".join([
-                f"**{r['title']}**\n{r['content']}"
-                for r in results
-            ])
-            return context
+            # Contexto sem repetição, dentro do orçamento de tokens
+            context = context_assembler.assemble(
+                query, results, formatter=lambda title, content: f"**{title}**\n{content}"
+            )
+            return context.text() or None
         
         return None
     
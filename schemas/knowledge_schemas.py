@@ -15,3 +15,18 @@ class KnowledgeOut(BaseModel):
     
     class Config:
         orm_mode = True
+
+
+class KnowledgePreview(BaseModel):
+    id: int
+    title: str
+    category: str | None
+    content_preview: str | None
+    created_at: datetime
+    
+    class Config:
+        orm_mode = True
+
+class KnowledgePage(BaseModel):
+    items: list[KnowledgePreview]
+    next_cursor: str | None = None
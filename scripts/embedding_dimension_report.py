@@ -0,0 +1,57 @@
+"""
+Script para comparar o recall@k de dimensões reduzidas das embeddings
+
+Mede, sobre os vetores do espaço ativo da organização, quanto do top-k exato
+na dimensão cheia é recuperado em cada dimensão candidata (truncamento para
+text-embedding-3, PCA para os demais modelos).
+
+Uso:
+    python scripts/embedding_dimension_report.py --org-id 1 [--dimensions 128 256 512] [--k 10] [--queries 200]
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Adicionar diretório raiz ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from database.database import AsyncSessionLocal
+from services.embedding_reduction_service import embedding_reduction_service
+
+
+async def dimension_report(org_id: int, dimensions, k: int, queries: int):
+    """Gerar relatório de recall por dimensão da organização"""
+    async with AsyncSessionLocal() as session:
+        report = await embedding_reduction_service.dimension_report(
+            session, org_id, dimensions, k=k, n_queries=queries
+        )
+
+    if report["vectors"] < 2:
+        print(f"❌ Org {org_id} sem embeddings suficientes no espaço ativo")
+        return
+
+    print(f"✅ Org {org_id}: {report['model']} ({report['dimensions']}d, {report['bytes_per_vector']} bytes/vetor)")
+    print(f"   Vetores: {report['vectors']} | Queries: {report['queries']} | k = {report['k']}")
+    for entry in report["candidates"]:
+        if "error" in entry:
+            print(f"   {entry['dimensions']:>5}d  {entry['method']}: {entry['error']}")
+            continue
+        variance = f"  variância {entry['explained_variance']:.1%}" if "explained_variance" in entry else ""
+        print(
+            f"   {entry['dimensions']:>5}d  {entry['method']}: recall@{report['k']} {entry['recall_at_k']:.3f}  "
+            f"{entry['bytes_per_vector']} bytes/vetor ({entry['memory_ratio']:.0%}){variance}"
+        )
+    print(f"   Recomendado: {report['recommended_dimensions'] or 'manter a dimensão atual'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k por dimensão das embeddings")
+    parser.add_argument("--org-id", type=int, required=True)
+    parser.add_argument("--dimensions", type=int, nargs="*", default=None)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    print("📊 Comparando dimensões das embeddings...")
+    asyncio.run(dimension_report(args.org_id, args.dimensions, args.k, args.queries))
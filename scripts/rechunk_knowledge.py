@@ -0,0 +1,75 @@
+"""
+Script para redividir em trechos os documentos da knowledge ingeridos inteiros
+
+A migração knowledge_chunks cria um único trecho por documento antigo (com a
+embedding do documento todo). Este script divide os documentos maiores que
+KNOWLEDGE_CHUNK_TOKENS e gera as embeddings dos trechos em lote.
+
+Documentos com algum trecho sem embedding (JSON legado que a migração não
+conseguiu converter, falha da API na ingestão) também são refeitos.
+
+Uso:
+    python scripts/rechunk_knowledge.py [--org-id 1]
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Adicionar diretório raiz ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import select, delete, func, or_
+
+from config import settings
+from database.database import AsyncSessionLocal
+from models.knowledge import Knowledge, KnowledgeChunk
+from services.knowledge_chunk_service import knowledge_chunk_service
+
+
+async def rechunk(org_id: int = None):
+    """Redividir documentos com um único trecho acima do limite ou sem embedding"""
+    async with AsyncSessionLocal() as session:
+        single = (
+            select(KnowledgeChunk.knowledge_id)
+            .group_by(KnowledgeChunk.knowledge_id)
+            .having(func.count(KnowledgeChunk.id) == 1)
+            .having(func.max(KnowledgeChunk.token_count) > settings.knowledge_chunk_tokens)
+        )
+        missing = select(KnowledgeChunk.knowledge_id).where(KnowledgeChunk.embedding_vec.is_(None))
+        stmt = (
+            select(Knowledge.id)
+            .where(or_(Knowledge.id.in_(single), Knowledge.id.in_(missing)))
+            .order_by(Knowledge.id)
+        )
+        if org_id is not None:
+            stmt = stmt.where(Knowledge.organization_id == org_id)
+
+        doc_ids = (await session.execute(stmt)).scalars().all()
+
+    if not doc_ids:
+        print("✅ Nenhum documento para redividir")
+        return
+
+    total_chunks = 0
+    for doc_id in doc_ids:
+        async with AsyncSessionLocal() as session:
+            doc = await session.get(Knowledge, doc_id)
+            await session.execute(delete(KnowledgeChunk).where(KnowledgeChunk.knowledge_id == doc_id))
+
+            chunks = await knowledge_chunk_service.create_chunks(session, doc)
+            await session.commit()
+
+        total_chunks += len(chunks)
+        print(f"   Documento {doc_id}: {len(chunks)} trechos")
+
+    print(f"✅ {len(doc_ids)} documentos redivididos em {total_chunks} trechos")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Redividir documentos da knowledge em trechos")
+    parser.add_argument("--org-id", type=int, default=None)
+    args = parser.parse_args()
+
+    print("✂️  Redividindo documentos da knowledge...")
+    asyncio.run(rechunk(args.org_id))
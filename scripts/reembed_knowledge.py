@@ -0,0 +1,54 @@
+"""
+Script para trocar o modelo de embeddings de uma organização sem downtime
+
+Gera as embeddings de todos os trechos no novo modelo (coluna sombra) e troca
+o espaço ativo da organização quando a cobertura chega a 100%. A busca segue
+no modelo atual até a troca; rodar de novo retoma um re-embedding parado.
+
+Uso:
+    python scripts/reembed_knowledge.py --org-id 1 --model text-embedding-3-small [--dimensions 512]
+    python scripts/reembed_knowledge.py --org-id 1 --model text-embedding-ada-002 --dimensions 256  # PCA
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Adicionar diretório raiz ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from database.database import AsyncSessionLocal
+from services.embedding_reduction_service import embedding_reduction_service
+from services.embedding_version_service import embedding_version_service
+
+
+async def reembed(org_id: int, model: str, dimensions: int = None):
+    """Re-embedding completo de uma organização + troca do espaço ativo"""
+    async with AsyncSessionLocal() as session:
+        try:
+            target = await embedding_reduction_service.target_space(session, org_id, model, dimensions)
+            await embedding_version_service.start_reembed(session, org_id, target, background=False)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return
+
+    switched = await embedding_version_service.run(org_id)
+
+    async with AsyncSessionLocal() as session:
+        status = await embedding_version_service.get_status(session, org_id)
+
+    if switched:
+        print(f"✅ Org {org_id} agora usa {status['model']} ({status['dimensions']}d, versão {status['version']})")
+    else:
+        print(f"⚠️  Troca não concluída: {status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embedding da knowledge de uma organização")
+    parser.add_argument("--org-id", type=int, required=True)
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--dimensions", type=int, default=None)
+    args = parser.parse_args()
+
+    print(f"🔁 Re-embedding da org {args.org_id} → {args.model} ({args.dimensions or 'nativa'})...")
+    asyncio.run(reembed(args.org_id, args.model, args.dimensions))
@@ -0,0 +1,53 @@
+"""
+Script para medir o recall@k do shard FAISS de uma organização
+
+Compara a busca do shard (quantizado ou não) com a busca exata sobre as
+embeddings float32 do banco, antes e depois do rescoring.
+
+Uso:
+    python scripts/vector_recall_report.py --org-id 1 [--k 10] [--queries 100] [--quantization sq8]
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Adicionar diretório raiz ao path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from database.database import AsyncSessionLocal
+from services.rag_service import rag_service
+from services.vector_store_service import vector_store_service
+
+
+async def recall_report(org_id: int, k: int, queries: int, quantization: str = None):
+    """Gerar relatório de recall da organização"""
+    if quantization:
+        # Reconstruir o shard no codec pedido antes de medir
+        vector_store_service.set_quantization(org_id, quantization, wait=True)
+
+    async with AsyncSessionLocal() as session:
+        report = await rag_service.recall_report(session, org_id, k=k, n_queries=queries)
+
+    if not report.get("queries"):
+        print(f"❌ Org {org_id} sem embeddings no banco")
+        return
+
+    print(f"✅ Org {org_id}: {report['index_type']} / {report['codec']}")
+    print(f"   Bytes por vetor: {report['bytes_per_vector']} (float32: {report['float32_bytes_per_vector']})")
+    print(f"   Recall@{report['k']}: {report['recall_at_k']:.3f}")
+    print(f"   Recall@{report['k']} com rescoring (x{report['rescore_factor']}): "
+          f"{report['recall_at_k_rescored']:.3f}")
+    print(f"   Queries: {report['queries']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k do shard FAISS")
+    parser.add_argument("--org-id", type=int, required=True)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--quantization", choices=["none", "sq8", "pq"], default=None)
+    args = parser.parse_args()
+
+    print("📊 Medindo recall do vector store...")
+    asyncio.run(recall_report(args.org_id, args.k, args.queries, args.quantization))
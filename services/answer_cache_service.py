@@ -0,0 +1,221 @@
+"""
+Cache semântico de respostas do /knowledge/rag por organização
+
+Guarda (embedding da pergunta, resposta, ids dos documentos usados). Uma
+pergunta nova cuja similaridade de cosseno com uma já respondida passe de
+KNOWLEDGE_ANSWER_CACHE_THRESHOLD recebe a resposta guardada, sem busca nem
+chamada ao modelo.
+
+As perguntas são comparadas no espaço de embeddings ativo da organização; uma
+troca de espaço (nova versão, ex.: re-embedding) descarta o cache da
+organização.
+
+O cache também guarda a versão do conteúdo da organização (COUNT/MAX(id) de
+knowledge_chunks, ver org_cache.chunk_version) em que as respostas foram
+geradas: documento novo (/knowledge, /bulk), removido ou redividido
+(scripts/rechunk_knowledge.py) muda a versão e descarta o cache. Como a versão
+vem do banco, vale também para escritas feitas por outros workers.
+"""
+import logging
+import time
+from itertools import count
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from services.embedding_service import EmbeddingSpace
+from services.knowledge_index_service import OrgEmbeddingMatrix, parse_embedding
+from services.org_cache import OrgCache
+
+logger = logging.getLogger(__name__)
+
+
+class CachedAnswer:
+    """
+    Resposta guardada + documentos de onde ela saiu
+    """
+
+    def __init__(self, entry_id: int, question: str, answer: str, doc_ids: List[int], latency: float):
+        self.entry_id = entry_id
+        self.question = question
+        self.answer = answer
+        self.doc_ids = list(dict.fromkeys(doc_ids))
+        self.latency = latency  # tempo da resposta original (busca + LLM), em segundos
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class OrgAnswerCache:
+    """
+    Entradas de uma organização: matriz das perguntas + respostas
+
+    `space` e `content` (versão dos trechos) identificam a base em que as
+    respostas foram geradas.
+    """
+
+    def __init__(self, space: Optional[EmbeddingSpace] = None, content: Optional[Tuple[int, int]] = None):
+        self.space = space
+        self.content = content
+        self.matrix = OrgEmbeddingMatrix()
+        self.entries: Dict[int, CachedAnswer] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, entry: CachedAnswer, vec: np.ndarray):
+        if not self.matrix.add([entry.entry_id], [vec]):
+            return
+        self.entries[entry.entry_id] = entry
+
+    def remove(self, entry_ids: Iterable[int]) -> int:
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id in self.entries]
+        if not entry_ids:
+            return 0
+
+        self.matrix.remove(entry_ids)
+        for entry_id in entry_ids:
+            del self.entries[entry_id]
+
+        return len(entry_ids)
+
+
+class SemanticAnswerCache(OrgCache):
+    """
+    Cache semântico de respostas (um OrgAnswerCache por organização)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.enabled = settings.knowledge_answer_cache
+        self.threshold = settings.knowledge_answer_cache_threshold
+        self.max_entries = settings.knowledge_answer_cache_size
+        self.ttl = settings.knowledge_answer_cache_ttl
+
+        self._ids = count(1)
+
+        # Métricas
+        self.lookups = 0
+        self.hits = 0
+        self.saved_seconds = 0.0
+        self.invalidated = 0
+
+    def lookup(
+        self,
+        organization_id: int,
+        query_embedding: Optional[List[float]],
+        space: Optional[EmbeddingSpace] = None,
+        content: Optional[Tuple[int, int]] = None
+    ) -> Optional[CachedAnswer]:
+        """
+        Resposta guardada mais parecida com a pergunta (None se abaixo do limiar)
+
+        Args:
+            content: Versão atual dos trechos da organização (chunk_version)
+        """
+        if not self.enabled:
+            return None
+
+        self.lookups += 1
+
+        cache = self._org_cache(organization_id, space, content)
+        query = parse_embedding(query_embedding)
+        if cache is None or query is None or not len(cache):
+            return None
+
+        self._expire(cache)
+
+        best = cache.matrix.top_k(query, 1)
+        if not best or best[0][1] < self.threshold:
+            return None
+
+        return cache.entries[best[0][0]]
+
+    def record_hit(self, entry: CachedAnswer):
+        """
+        Contabilizar um acerto servido (depois da validação dos documentos)
+        """
+        entry.hits += 1
+        self.hits += 1
+        self.saved_seconds += entry.latency
+
+    def store(
+        self,
+        organization_id: int,
+        query_embedding: Optional[List[float]],
+        question: str,
+        answer: str,
+        doc_ids: List[int],
+        latency: float,
+        space: Optional[EmbeddingSpace] = None,
+        content: Optional[Tuple[int, int]] = None
+    ):
+        """
+        Guardar a resposta gerada (descarta a entrada mais antiga se lotado)
+
+        Args:
+            content: Versão dos trechos lida antes da busca que gerou a resposta
+        """
+        vec = parse_embedding(query_embedding)
+        if not self.enabled or vec is None or not answer:
+            return
+
+        cache = self._org_cache(organization_id, space, content)
+        if cache is None:
+            cache = self._orgs[organization_id] = OrgAnswerCache(space, content)
+        self._expire(cache)
+
+        if len(cache) >= self.max_entries:
+            oldest = sorted(cache.entries.values(), key=lambda e: e.created_at)
+            cache.remove(e.entry_id for e in oldest[:len(cache) - self.max_entries + 1])
+
+        cache.add(CachedAnswer(next(self._ids), question, answer, doc_ids, latency), vec)
+
+    def _org_cache(
+        self,
+        organization_id: int,
+        space: Optional[EmbeddingSpace],
+        content: Optional[Tuple[int, int]]
+    ) -> Optional[OrgAnswerCache]:
+        """Cache da organização (descartado se gerado em outro espaço ou versão do conteúdo)"""
+        cache = self._orgs.get(organization_id)
+        if cache is None:
+            return None
+
+        if cache.space != space:
+            reason = "novo espaço de embeddings"
+        elif cache.content != content:
+            reason = "conteúdo alterado"
+        else:
+            return cache
+
+        logger.info(f"Cache de respostas da org {organization_id} descartado ({reason})")
+        self.invalidated += len(cache)
+        del self._orgs[organization_id]
+        return None
+
+    def _expire(self, cache: OrgAnswerCache):
+        if not self.ttl:
+            return
+        deadline = time.monotonic() - self.ttl
+        expired = [e.entry_id for e in cache.entries.values() if e.created_at < deadline]
+        if expired:
+            cache.remove(expired)
+
+    def _stats(self) -> Dict[str, Any]:
+        """Taxa de acerto e latência economizada"""
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "entries": sum(len(c) for c in self._orgs.values()),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "invalidated": self.invalidated,
+            "saved_latency_seconds": round(self.saved_seconds, 3),
+            "avg_saved_latency_seconds": round(self.saved_seconds / self.hits, 3) if self.hits else 0.0
+        }
+
+
+# Instância global do serviço
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,52 @@
+"""
+Serviços em segundo plano do app: startup / shutdown
+
+Chamado pelos dois entrypoints (main.py e main_multitenant.py, o do deploy),
+para que workers de ingestão, clientes HTTP, checkpoints do FAISS e a limpeza
+do cache de embeddings não dependam de qual app está rodando.
+"""
+import logging
+
+from services.embedding_service import embedding_service
+from services.embedding_version_service import embedding_version_service
+from services.ingestion_job_service import ingestion_job_service
+from services.vector_store_service import vector_store_service
+
+logger = logging.getLogger(__name__)
+
+
+async def start_services():
+    """Iniciar os workers de ingestão e as tarefas periódicas (checkpoint do FAISS, limpeza do cache)"""
+    ingestion_job_service.start()
+    vector_store_service.start_checkpoints()
+    embedding_version_service.start_cache_pruning()
+
+
+async def stop_services():
+    """
+    Parar os workers e fechar/persistir os serviços compartilhados
+
+    Cada etapa roda mesmo se a anterior falhar.
+    """
+    # Jobs em andamento voltam à fila (retomados do último lote confirmado)
+    try:
+        await ingestion_job_service.stop()
+    except Exception as e:
+        logger.error(f"Erro ao parar os workers de ingestão: {e}")
+
+    try:
+        await embedding_version_service.stop_cache_pruning()
+    except Exception as e:
+        logger.error(f"Erro ao parar a limpeza do cache de embeddings: {e}")
+
+    try:
+        await embedding_service.aclose()
+    except Exception as e:
+        logger.error(f"Erro ao fechar o cliente de embeddings: {e}")
+
+    # Checkpoint dos shards FAISS (WAL → índice base)
+    try:
+        vector_store_service.stop_checkpoints()
+        vector_store_service.save_index()
+    except Exception as e:
+        logger.error(f"Erro no checkpoint do índice FAISS: {e}")
@@ -0,0 +1,279 @@
+"""
+Índice invertido BM25 em memória da Knowledge Base por organização
+
+Complementa a busca vetorial (knowledge_index_service) com termos exatos:
+números de aula, nomes de produto, preços. Indexa os mesmos trechos
+(knowledge_chunks), com o título e a categoria do documento pai. O texto passa por minúsculas,
+remoção de acentos, stopwords do português e uma redução simples de plural,
+então "Aulas", "aula" e "AULA" caem no mesmo termo.
+
+As duas listas são combinadas por Reciprocal Rank Fusion (RRF), que usa só
+as posições e dispensa calibrar BM25 contra cosseno.
+"""
+import heapq
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.knowledge import Knowledge, KnowledgeChunk
+from services.org_cache import ChunkSyncedCache
+
+logger = logging.getLogger(__name__)
+
+# Parâmetros clássicos do Okapi BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Constante do RRF (Cormack et al.): 1 / (k + posição)
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Stopwords do português (já sem acento)
+STOPWORDS = frozenset("""
+a ao aos as ate com como da das de dela dele deles do dos e ela elas ele eles
+em entre era essa esse esta estao este eu foi for ha isso isto ja la lhe mais
+mas me mesmo meu minha muito na nao nas nem no nos nossa nosso num numa o os
+ou para pela pelas pelo pelos por qual quando que quem se sem ser seu seus so
+sua suas tambem te tem tu um uma umas uns voce voces vos
+""".split())
+
+
+def fold_accents(text: str) -> str:
+    """
+    Minúsculas sem acentos ("Ação" → "acao")
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _reduce_plural(token: str) -> str:
+    if token.isdigit() or len(token) <= 3:
+        return token
+    if token.endswith("oes") and len(token) > 4:
+        return token[:-3] + "ao"
+    if token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Termos do texto para o índice (mesma normalização para query e documentos)
+    """
+    if not text:
+        return []
+
+    return [
+        _reduce_plural(token)
+        for token in _TOKEN_RE.findall(fold_accents(text))
+        if token not in STOPWORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Tuple[int, float]]],
+    k: int = RRF_K
+) -> List[Tuple[int, float]]:
+    """
+    Combinar rankings (listas de (id, score) em ordem decrescente) por RRF
+
+    Returns:
+        Lista de tuplas (id, score RRF) em ordem decrescente de score
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for position, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + position)
+
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def _document_text(title: Optional[str], category: Optional[str], content: Optional[str]) -> str:
+    return " ".join(part for part in (title, category, content) if part)
+
+
+class OrgBM25Index:
+    """
+    Listas invertidas (termo → {documento: frequência}) de uma organização
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_terms: Dict[int, Counter] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.total_length = 0
+
+        # Controle de sincronização com o banco
+        self.max_id = 0
+        self.known_rows = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def add(self, doc_id: int, text: str):
+        """
+        Indexar (ou reindexar) um documento
+        """
+        self.remove(doc_id)
+
+        terms = Counter(tokenize(text))
+        self.doc_terms[doc_id] = terms
+        self.doc_lengths[doc_id] = sum(terms.values())
+        self.total_length += self.doc_lengths[doc_id]
+
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id: int) -> bool:
+        """
+        Tirar um documento do índice; retorna se ele existia
+        """
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return False
+
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+
+        return True
+
+    def top_k(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Retornar os k documentos com maior score BM25 (id, score)
+        """
+        n = len(self.doc_terms)
+        if n == 0 or k <= 0:
+            return []
+
+        avg_length = self.total_length / n or 1.0
+        scores: Dict[int, float] = {}
+
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+
+            df = len(docs)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+            for doc_id, tf in docs.items():
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+class BM25IndexCache(ChunkSyncedCache):
+    """
+    Cache por organização dos índices BM25 da tabela knowledge_chunks
+
+    Mesma sincronização do KnowledgeMatrixCache (ver ChunkSyncedCache): um
+    COUNT/MAX(id) por busca, carga incremental de trechos novos e recarga
+    completa se divergir.
+    """
+
+    label = "Índice BM25"
+
+    def _create(self, key: Any = None) -> OrgBM25Index:
+        return OrgBM25Index()
+
+    async def _load_rows(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        index: OrgBM25Index,
+        after_id: int = 0
+    ) -> int:
+        """
+        Indexar linhas com id > after_id; retorna linhas lidas
+        """
+        stmt = (
+            select(KnowledgeChunk.id, Knowledge.title, Knowledge.category, KnowledgeChunk.content)
+            .join(Knowledge, Knowledge.id == KnowledgeChunk.knowledge_id)
+            .where(
+                KnowledgeChunk.organization_id == organization_id,
+                KnowledgeChunk.id > after_id
+            )
+            .order_by(KnowledgeChunk.id)
+        )
+        result = await session.execute(stmt)
+        rows = result.all()
+
+        for chunk_id, title, category, content in rows:
+            index.add(chunk_id, _document_text(title, category, content))
+
+        return self._track_rows(index, rows)
+
+    def _remove(self, index: OrgBM25Index, chunk_ids: Iterable[int]) -> int:
+        return sum(1 for chunk_id in chunk_ids if index.remove(chunk_id))
+
+    def _describe(self, index: OrgBM25Index) -> str:
+        return f"{len(index)} trechos, {len(index.postings)} termos"
+
+    async def get_index(
+        self,
+        session: AsyncSession,
+        organization_id: int
+    ) -> OrgBM25Index:
+        """
+        Obter o índice da organização, sincronizado com o banco
+        """
+        return await self._get_entry(session, organization_id)
+
+    async def search(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        query: str,
+        top_k: int = 5
+    ) -> List[Tuple[int, float]]:
+        """
+        Buscar os top_k trechos da organização por BM25
+
+        Returns:
+            Lista de tuplas (chunk_id, score) em ordem decrescente de score
+        """
+        if not tokenize(query):
+            return []
+
+        index = await self.get_index(session, organization_id)
+        return index.top_k(query, top_k)
+
+    def add_chunks(
+        self,
+        organization_id: int,
+        title: Optional[str],
+        category: Optional[str],
+        chunks: List[Tuple[int, str]]
+    ):
+        """
+        Registrar trechos recém-inseridos (id, conteúdo) de um documento
+        """
+        index = self._orgs.get(organization_id)
+        if index is None:
+            return
+
+        for chunk_id, content in self._new_chunks(index, chunks):
+            index.add(chunk_id, _document_text(title, category, content))
+
+    def _stats(self) -> Dict[str, Any]:
+        return {
+            "total_chunks": sum(len(i) for i in self._orgs.values()),
+            "total_terms": sum(len(i.postings) for i in self._orgs.values())
+        }
+
+
+# Instância global do serviço
+bm25_index_cache = BM25IndexCache()
@@ -0,0 +1,166 @@
+"""
+Montagem do contexto dos prompts RAG dentro de um orçamento de tokens
+
+Os trechos chegam em ordem de relevância e entram nessa ordem até encher
+RAG_CONTEXT_TOKENS:
+
+- frases já incluídas por um trecho anterior são removidas (sobreposição dos
+  chunks, versões repetidas do mesmo documento);
+- um trecho maior que RAG_PASSAGE_MAX_TOKENS (ou que o espaço restante) é
+  cortado para as frases com mais termos da pergunta, na ordem original;
+- o que não coube é contabilizado em `dropped_tokens`.
+
+Tokens são estimados com o mesmo critério das embeddings (estimate_tokens).
+"""
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from config import settings
+from services.bm25_index_service import fold_accents, tokenize
+from services.embedding_service import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _default_format(title: Optional[str], content: str) -> str:
+    return f"[{title}]\n{content}" if title else content
+
+
+def _sentence_key(sentence: str) -> str:
+    return _WHITESPACE.sub(" ", fold_accents(sentence)).strip(" .!?…")
+
+
+class AssembledContext:
+    """
+    Resultado da montagem: texto final + contabilidade de tokens
+    """
+
+    def __init__(self):
+        self.blocks: List[str] = []
+        self.passages: List[Dict[str, Any]] = []  # trechos usados (na ordem)
+        self.tokens = 0
+        self.input_tokens = 0
+        self.trimmed = 0
+
+    @property
+    def dropped_tokens(self) -> int:
+        return max(self.input_tokens - self.tokens, 0)
+
+    def text(self, separator: str = "\n\n") -> str:
+        return separator.join(self.blocks)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "context_tokens": self.tokens,
+            "dropped_tokens": self.dropped_tokens,
+            "passages_used": len(self.passages),
+            "passages_trimmed": self.trimmed,
+        }
+
+
+class ContextAssembler:
+    """
+    Serviço para montar o contexto dos prompts dentro do orçamento de tokens
+    """
+
+    def __init__(self):
+        self.budget = settings.rag_context_tokens
+        self.passage_max_tokens = settings.rag_passage_max_tokens
+        self.min_tokens = settings.rag_context_min_tokens
+
+    def assemble(
+        self,
+        query: str,
+        passages: List[Dict[str, Any]],
+        budget: Optional[int] = None,
+        formatter: Callable[[Optional[str], str], str] = _default_format
+    ) -> AssembledContext:
+        """
+        Montar o contexto com os trechos (dicts com `content` e `title` opcional)
+
+        Args:
+            query: Pergunta (para escolher as frases mais relevantes ao cortar)
+            passages: Trechos em ordem de relevância
+            budget: Orçamento de tokens (padrão RAG_CONTEXT_TOKENS)
+            formatter: Formata (título, conteúdo) em um bloco do contexto
+        """
+        budget = budget or self.budget
+        query_terms = set(tokenize(query))
+        seen = set()
+        result = AssembledContext()
+
+        for passage in passages:
+            content = passage.get("content") or ""
+            title = passage.get("title")
+            result.input_tokens += estimate_tokens(formatter(title, content))
+
+            remaining = budget - result.tokens
+            if remaining < self.min_tokens:
+                continue
+
+            # Remover frases que já estão no contexto (ou repetidas no próprio trecho)
+            sentences = []
+            keys = set()
+            for sentence in _SENTENCE_RE.split(content):
+                key = _sentence_key(sentence)
+                if key and key not in seen and key not in keys:
+                    keys.add(key)
+                    sentences.append((sentence.strip(), key))
+            if not sentences:
+                continue
+
+            limit = min(self.passage_max_tokens, remaining - estimate_tokens(formatter(title, "")))
+            kept = self._trim(sentences, query_terms, limit)
+            if not kept:
+                continue
+            if len(kept) < len(sentences):
+                result.trimmed += 1
+
+            block = formatter(title, " ".join(sentence for sentence, _ in kept))
+            tokens = estimate_tokens(block)
+            if tokens > remaining:
+                continue
+
+            seen.update(key for _, key in kept)
+            result.blocks.append(block)
+            result.passages.append(passage)
+            result.tokens += tokens
+
+        if result.dropped_tokens:
+            logger.info(
+                f"Contexto: {result.tokens} tokens em {len(result.passages)} trechos, "
+                f"{result.dropped_tokens} tokens descartados (orçamento {budget})"
+            )
+
+        return result
+
+    @staticmethod
+    def _trim(sentences: List[tuple], query_terms: set, limit: int) -> List[tuple]:
+        """
+        Frases que cabem em `limit` tokens, priorizando as com mais termos da pergunta
+        """
+        costs = [estimate_tokens(sentence) + 1 for sentence, _ in sentences]
+        if sum(costs) <= limit:
+            return sentences
+
+        scores = [len(query_terms.intersection(tokenize(sentence))) for sentence, _ in sentences]
+
+        # Mais termos da pergunta primeiro; empate → frase mais próxima do início
+        order = sorted(range(len(sentences)), key=lambda i: (-scores[i], i))
+
+        chosen = []
+        used = 0
+        for i in order:
+            if used + costs[i] <= limit:
+                chosen.append(i)
+                used += costs[i]
+
+        return [sentences[i] for i in sorted(chosen)]
+
+
+# Instância global do serviço
+context_assembler = ContextAssembler()
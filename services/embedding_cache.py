@@ -0,0 +1,429 @@
+"""
+Cache de embeddings por conteúdo (modelo + sha256 do texto normalizado)
+
+Dois níveis:
+1. LRU em memória, limitado por número de entradas
+2. Tabela persistente `embedding_cache` (Postgres ou SQLite)
+
+Os lotes usam get_many / put_many: um SELECT ... IN e um INSERT multi-linha
+por lote, em vez de uma ida ao banco por texto.
+
+A tabela guarda o último uso de cada entrada (last_used_at, atualizado no
+máximo uma vez por TOUCH_INTERVAL); prune() descarta as antigas, o excesso
+acima do teto de linhas e os modelos que nenhuma organização usa mais.
+"""
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from config import settings
+
+logger = logging.getLogger("FT9-EmbeddingCache")
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Chaves por SELECT ... IN / linhas por INSERT
+STORE_BATCH = 500
+
+# Acertos só regravam last_used_at se o valor tiver mais que isso
+TOUCH_INTERVAL = timedelta(days=1)
+
+metadata = sa.MetaData()
+
+embedding_cache_table = sa.Table(
+    "embedding_cache",
+    metadata,
+    sa.Column("model", sa.String(100), primary_key=True),
+    sa.Column("text_hash", sa.String(64), primary_key=True),
+    sa.Column("embedding", sa.LargeBinary, nullable=False),
+    sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    sa.Column("last_used_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+)
+
+# Limpeza por idade / teto de linhas (ordem de uso)
+last_used_index = sa.Index("ix_embedding_cache_last_used", embedding_cache_table.c.last_used_at)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def normalize_text(text: str) -> str:
+    """Normalizar texto para a chave do cache (NFC + espaços colapsados)"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_hash(normalized_text: str) -> str:
+    """sha256 do texto já normalizado"""
+    return hashlib.sha256(normalized_text.encode("utf-8")).hexdigest()
+
+
+def _as_utc(value: datetime) -> datetime:
+    """SQLite devolve datetimes sem fuso (gravados em UTC)"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _default_store_url() -> str:
+    """URL síncrona do banco principal (asyncpg → driver padrão psycopg2)"""
+    return settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+class EmbeddingCacheStore:
+    """
+    Camada persistente do cache (SQLAlchemy síncrono)
+
+    Se o banco não estiver acessível, a camada é desativada e o cache segue
+    apenas em memória.
+    """
+
+    def __init__(self, url: Optional[str] = None):
+        url = url if url is not None else (settings.embedding_cache_url or _default_store_url())
+        self.url = url
+        # No banco principal a tabela vem da migration (alembic); um store
+        # separado (EMBEDDING_CACHE_URL, ex. SQLite local) cria a própria tabela
+        self.managed = url == _default_store_url()
+        self.enabled = bool(url) and url.lower() != "disabled"
+        self._engine = None
+        self._lock = threading.Lock()
+
+    def _get_engine(self):
+        if self._engine is not None or not self.enabled:
+            return self._engine
+
+        with self._lock:
+            if self._engine is not None or not self.enabled:
+                return self._engine
+
+            try:
+                connect_args = {}
+                if self.url.startswith("sqlite"):
+                    db_path = self.url.split("///", 1)[-1]
+                    if db_path and db_path != ":memory:":
+                        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+                    connect_args = {"check_same_thread": False}
+                elif self.url.startswith("postgresql"):
+                    connect_args = {"connect_timeout": 5}
+
+                engine = sa.create_engine(self.url, pool_pre_ping=True, connect_args=connect_args)
+                if not self.managed:
+                    metadata.create_all(engine)
+                    self._add_last_used(engine)
+                elif "last_used_at" not in self._columns(engine):
+                    raise RuntimeError("tabela embedding_cache ausente ou antiga (rode as migrations do alembic)")
+                self._engine = engine
+
+                logger.info("🗄️ Cache persistente de embeddings ativo")
+
+            except Exception as e:
+                logger.warning(f"⚠️ Cache persistente de embeddings desativado: {e}")
+                self.enabled = False
+
+        return self._engine
+
+    @staticmethod
+    def _columns(engine) -> List[str]:
+        inspector = sa.inspect(engine)
+        if not inspector.has_table("embedding_cache"):
+            return []
+        return [column["name"] for column in inspector.get_columns("embedding_cache")]
+
+    def _add_last_used(self, engine):
+        """Store próprio criado antes de last_used_at: coluna + índice (uso = agora)"""
+        if "last_used_at" in self._columns(engine):
+            return
+
+        with engine.begin() as conn:
+            conn.execute(sa.text("ALTER TABLE embedding_cache ADD COLUMN last_used_at TIMESTAMP"))
+            conn.execute(embedding_cache_table.update().values(last_used_at=_utcnow()))
+        last_used_index.create(engine, checkfirst=True)
+
+    def get(self, model: str, key: str) -> Optional[np.ndarray]:
+        return self.get_many(model, [key]).get(key)
+
+    def put(self, model: str, key: str, embedding: np.ndarray):
+        engine = self._get_engine()
+        if engine is None:
+            return
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    embedding_cache_table.insert().values(
+                        model=model,
+                        text_hash=key,
+                        embedding=np.asarray(embedding, dtype="<f4").tobytes(),
+                        last_used_at=_utcnow(),
+                    )
+                )
+        except IntegrityError:
+            # Já gravado por outro worker
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao gravar cache persistente: {e}")
+
+    def get_many(self, model: str, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Buscar várias chaves (um SELECT ... IN por STORE_BATCH chaves)"""
+        engine = self._get_engine()
+        if engine is None or not keys:
+            return {}
+
+        table = embedding_cache_table
+        now = _utcnow()
+        found: Dict[str, np.ndarray] = {}
+        stale: List[str] = []
+        try:
+            with engine.connect() as conn:
+                for start in range(0, len(keys), STORE_BATCH):
+                    rows = conn.execute(
+                        sa.select(table.c.text_hash, table.c.embedding, table.c.last_used_at).where(
+                            table.c.model == model,
+                            table.c.text_hash.in_(keys[start:start + STORE_BATCH]),
+                        )
+                    )
+                    for key, blob, last_used_at in rows:
+                        found[key] = np.frombuffer(blob, dtype="<f4")
+                        if last_used_at is None or _as_utc(last_used_at) < now - TOUCH_INTERVAL:
+                            stale.append(key)
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao ler cache persistente: {e}")
+            return found
+
+        if stale:
+            self._touch(engine, model, stale, now)
+
+        return found
+
+    @staticmethod
+    def _touch(engine, model: str, keys: List[str], now: datetime):
+        """Registrar o uso das entradas (protege da limpeza por idade)"""
+        table = embedding_cache_table
+        try:
+            with engine.begin() as conn:
+                for start in range(0, len(keys), STORE_BATCH):
+                    conn.execute(
+                        table.update()
+                        .where(table.c.model == model, table.c.text_hash.in_(keys[start:start + STORE_BATCH]))
+                        .values(last_used_at=now)
+                    )
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao atualizar uso do cache persistente: {e}")
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, np.ndarray]]):
+        """
+        Gravar várias chaves (um INSERT multi-linha por STORE_BATCH), ignorando
+        as já gravadas por outro worker
+        """
+        engine = self._get_engine()
+        if engine is None:
+            return
+
+        now = _utcnow()
+        rows = [
+            {"model": model, "text_hash": key, "embedding": np.asarray(vec, dtype="<f4").tobytes(),
+             "last_used_at": now}
+            for key, vec in items
+        ]
+        if not rows:
+            return
+
+        dialect = engine.dialect.name
+        if dialect == "postgresql":
+            stmt = postgresql.insert(embedding_cache_table).on_conflict_do_nothing()
+        elif dialect == "sqlite":
+            stmt = sqlite.insert(embedding_cache_table).on_conflict_do_nothing()
+        else:
+            for row in rows:
+                self.put(model, row["text_hash"], np.frombuffer(row["embedding"], dtype="<f4"))
+            return
+
+        try:
+            with engine.begin() as conn:
+                for start in range(0, len(rows), STORE_BATCH):
+                    conn.execute(stmt, rows[start:start + STORE_BATCH])
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao gravar cache persistente: {e}")
+
+    def prune(
+        self,
+        max_age_days: int = 0,
+        max_rows: int = 0,
+        keep_models: Optional[Iterable[str]] = None
+    ) -> int:
+        """
+        Descartar entradas da tabela persistente
+
+        Args:
+            max_age_days: Sem uso há mais que isso (0 = sem limite de idade)
+            max_rows: Teto de linhas; o excesso sai pelo uso mais antigo (0 = sem teto)
+            keep_models: Modelos (chaves de espaço) ainda usados; os demais saem
+
+        Returns:
+            Linhas removidas
+        """
+        engine = self._get_engine()
+        if engine is None:
+            return 0
+
+        table = embedding_cache_table
+        removed = 0
+        try:
+            with engine.begin() as conn:
+                if keep_models is not None:
+                    removed += conn.execute(
+                        table.delete().where(table.c.model.not_in(list(keep_models)))
+                    ).rowcount
+
+                if max_age_days > 0:
+                    removed += conn.execute(
+                        table.delete().where(table.c.last_used_at < _utcnow() - timedelta(days=max_age_days))
+                    ).rowcount
+
+                if max_rows > 0:
+                    # last_used_at da linha max_rows+1 (mais recentes primeiro): dali para trás sai
+                    cutoff = conn.execute(
+                        sa.select(table.c.last_used_at)
+                        .order_by(table.c.last_used_at.desc())
+                        .offset(max_rows)
+                        .limit(1)
+                    ).scalar_one_or_none()
+                    if cutoff is not None:
+                        removed += conn.execute(
+                            table.delete().where(table.c.last_used_at <= cutoff)
+                        ).rowcount
+        except Exception as e:
+            logger.warning(f"⚠️ Falha na limpeza do cache persistente: {e}")
+            return removed
+
+        if removed:
+            logger.info(f"🧹 Cache persistente de embeddings: {removed} entradas removidas")
+
+        return removed
+
+
+class EmbeddingCache:
+    """
+    LRU em memória na frente da tabela persistente, com contadores de hit/miss
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        store: Optional[EmbeddingCacheStore] = None
+    ):
+        self.max_entries = max_entries if max_entries is not None else settings.embedding_cache_size
+        self.store = store if store is not None else EmbeddingCacheStore()
+        self._lru: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def _remember(self, cache_key: Tuple[str, str], vec: np.ndarray):
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._lru[cache_key] = vec
+            self._lru.move_to_end(cache_key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    def get(self, model: str, normalized_text: str) -> Optional[List[float]]:
+        """Buscar embedding no cache (memória → persistente)"""
+        cache_key = (model, text_hash(normalized_text))
+
+        with self._lock:
+            vec = self._lru.get(cache_key)
+            if vec is not None:
+                self._lru.move_to_end(cache_key)
+                self.memory_hits += 1
+                return vec.tolist()
+
+        vec = self.store.get(*cache_key)
+        if vec is not None:
+            self._remember(cache_key, vec)
+            with self._lock:
+                self.persistent_hits += 1
+            return vec.tolist()
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model: str, normalized_text: str, embedding: List[float]):
+        """Gravar embedding nos dois níveis"""
+        cache_key = (model, text_hash(normalized_text))
+        vec = np.asarray(embedding, dtype=np.float32)
+
+        self._remember(cache_key, vec)
+        self.store.put(*cache_key, vec)
+
+    def get_many(self, model: str, normalized_texts: List[str]) -> Dict[str, List[float]]:
+        """
+        Buscar vários textos de uma vez (memória → uma consulta ao persistente)
+
+        Returns:
+            texto normalizado → embedding, só para os encontrados
+        """
+        hashes = {normalized: text_hash(normalized) for normalized in normalized_texts}
+        found: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+
+        with self._lock:
+            for normalized, key in hashes.items():
+                vec = self._lru.get((model, key))
+                if vec is None:
+                    missing[key] = normalized
+                    continue
+                self._lru.move_to_end((model, key))
+                found[normalized] = vec.tolist()
+            self.memory_hits += len(found)
+
+        stored = self.store.get_many(model, list(missing))
+        for key, vec in stored.items():
+            self._remember((model, key), vec)
+            found[missing[key]] = vec.tolist()
+
+        with self._lock:
+            self.persistent_hits += len(stored)
+            self.misses += len(missing) - len(stored)
+
+        return found
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, List[float]]]):
+        """Gravar vários (texto normalizado, embedding) nos dois níveis"""
+        entries = []
+        for normalized, embedding in items:
+            key = text_hash(normalized)
+            vec = np.asarray(embedding, dtype=np.float32)
+            self._remember((model, key), vec)
+            entries.append((key, vec))
+
+        self.store.put_many(model, entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores de hit/miss e ocupação"""
+        with self._lock:
+            lookups = self.memory_hits + self.persistent_hits + self.misses
+            hits = self.memory_hits + self.persistent_hits
+            return {
+                "memory_hits": self.memory_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._lru),
+                "max_entries": self.max_entries,
+                "persistent_enabled": self.store.enabled,
+            }
@@ -0,0 +1,257 @@
+"""
+Embeddings com dimensão reduzida (parâmetro `dimensions` da API ou PCA por organização)
+
+Armazenamento, RAM da matriz e custo do produto matriz-vetor caem na mesma
+proporção da dimensão. A redução é sempre um espaço de embeddings próprio
+(EmbeddingSpace), usado igualmente por trechos e consultas e adotado via
+re-embedding (embedding_version_service):
+
+- text-embedding-3-*: a API devolve direto a dimensão pedida;
+- demais modelos (ada-002): projeção PCA ajustada nos vetores da própria
+  organização e guardada em knowledge_embedding_projections.
+
+dimension_report compara, sobre os vetores do espaço ativo, o top-k exato na
+dimensão cheia com o top-k em cada dimensão candidata (recall@k), para
+justificar o tamanho escolhido. Para os text-embedding-3 a redução é simulada
+truncando e renormalizando (equivalente ao `dimensions` da API).
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from models.knowledge import KnowledgeChunk, KnowledgeEmbeddingProjection
+from services.embedding_service import (
+    API_DIMENSION_MODELS, NATIVE_DIMENSIONS, EmbeddingSpace,
+    decode_embedding, embedding_service, encode_embedding, project_vectors
+)
+from services.embedding_version_service import embedding_version_service, in_space
+from services.knowledge_index_service import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+
+def fit_pca(vectors: np.ndarray, dimensions: int) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Ajustar PCA com `dimensions` componentes
+
+    Returns:
+        (média, componentes k x D, fração da variância mantida)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    mean = vectors.mean(axis=0)
+    _, singular, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+
+    variance = singular ** 2
+    explained = float(variance[:dimensions].sum() / variance.sum()) if variance.sum() else 0.0
+
+    return mean, np.ascontiguousarray(vt[:dimensions], dtype=np.float32), explained
+
+
+def recall_at_k(full: np.ndarray, reduced: np.ndarray, k: int, n_queries: int, seed: int = 0) -> float:
+    """
+    Recall@k do top-k (cosseno) em `reduced` contra o top-k exato em `full`
+
+    As queries são uma amostra dos próprios vetores; o vetor da query não
+    conta como vizinho.
+    """
+    n = full.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        return 1.0
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(n, min(n_queries, n), replace=False)
+
+    def top_k(matrix: np.ndarray) -> np.ndarray:
+        matrix = normalize_rows(matrix)
+        scores = matrix[sample] @ matrix.T
+        scores[np.arange(len(sample)), sample] = -np.inf
+        return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+    truth = top_k(full)
+    found = top_k(reduced)
+
+    hits = sum(len(np.intersect1d(t, f, assume_unique=True)) for t, f in zip(truth, found))
+    return hits / (len(sample) * k)
+
+
+class EmbeddingReductionService:
+    """
+    Serviço para espaços de dimensão reduzida (PCA) e comparação recall@k
+    """
+
+    def __init__(self):
+        self.pca_sample = settings.embedding_pca_sample
+        self.recall_dimensions = settings.embedding_recall_dimensions
+        self.recall_target = settings.embedding_recall_target
+
+    async def _active_vectors(
+        self,
+        session: AsyncSession,
+        organization_id: int
+    ) -> Tuple[EmbeddingSpace, np.ndarray]:
+        """Espaço ativo + vetores (N x D) dos trechos da organização nesse espaço"""
+        space = await embedding_version_service.get_space(session, organization_id)
+        rows = (await session.execute(
+            select(KnowledgeChunk.embedding_vec)
+            .where(KnowledgeChunk.organization_id == organization_id, in_space(space))
+            .order_by(KnowledgeChunk.id)
+        )).scalars().all()
+
+        vectors = (
+            np.vstack([decode_embedding(raw) for raw in rows])
+            if rows else np.empty((0, space.dimensions), dtype=np.float32)
+        )
+        return space, vectors
+
+    def _sample(self, vectors: np.ndarray) -> np.ndarray:
+        if vectors.shape[0] <= self.pca_sample:
+            return vectors
+        rng = np.random.default_rng(0)
+        return vectors[rng.choice(vectors.shape[0], self.pca_sample, replace=False)]
+
+    async def target_space(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        model: str,
+        dimensions: Optional[int] = None
+    ) -> EmbeddingSpace:
+        """
+        Espaço alvo de um re-embedding para (modelo, dimensão)
+
+        Dimensão nativa ou text-embedding-3 → API; abaixo da nativa nos demais
+        modelos → ajusta uma projeção PCA nos vetores ativos (mesmo modelo).
+        """
+        native = NATIVE_DIMENSIONS.get(model)
+        dimensions = dimensions or native
+        if not dimensions:
+            raise ValueError(f"Informe `dimensions` para o modelo {model}")
+        if native and dimensions > native:
+            raise ValueError(f"{model} tem no máximo {native} dimensões")
+
+        if dimensions == native or model in API_DIMENSION_MODELS:
+            return EmbeddingSpace(model, dimensions)
+
+        projection = await self.fit_projection(session, organization_id, model, dimensions)
+        return EmbeddingSpace(model, dimensions, projection=projection.id)
+
+    async def fit_projection(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        model: str,
+        dimensions: int
+    ) -> KnowledgeEmbeddingProjection:
+        """
+        Ajustar e guardar a projeção PCA da organização (commit incluído)
+
+        O ajuste usa os vetores do espaço ativo, que precisa ser `model` na
+        dimensão nativa (sem projeção).
+        """
+        space, vectors = await self._active_vectors(session, organization_id)
+        if space.model != model or space.projection or not space.native:
+            raise ValueError(
+                f"PCA de {model} precisa do espaço ativo {model} na dimensão nativa "
+                f"(atual: {space.tag}, {space.dimensions}d)"
+            )
+
+        sample = self._sample(vectors)
+        if sample.shape[0] < dimensions:
+            raise ValueError(
+                f"Trechos insuficientes para PCA com {dimensions} dimensões ({sample.shape[0]} vetores)"
+            )
+
+        mean, components, explained = await asyncio.to_thread(fit_pca, sample, dimensions)
+
+        projection = KnowledgeEmbeddingProjection(
+            organization_id=organization_id,
+            model=model,
+            source_dimensions=space.dimensions,
+            dimensions=dimensions,
+            mean=encode_embedding(mean),
+            components=encode_embedding(components.ravel()),
+            explained_variance=explained,
+            sample_size=int(sample.shape[0])
+        )
+        session.add(projection)
+        await session.commit()
+        await session.refresh(projection)
+
+        embedding_service.register_projection(projection.id, mean, components)
+
+        logger.info(
+            f"Projeção PCA {projection.id} da org {organization_id}: {space.dimensions} → {dimensions} "
+            f"dimensões ({explained:.1%} da variância, {sample.shape[0]} vetores)"
+        )
+
+        return projection
+
+    async def dimension_report(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        dimensions: Optional[List[int]] = None,
+        k: int = 10,
+        n_queries: int = 200
+    ) -> Dict[str, Any]:
+        """
+        Recall@k de cada dimensão candidata contra o espaço ativo completo
+        """
+        space, vectors = await self._active_vectors(session, organization_id)
+        source_dimensions = vectors.shape[1] if len(vectors) else space.dimensions
+        candidates = sorted(d for d in (dimensions or self.recall_dimensions) if 0 < d < source_dimensions)
+
+        report = {
+            "model": space.tag,
+            "dimensions": source_dimensions,
+            "vectors": int(vectors.shape[0]),
+            "k": k,
+            "queries": int(min(n_queries, vectors.shape[0])),
+            "bytes_per_vector": 4 * source_dimensions,
+            "candidates": [],
+            "recommended_dimensions": None,
+        }
+        if vectors.shape[0] < 2:
+            return report
+
+        truncate = space.model in API_DIMENSION_MODELS and not space.projection
+        sample = None if truncate else self._sample(vectors)
+
+        for target in candidates:
+            entry = {
+                "dimensions": target,
+                "method": "api" if truncate else "pca",
+                "bytes_per_vector": 4 * target,
+                "memory_ratio": round(target / source_dimensions, 4),
+            }
+
+            if truncate:
+                reduced = vectors[:, :target]
+            elif sample.shape[0] < target:
+                entry["error"] = f"amostra de {sample.shape[0]} vetores < {target} componentes"
+                report["candidates"].append(entry)
+                continue
+            else:
+                mean, components, explained = await asyncio.to_thread(fit_pca, sample, target)
+                reduced = project_vectors(vectors, mean, components)
+                entry["explained_variance"] = round(explained, 4)
+
+            entry["recall_at_k"] = round(
+                await asyncio.to_thread(recall_at_k, vectors, reduced, k, n_queries), 4
+            )
+            report["candidates"].append(entry)
+
+            if report["recommended_dimensions"] is None and entry["recall_at_k"] >= self.recall_target:
+                report["recommended_dimensions"] = target
+
+        return report
+
+
+# Instância global do serviço
+embedding_reduction_service = EmbeddingReductionService()
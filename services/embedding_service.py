@@ -4,32 +4,302 @@ Versão final – AI9
 """
 
 import os
+import time
+import asyncio
 import logging
+import httpx
 import requests
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 import numpy as np
 from config import settings
+from services.embedding_cache import EmbeddingCache, normalize_text
 
 logger = logging.getLogger("FT9-EmbeddingService")
 
+# Formato binário das embeddings no banco: float32 little-endian (bytea)
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+# Dimensão nativa de cada modelo (os text-embedding-3 aceitam `dimensions` menor)
+NATIVE_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+
+# Modelos que aceitam `dimensions` na API (saída reduzida direto na geração)
+API_DIMENSION_MODELS = ("text-embedding-3-small", "text-embedding-3-large")
+
+
+class EmbeddingSpace(NamedTuple):
+    """
+    Modelo + dimensão que produziram um vetor
+
+    Vetores de espaços diferentes não são comparáveis; `version` identifica a
+    troca de espaço da organização (ver embedding_version_service).
+
+    Dimensão abaixo da nativa: parâmetro `dimensions` da API (text-embedding-3)
+    ou projeção PCA ajustada para a organização (`projection` = id da projeção,
+    aplicada igualmente a trechos e consultas).
+    """
+    model: str
+    dimensions: int
+    version: int = 0
+    projection: int = 0
+
+    @property
+    def native(self) -> bool:
+        return NATIVE_DIMENSIONS.get(self.model) == self.dimensions
+
+    @property
+    def tag(self) -> str:
+        """Modelo gravado junto de cada vetor (inclui a projeção)"""
+        return f"{self.model}+pca{self.projection}" if self.projection else self.model
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        """Identidade do espaço, sem a versão"""
+        return self.tag, self.dimensions
+
+    @property
+    def base(self) -> "EmbeddingSpace":
+        """Espaço pedido à API (antes da projeção)"""
+        if not self.projection:
+            return self
+        return EmbeddingSpace(self.model, NATIVE_DIMENSIONS.get(self.model, self.dimensions))
+
+    @property
+    def cache_key(self) -> str:
+        """Chave do cache de embeddings (só o modelo quando a dimensão é a nativa)"""
+        return self.model if self.native else f"{self.model}@{self.dimensions}"
+
+    def matches(self, tag: Optional[str], dimensions: Optional[int]) -> bool:
+        return (tag, dimensions) == self.key
+
+
+def project_vectors(vectors: np.ndarray, mean: np.ndarray, components: np.ndarray) -> np.ndarray:
+    """Projeção PCA: (X - média) @ componentesᵀ → (N x k)"""
+    return (np.asarray(vectors, dtype=np.float32) - mean) @ components.T
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa conservadora de tokens (~3 caracteres por token em português)"""
+    return len(text) // 3 + 1
+
+
+def encode_embedding(embedding: Optional[List[float]]) -> Optional[bytes]:
+    """Serializar embedding para bytes float32 little-endian"""
+    if embedding is None:
+        return None
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embedding(blob: Union[bytes, bytearray, memoryview, None]) -> Optional[np.ndarray]:
+    """Ler embedding binária sem cópia (array somente leitura sobre o buffer)"""
+    if blob is None:
+        return None
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
 
 class EmbeddingService:
     """
     Serviço para gerar embeddings vetoriais usando OpenAI API
-    Modelo: text-embedding-ada-002 (1536 dimensões)
+    Modelo padrão: EMBEDDING_MODEL (text-embedding-ada-002, 1536 dimensões);
+    todos os métodos aceitam outro `space` (modelo + dimensão).
+
+    API síncrona (requests) para scripts; API assíncrona (prefixo `a`) sobre
+    um httpx.AsyncClient compartilhado, com keep-alive e HTTP/2.
     """
 
     def __init__(self):
         self.api_key = settings.OPENAI_API_KEY
-        self.model = "text-embedding-ada-002"
+        self.model = settings.embedding_model
         self.api_url = "https://api.openai.com/v1/embeddings"
-        self.dimensions = 1536
+        self.dimensions = settings.embedding_dimensions or NATIVE_DIMENSIONS.get(self.model, 1536)
+        self.cache = EmbeddingCache()
+
+        # Lotes: limite de inputs e de tokens por requisição, lotes simultâneos
+        self.batch_size = settings.embedding_batch_size
+        self.batch_tokens = settings.embedding_batch_tokens
+        self.concurrency = settings.embedding_concurrency
+        self.max_retries = settings.embedding_max_retries
+
+        # Cliente HTTP assíncrono (criado sob demanda, um por event loop)
+        self.timeout = settings.embedding_http_timeout
+        self.http_limits = httpx.Limits(
+            max_connections=settings.embedding_http_max_connections,
+            max_keepalive_connections=settings.embedding_http_max_keepalive,
+            keepalive_expiry=settings.embedding_http_keepalive_expiry,
+        )
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Projeções PCA carregadas (id → (média, componentes)); ver register_projection
+        self._projections: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
 
         if not self.api_key:
             logger.warning("⚠️ OPENAI_API_KEY não configurada. Embeddings não funcionarão.")
 
-    def generate_embedding(self, text: str) -> Optional[List[float]]:
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+    @property
+    def default_space(self) -> EmbeddingSpace:
+        return EmbeddingSpace(self.model, self.dimensions)
+
+    # ------------------------------------------------------------------
+    # Projeções PCA (dimensão reduzida para modelos sem `dimensions`)
+    # ------------------------------------------------------------------
+
+    def register_projection(self, projection_id: int, mean: np.ndarray, components: np.ndarray):
+        self._projections[projection_id] = (
+            np.asarray(mean, dtype=np.float32),
+            np.ascontiguousarray(components, dtype=np.float32),
+        )
+
+    def has_projection(self, projection_id: int) -> bool:
+        return projection_id in self._projections
+
+    def project(
+        self,
+        embeddings: List[Optional[List[float]]],
+        space: EmbeddingSpace
+    ) -> List[Optional[List[float]]]:
+        """Aplicar a projeção do espaço às embeddings do espaço base (None continua None)"""
+        if space.projection not in self._projections:
+            raise RuntimeError(f"Projeção {space.projection} não carregada")
+
+        positions = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        if not positions:
+            return embeddings
+
+        mean, components = self._projections[space.projection]
+        projected = project_vectors([embeddings[i] for i in positions], mean, components)
+
+        results = list(embeddings)
+        for i, vec in zip(positions, projected):
+            results[i] = vec.tolist()
+        return results
+
+    @staticmethod
+    def _payload(inputs: List[str], space: EmbeddingSpace) -> dict:
+        payload = {"model": space.model, "input": inputs}
+        if not space.native:
+            payload["dimensions"] = space.dimensions
+        return payload
+
+    @staticmethod
+    def _parse_response(data: dict) -> List[List[float]]:
+        items = sorted(data["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in items]
+
+    # ------------------------------------------------------------------
+    # Preparação de lotes (comum às APIs síncrona e assíncrona)
+    # ------------------------------------------------------------------
+
+    def _make_batches(self, texts: List[str]) -> List[List[str]]:
+        """Agrupar textos em lotes limitados por quantidade e por tokens"""
+        batches = []
+        current = []
+        current_tokens = 0
+
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if current and (
+                len(current) >= self.batch_size
+                or current_tokens + tokens > self.batch_tokens
+            ):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+
+            current.append(text)
+            current_tokens += tokens
+
+        if current:
+            batches.append(current)
+
+        return batches
+
+    def _prepare_batches(
+        self,
+        texts: List[str],
+        results: List[Optional[List[float]]],
+        space: EmbeddingSpace
+    ) -> Tuple[Dict[str, List[int]], List[List[str]]]:
+        """
+        Preencher `results` com o que estiver no cache e montar os lotes do resto
+
+        Returns:
+            (texto normalizado → posições na entrada, lotes pendentes)
+        """
+        # Textos repetidos viram um único input
+        positions: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            if not text or not text.strip():
+                continue
+            positions.setdefault(normalize_text(text), []).append(i)
+
+        cached = self.cache.get_many(space.cache_key, list(positions))
+
+        pending = []
+        for normalized, idxs in positions.items():
+            embedding = cached.get(normalized)
+            if embedding is None:
+                pending.append(normalized)
+                continue
+            for i in idxs:
+                results[i] = embedding
+
+        batches = self._make_batches(pending)
+
+        logger.info(
+            f"🔄 Gerando {len(pending)} embeddings em {len(batches)} lotes "
+            f"({len(texts) - len(pending)} do cache ou vazios)"
+        )
+
+        return positions, batches
+
+    def _store_batch(
+        self,
+        batch: List[str],
+        embeddings: List[List[float]],
+        positions: Dict[str, List[int]],
+        results: List[Optional[List[float]]],
+        space: EmbeddingSpace
+    ):
+        self.cache.put_many(space.cache_key, zip(batch, embeddings))
+        for normalized, embedding in zip(batch, embeddings):
+            for i in positions[normalized]:
+                results[i] = embedding
+
+    # ------------------------------------------------------------------
+    # API síncrona (scripts)
+    # ------------------------------------------------------------------
+
+    def _request_embeddings(self, inputs: List[str], space: EmbeddingSpace) -> List[List[float]]:
+        """Uma requisição à API para uma lista de textos (ordem preservada)"""
+        response = requests.post(
+            self.api_url,
+            headers=self._headers(),
+            json=self._payload(inputs, space),
+            timeout=self.timeout,
+        )
+
+        response.raise_for_status()
+
+        return self._parse_response(response.json())
+
+    def generate_embedding(self, text: str, space: Optional[EmbeddingSpace] = None) -> Optional[List[float]]:
         """Gerar embedding para um texto"""
+        space = space or self.default_space
+        if space.projection:
+            return self.project([self.generate_embedding(text, space.base)], space)[0]
+
         if not self.api_key:
             logger.error("❌ OPENAI_API_KEY não configurada")
             return None
@@ -38,29 +308,179 @@ class EmbeddingService:
             logger.error("❌ Texto vazio fornecido")
             return None
 
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            }
+        normalized = normalize_text(text)
 
-            payload = {
-                "model": self.model,
-                "input": text.strip(),
-            }
+        cached = self.cache.get(space.cache_key, normalized)
+        if cached is not None:
+            return cached
 
+        try:
             logger.info(f"🔄 Gerando embedding ({len(text)} chars)...")
 
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=30,
+            embedding = self._request_embeddings([normalized], space)[0]
+
+            self.cache.put(space.cache_key, normalized, embedding)
+
+            return embedding
+
+        except Exception as e:
+            logger.error(f"❌ Erro ao gerar embedding: {e}")
+            return None
+
+    def generate_embeddings(
+        self,
+        texts: List[str],
+        space: Optional[EmbeddingSpace] = None
+    ) -> List[Optional[List[float]]]:
+        """
+        Gerar embeddings para vários textos
+
+        Usa o cache, agrupa os textos restantes em lotes do tamanho da API,
+        envia até `concurrency` lotes em paralelo e repete apenas os lotes que
+        falharam. A saída segue a ordem da entrada (None para texto vazio ou
+        lote que falhou em todas as tentativas).
+        """
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        space = space or self.default_space
+        if space.projection:
+            return self.project(self.generate_embeddings(texts, space.base), space)
+
+        if not self.api_key:
+            logger.error("❌ OPENAI_API_KEY não configurada")
+            return results
+
+        positions, batches = self._prepare_batches(texts, results, space)
+
+        for attempt in range(self.max_retries + 1):
+            if not batches:
+                break
+
+            if attempt:
+                time.sleep(min(2 ** attempt, 30))
+                logger.warning(f"🔁 Repetindo {len(batches)} lotes (tentativa {attempt + 1})")
+
+            failed = []
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = {
+                    pool.submit(self._request_embeddings, batch, space): batch
+                    for batch in batches
+                }
+
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    try:
+                        embeddings = future.result()
+                    except Exception as e:
+                        logger.error(f"❌ Erro no lote de {len(batch)} embeddings: {e}")
+                        failed.append(batch)
+                        continue
+
+                    self._store_batch(batch, embeddings, positions, results, space)
+
+            batches = failed
+
+        if batches:
+            logger.error(f"❌ {sum(len(b) for b in batches)} embeddings não gerados após {self.max_retries} tentativas")
+
+        return results
+
+    # ------------------------------------------------------------------
+    # API assíncrona (rotas FastAPI) — não bloqueia o event loop
+    # ------------------------------------------------------------------
+
+    async def _get_async_client(self) -> httpx.AsyncClient:
+        """
+        Cliente compartilhado; recriado se fechado ou se o event loop mudou
+
+        O cliente do loop anterior é fechado antes de ser substituído (ex.: um
+        asyncio.run por chamada nos scripts), para não vazar o pool de conexões.
+        """
+        loop = asyncio.get_running_loop()
+
+        if (
+            self._async_client is None
+            or self._async_client.is_closed
+            or self._async_client_loop is not loop
+        ):
+            if self._async_client is not None and not self._async_client.is_closed:
+                await self._close_stale_client(self._async_client, self._async_client_loop)
+
+            self._async_client = httpx.AsyncClient(
+                http2=True,
+                limits=self.http_limits,
+                timeout=httpx.Timeout(self.timeout),
+                headers=self._headers(),
             )
+            self._async_client_loop = loop
+
+        return self._async_client
+
+    @staticmethod
+    async def _close_stale_client(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]):
+        """Fechar o cliente de outro event loop (vivo em outra thread, ou já encerrado)"""
+        try:
+            if loop is not None and loop.is_running() and not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+            else:
+                # Os sockets são fechados mesmo com o loop antigo encerrado;
+                # só o aviso final ao loop morto falha
+                await client.aclose()
+        except RuntimeError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Erro ao fechar cliente HTTP anterior: {e}")
+
+    async def _arequest_embeddings(
+        self,
+        inputs: List[str],
+        space: EmbeddingSpace,
+        timeout: Optional[float] = None
+    ) -> List[List[float]]:
+        """Versão assíncrona de _request_embeddings (timeout por chamada opcional)"""
+        client = await self._get_async_client()
+
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        response = await client.post(self.api_url, json=self._payload(inputs, space), **kwargs)
+        response.raise_for_status()
+
+        return self._parse_response(response.json())
 
-            response.raise_for_status()
-            data = response.json()
-            embedding = data["data"][0]["embedding"]
+    async def agenerate_embedding(
+        self,
+        text: str,
+        timeout: Optional[float] = None,
+        space: Optional[EmbeddingSpace] = None
+    ) -> Optional[List[float]]:
+        """Gerar embedding para um texto (assíncrono)"""
+        space = space or self.default_space
+        if space.projection:
+            embedding = await self.agenerate_embedding(text, timeout=timeout, space=space.base)
+            return self.project([embedding], space)[0]
+        if not self.api_key:
+            logger.error("❌ OPENAI_API_KEY não configurada")
+            return None
+
+        if not text or not text.strip():
+            logger.error("❌ Texto vazio fornecido")
+            return None
+
+        normalized = normalize_text(text)
+
+        # Cache persistente faz I/O síncrono → thread
+        cached = await asyncio.to_thread(self.cache.get, space.cache_key, normalized)
+        if cached is not None:
+            return cached
+
+        try:
+            logger.info(f"🔄 Gerando embedding ({len(text)} chars)...")
+
+            embeddings = await self._arequest_embeddings([normalized], space, timeout=timeout)
+            embedding = embeddings[0]
+
+            await asyncio.to_thread(self.cache.put, space.cache_key, normalized, embedding)
 
             return embedding
 
@@ -68,11 +488,75 @@ class EmbeddingService:
             logger.error(f"❌ Erro ao gerar embedding: {e}")
             return None
 
+    async def agenerate_embeddings(
+        self,
+        texts: List[str],
+        timeout: Optional[float] = None,
+        space: Optional[EmbeddingSpace] = None
+    ) -> List[Optional[List[float]]]:
+        """
+        Versão assíncrona de generate_embeddings (semáforo limita lotes simultâneos)
+        """
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        space = space or self.default_space
+        if space.projection:
+            embeddings = await self.agenerate_embeddings(texts, timeout=timeout, space=space.base)
+            return self.project(embeddings, space)
+
+        if not self.api_key:
+            logger.error("❌ OPENAI_API_KEY não configurada")
+            return results
+
+        positions, batches = await asyncio.to_thread(self._prepare_batches, texts, results, space)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_batch(batch: List[str]) -> Optional[List[str]]:
+            async with semaphore:
+                try:
+                    embeddings = await self._arequest_embeddings(batch, space, timeout=timeout)
+                except Exception as e:
+                    logger.error(f"❌ Erro no lote de {len(batch)} embeddings: {e}")
+                    return batch
+
+            await asyncio.to_thread(self._store_batch, batch, embeddings, positions, results, space)
+            return None
+
+        for attempt in range(self.max_retries + 1):
+            if not batches:
+                break
+
+            if attempt:
+                await asyncio.sleep(min(2 ** attempt, 30))
+                logger.warning(f"🔁 Repetindo {len(batches)} lotes (tentativa {attempt + 1})")
+
+            outcomes = await asyncio.gather(*(run_batch(batch) for batch in batches))
+            batches = [batch for batch in outcomes if batch is not None]
+
+        if batches:
+            logger.error(f"❌ {sum(len(b) for b in batches)} embeddings não gerados após {self.max_retries} tentativas")
+
+        return results
+
+    async def aclose(self):
+        """Fechar o cliente HTTP assíncrono (shutdown da aplicação)"""
+        if self._async_client is not None and not self._async_client.is_closed:
+            await self._async_client.aclose()
+        self._async_client = None
+        self._async_client_loop = None
+
+    def get_cache_stats(self) -> dict:
+        """Estatísticas do cache de embeddings (hits/misses)"""
+        return self.cache.get_stats()
+
 
 # Instância global – ESSENCIAL para não quebrar imports
 embedding_service = EmbeddingService()
 
 
-# Função auxiliar de compatibilidade
-async def generate_embedding(text: str):
-    return embedding_service.generate_embedding(text)
+# Funções auxiliares de compatibilidade (assíncronas de verdade)
+async def generate_embedding(text: str, timeout: Optional[float] = None, space: Optional[EmbeddingSpace] = None):
+    return await embedding_service.agenerate_embedding(text, timeout=timeout, space=space)
+
+
+async def generate_embeddings(texts: List[str], timeout: Optional[float] = None, space: Optional[EmbeddingSpace] = None):
+    return await embedding_service.agenerate_embeddings(texts, timeout=timeout, space=space)
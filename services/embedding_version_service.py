@@ -0,0 +1,481 @@
+"""
+Embeddings versionadas por organização e re-embedding sem downtime
+
+Cada trecho guarda o espaço (modelo + dimensão) que gerou o seu vetor, e cada
+organização tem um espaço ativo em knowledge_embedding_versions: consultas e
+trechos novos usam esse espaço e a matriz de busca só carrega vetores dele.
+
+Troca de modelo (start_reembed → run):
+
+1. o status da organização vira `reembedding` com o espaço alvo;
+2. os trechos recebem a embedding do alvo em shadow_embedding_vec, em lotes de
+   EMBEDDING_REEMBED_BATCH — a busca continua na embedding_vec;
+3. com 100% de cobertura, numa transação (com a linha da versão travada):
+   shadow → embedding_vec, espaço ativo = alvo, version + 1. Os workers veem a
+   nova versão na próxima busca e recarregam a matriz.
+
+O progresso fica no próprio banco (trechos com a sombra no alvo), então um
+re-embedding interrompido continua de onde parou ao ser iniciado de novo.
+
+Quando o alvo é uma projeção PCA do espaço ativo (mesmo modelo, dimensão
+reduzida), a sombra é calculada dos vetores já gravados, sem chamar a API.
+
+Depois de uma troca, o cache persistente de embeddings perde os modelos que
+nenhuma organização usa mais; a mesma limpeza (mais idade / teto de linhas)
+roda periodicamente a cada EMBEDDING_CACHE_PRUNE_INTERVAL segundos.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import and_, func, not_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database.database import AsyncSessionLocal
+from models.knowledge import KnowledgeChunk, KnowledgeEmbeddingProjection, KnowledgeEmbeddingVersion
+from services.embedding_service import EmbeddingSpace, decode_embedding, embedding_service, encode_embedding
+
+logger = logging.getLogger(__name__)
+
+MAX_PASSES = 3  # passagens pelos trechos que falharam antes de desistir
+
+
+def in_space(space: EmbeddingSpace):
+    """Filtro SQL: trecho com embedding do espaço"""
+    return and_(
+        KnowledgeChunk.embedding_vec.isnot(None),
+        KnowledgeChunk.embedding_model == space.tag,
+        KnowledgeChunk.embedding_dim == space.dimensions,
+    )
+
+
+def shadow_in_space(space: EmbeddingSpace):
+    """Filtro SQL: trecho com a sombra já no espaço alvo"""
+    return and_(
+        KnowledgeChunk.shadow_embedding_vec.isnot(None),
+        KnowledgeChunk.shadow_embedding_model == space.tag,
+        KnowledgeChunk.shadow_embedding_dim == space.dimensions,
+    )
+
+
+def _active_space(row: KnowledgeEmbeddingVersion) -> EmbeddingSpace:
+    return EmbeddingSpace(row.model, row.dimensions, row.version, row.projection_id or 0)
+
+
+def _target_space(row: KnowledgeEmbeddingVersion) -> EmbeddingSpace:
+    return EmbeddingSpace(row.target_model, row.target_dimensions, projection=row.target_projection_id or 0)
+
+
+class EmbeddingVersionService:
+    """
+    Serviço para o espaço de embeddings das organizações e o re-embedding
+    """
+
+    def __init__(self):
+        self.batch_size = settings.embedding_reembed_batch
+        self.cache_max_age_days = settings.embedding_cache_max_age_days
+        self.cache_max_rows = settings.embedding_cache_max_rows
+        self.cache_prune_interval = settings.embedding_cache_prune_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._prune_task: Optional[asyncio.Task] = None
+
+    async def get_space(self, session: AsyncSession, organization_id: int) -> EmbeddingSpace:
+        """
+        Espaço ativo da organização (o padrão, version 0, se nunca registrado)
+        """
+        row = (await session.execute(
+            select(KnowledgeEmbeddingVersion.model, KnowledgeEmbeddingVersion.dimensions,
+                   KnowledgeEmbeddingVersion.version, KnowledgeEmbeddingVersion.projection_id)
+            .where(KnowledgeEmbeddingVersion.organization_id == organization_id)
+        )).one_or_none()
+
+        if row is None:
+            return embedding_service.default_space
+
+        model, dimensions, version, projection_id = row
+        space = EmbeddingSpace(model, dimensions, version, projection_id or 0)
+        await self.ensure_projection(session, space)
+        return space
+
+    async def ensure_projection(self, session: AsyncSession, space: EmbeddingSpace):
+        """
+        Carregar no embedding_service a projeção PCA do espaço (se houver)
+        """
+        if not space.projection or embedding_service.has_projection(space.projection):
+            return
+
+        projection = await session.get(KnowledgeEmbeddingProjection, space.projection)
+        if projection is None:
+            raise RuntimeError(f"Projeção {space.projection} não encontrada")
+
+        embedding_service.register_projection(
+            projection.id,
+            decode_embedding(projection.mean),
+            decode_embedding(projection.components).reshape(projection.dimensions, projection.source_dimensions)
+        )
+
+    async def pin_space(self, session: AsyncSession, organization_id: int) -> EmbeddingSpace:
+        """
+        Espaço para gravar trechos: registra o padrão atual na primeira gravação
+
+        Assim uma troca de EMBEDDING_MODEL não muda o espaço de quem já tem
+        vetores (a migração é sempre pelo re-embedding). Confirmado junto com a
+        transação de quem chamou.
+        """
+        space = await self.get_space(session, organization_id)
+        if space.version:
+            return space
+
+        await session.execute(
+            insert(KnowledgeEmbeddingVersion)
+            .values(organization_id=organization_id, model=space.model,
+                    dimensions=space.dimensions, version=1, status="active")
+            .on_conflict_do_nothing(index_elements=["organization_id"])
+        )
+        return await self.get_space(session, organization_id)
+
+    # -------------------------------------------------
+    # Re-embedding
+    # -------------------------------------------------
+    async def start_reembed(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        target: EmbeddingSpace,
+        background: bool = True
+    ) -> KnowledgeEmbeddingVersion:
+        """
+        Marcar a troca para `target` e iniciar o re-embedding em segundo plano
+
+        Chamar de novo com o mesmo alvo retoma um re-embedding interrompido.
+        Com background=False só marca a troca (quem chamou executa run()).
+        """
+        await self.pin_space(session, organization_id)
+        row = (await session.execute(
+            select(KnowledgeEmbeddingVersion)
+            .where(KnowledgeEmbeddingVersion.organization_id == organization_id)
+            .with_for_update()
+        )).scalar_one()
+
+        if target.key == _active_space(row).key:
+            raise ValueError(f"{target.tag} ({target.dimensions}d) já é o espaço ativo")
+
+        if not (row.status == "reembedding" and target.key == _target_space(row).key):
+            row.status = "reembedding"
+            row.target_model = target.model
+            row.target_dimensions = target.dimensions
+            row.target_projection_id = target.projection or None
+
+            # Sombras de um alvo anterior não servem mais
+            await session.execute(
+                update(KnowledgeChunk)
+                .where(KnowledgeChunk.organization_id == organization_id,
+                       KnowledgeChunk.shadow_embedding_vec.isnot(None),
+                       not_(shadow_in_space(target)))
+                .values(shadow_embedding_vec=None, shadow_embedding_model=None, shadow_embedding_dim=None)
+            )
+
+        await session.commit()
+        await session.refresh(row)
+
+        logger.info(
+            f"Re-embedding da org {organization_id}: {_active_space(row).tag} ({row.dimensions}d) → "
+            f"{target.tag} ({target.dimensions}d)"
+        )
+
+        task = self._tasks.get(organization_id)
+        if background and (task is None or task.done()):
+            self._tasks[organization_id] = asyncio.create_task(self.run(organization_id))
+
+        return row
+
+    async def run(self, organization_id: int) -> bool:
+        """
+        Preencher as sombras em lotes e trocar o espaço com 100% de cobertura
+
+        Returns:
+            True se o espaço foi trocado
+        """
+        try:
+            for attempt in range(MAX_PASSES):
+                target = await self._target(organization_id)
+                if target is None:
+                    return False
+
+                await self._fill_shadows(organization_id, target)
+
+                if await self._switch(organization_id, target):
+                    await self._repair(organization_id)
+                    await self.prune_embedding_cache(unused_only=True)
+                    return True
+
+                logger.warning(f"Re-embedding da org {organization_id}: cobertura incompleta (passagem {attempt + 1})")
+
+            logger.error(f"Re-embedding da org {organization_id} parado sem 100% de cobertura")
+            return False
+
+        except Exception as e:
+            logger.error(f"Erro no re-embedding da org {organization_id}: {e}")
+            raise
+
+    async def _target(self, organization_id: int) -> Optional[EmbeddingSpace]:
+        async with AsyncSessionLocal() as session:
+            row = await session.get(KnowledgeEmbeddingVersion, organization_id)
+            if row is None or row.status != "reembedding":
+                return None
+
+            target = _target_space(row)
+            await self.ensure_projection(session, target)
+            return target
+
+    async def _fill_shadows(self, organization_id: int, target: EmbeddingSpace):
+        """
+        Uma passagem (keyset por id) pelos trechos sem sombra no alvo
+        """
+        last_id = 0
+        while True:
+            async with AsyncSessionLocal() as session:
+                active = await self.get_space(session, organization_id)
+                derive = bool(target.projection) and active.key == target.base.key
+
+                rows = (await session.execute(
+                    select(KnowledgeChunk.id, KnowledgeChunk.content, KnowledgeChunk.embedding_vec,
+                           KnowledgeChunk.embedding_model, KnowledgeChunk.embedding_dim)
+                    .where(KnowledgeChunk.organization_id == organization_id,
+                           KnowledgeChunk.id > last_id,
+                           not_(shadow_in_space(target)))
+                    .order_by(KnowledgeChunk.id)
+                    .limit(self.batch_size)
+                )).all()
+                if not rows:
+                    return
+
+                embeddings = [None] * len(rows)
+
+                # Projeção do espaço ativo: calculada dos vetores gravados
+                if derive:
+                    local = [
+                        i for i, row in enumerate(rows)
+                        if row.embedding_vec is not None and active.matches(row.embedding_model, row.embedding_dim)
+                    ]
+                    projected = embedding_service.project([decode_embedding(rows[i].embedding_vec) for i in local], target)
+                    for i, embedding in zip(local, projected):
+                        embeddings[i] = embedding
+
+                pending = [i for i, embedding in enumerate(embeddings) if embedding is None]
+                if pending:
+                    generated = await embedding_service.agenerate_embeddings(
+                        [rows[i].content for i in pending], space=target
+                    )
+                    for i, embedding in zip(pending, generated):
+                        embeddings[i] = embedding
+
+                values = [
+                    {
+                        "id": row.id,
+                        "shadow_embedding_vec": encode_embedding(embedding),
+                        "shadow_embedding_model": target.tag,
+                        "shadow_embedding_dim": target.dimensions,
+                    }
+                    for row, embedding in zip(rows, embeddings)
+                    if embedding is not None
+                ]
+                if values:
+                    await session.execute(update(KnowledgeChunk), values)
+                    await session.commit()
+
+                last_id = rows[-1].id
+                logger.info(
+                    f"Re-embedding da org {organization_id}: +{len(values)}/{len(rows)} trechos "
+                    f"(até id {last_id}, {len(rows) - len(pending)} projetados localmente)"
+                )
+
+    async def _switch(self, organization_id: int, target: EmbeddingSpace) -> bool:
+        """
+        Troca atômica: sombra → embedding_vec e novo espaço ativo na mesma transação
+        """
+        async with AsyncSessionLocal() as session:
+            row = (await session.execute(
+                select(KnowledgeEmbeddingVersion)
+                .where(KnowledgeEmbeddingVersion.organization_id == organization_id)
+                .with_for_update()
+            )).scalar_one()
+
+            if row.status != "reembedding" or _target_space(row).key != target.key:
+                return False
+
+            missing = (await session.execute(
+                select(func.count(KnowledgeChunk.id))
+                .where(KnowledgeChunk.organization_id == organization_id, not_(shadow_in_space(target)))
+            )).scalar()
+            if missing:
+                await session.rollback()
+                return False
+
+            # Trechos gravados depois da contagem (sem sombra) ficam no espaço
+            # antigo; _repair os re-embedda após a troca
+            await session.execute(
+                update(KnowledgeChunk)
+                .where(KnowledgeChunk.organization_id == organization_id, shadow_in_space(target))
+                .values(
+                    embedding_vec=KnowledgeChunk.shadow_embedding_vec,
+                    embedding_model=KnowledgeChunk.shadow_embedding_model,
+                    embedding_dim=KnowledgeChunk.shadow_embedding_dim,
+                    shadow_embedding_vec=None,
+                    shadow_embedding_model=None,
+                    shadow_embedding_dim=None,
+                )
+            )
+
+            row.model = target.model
+            row.dimensions = target.dimensions
+            row.projection_id = target.projection or None
+            row.version += 1
+            row.status = "active"
+            row.target_model = None
+            row.target_dimensions = None
+            row.target_projection_id = None
+            row.switched_at = func.now()
+
+            await session.commit()
+
+        logger.info(f"Org {organization_id} agora usa {target.tag} ({target.dimensions}d)")
+        return True
+
+    async def _repair(self, organization_id: int):
+        """
+        Trechos gravados no espaço antigo durante a troca → espaço ativo
+        """
+        async with AsyncSessionLocal() as session:
+            space = await self.get_space(session, organization_id)
+            rows = (await session.execute(
+                select(KnowledgeChunk.id, KnowledgeChunk.content)
+                .where(KnowledgeChunk.organization_id == organization_id,
+                       KnowledgeChunk.embedding_model.isnot(None),
+                       not_(in_space(space)))
+            )).all()
+            if not rows:
+                return
+
+            embeddings = await embedding_service.agenerate_embeddings([content for _, content in rows], space=space)
+            values = [
+                {"id": chunk_id, "embedding_vec": encode_embedding(embedding),
+                 "embedding_model": space.tag, "embedding_dim": space.dimensions}
+                for (chunk_id, _), embedding in zip(rows, embeddings)
+                if embedding is not None
+            ]
+            if values:
+                await session.execute(update(KnowledgeChunk), values)
+                await session.commit()
+
+            logger.info(f"Org {organization_id}: {len(values)} trechos gravados durante a troca re-embeddados")
+
+    # -------------------------------------------------
+    # Limpeza do cache persistente de embeddings
+    # -------------------------------------------------
+    async def cache_models_in_use(self, session: AsyncSession) -> Set[str]:
+        """
+        Chaves do cache de embeddings ainda usadas: espaços ativos, alvos de
+        re-embedding e o padrão (projeções PCA usam a chave do espaço base)
+        """
+        rows = (await session.execute(select(KnowledgeEmbeddingVersion))).scalars().all()
+
+        keys = {embedding_service.default_space.cache_key}
+        for row in rows:
+            keys.add(_active_space(row).base.cache_key)
+            if row.target_model:
+                keys.add(_target_space(row).base.cache_key)
+
+        return keys
+
+    async def prune_embedding_cache(self, unused_only: bool = False) -> int:
+        """
+        Descartar do cache persistente os modelos sem uso e (exceto com
+        unused_only) as entradas antigas / acima do teto de linhas
+
+        Returns:
+            Linhas removidas
+        """
+        try:
+            async with AsyncSessionLocal() as session:
+                keep = await self.cache_models_in_use(session)
+        except Exception as e:
+            logger.error(f"Erro ao consultar os espaços em uso para a limpeza do cache: {e}")
+            return 0
+
+        store = embedding_service.cache.store
+        if unused_only:
+            return await asyncio.to_thread(store.prune, keep_models=keep)
+
+        return await asyncio.to_thread(store.prune, self.cache_max_age_days, self.cache_max_rows, keep)
+
+    async def _prune_loop(self):
+        while True:
+            await asyncio.sleep(self.cache_prune_interval)
+            try:
+                await self.prune_embedding_cache()
+            except Exception as e:
+                logger.error(f"Erro na limpeza periódica do cache de embeddings: {e}")
+
+    def start_cache_pruning(self):
+        """
+        Iniciar a limpeza periódica do cache persistente (startup do app)
+        """
+        if self.cache_prune_interval <= 0 or self._prune_task is not None:
+            return
+
+        self._prune_task = asyncio.create_task(self._prune_loop())
+
+    async def stop_cache_pruning(self):
+        """Parar a limpeza periódica"""
+        if self._prune_task is None:
+            return
+
+        self._prune_task.cancel()
+        await asyncio.gather(self._prune_task, return_exceptions=True)
+        self._prune_task = None
+
+    async def get_status(self, session: AsyncSession, organization_id: int) -> Dict[str, Any]:
+        """
+        Espaço ativo, troca em andamento e cobertura da sombra
+        """
+        row = await session.get(KnowledgeEmbeddingVersion, organization_id)
+        space = _active_space(row) if row else embedding_service.default_space
+
+        total, active = (await session.execute(
+            select(func.count(KnowledgeChunk.id), func.count(KnowledgeChunk.id).filter(in_space(space)))
+            .where(KnowledgeChunk.organization_id == organization_id)
+        )).one()
+
+        status = {
+            "model": space.model,
+            "dimensions": space.dimensions,
+            "projection_id": space.projection or None,
+            "version": space.version,
+            "status": row.status if row else "active",
+            "chunks": total,
+            "chunks_in_active_space": active,
+            "running": organization_id in self._tasks and not self._tasks[organization_id].done(),
+        }
+
+        if row is not None and row.status == "reembedding":
+            target = _target_space(row)
+            covered = (await session.execute(
+                select(func.count(KnowledgeChunk.id))
+                .where(KnowledgeChunk.organization_id == organization_id, shadow_in_space(target))
+            )).scalar()
+            status.update({
+                "target_model": target.model,
+                "target_dimensions": target.dimensions,
+                "target_projection_id": target.projection or None,
+                "reembedded": covered,
+                "coverage": round(covered / total, 4) if total else 1.0,
+            })
+
+        return status
+
+
+# Instância global do serviço
+embedding_version_service = EmbeddingVersionService()
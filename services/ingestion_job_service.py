@@ -0,0 +1,519 @@
+"""
+Jobs de ingestão da knowledge em segundo plano
+
+O upload (POST /knowledge/jobs) só valida e enfileira os registros em
+knowledge_ingest_items e responde com o id do job. Um pool de workers por
+processo (KNOWLEDGE_JOB_WORKERS) consome a fila:
+
+1. reivindica um job pendente — ou um `running` sem heartbeat há mais de
+   KNOWLEDGE_JOB_STALE_SECONDS (worker morto) — com FOR UPDATE SKIP LOCKED;
+2. lê os itens com seq > cursor em lotes de KNOWLEDGE_BULK_BATCH_DOCS, com as
+   embeddings do próximo lote em andamento enquanto o anterior grava;
+3. grava documentos + trechos, avança o cursor, soma as contagens e apaga os
+   itens do lote na MESMA transação — depois de um restart o job continua do
+   último lote confirmado, sem duplicar documentos.
+
+Enquanto o job roda, o heartbeat é renovado a cada terço de
+KNOWLEDGE_JOB_STALE_SECONDS (inclusive durante um lote de embeddings lento).
+Só erros e workers mortos contam como tentativas; o stop() de um deploy
+devolve o job à fila sem gastar tentativa.
+
+As atualizações do job só valem enquanto ele pertence ao worker (status
+running + worker_id): um job cancelado ou retomado por outro worker faz o
+worker antigo parar no lote seguinte, com o lote em andamento desfeito.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database.database import AsyncSessionLocal
+from models.knowledge import KnowledgeIngestItem, KnowledgeIngestJob
+from services.embedding_service import EmbeddingSpace, estimate_tokens
+from services.embedding_version_service import embedding_version_service
+from services.knowledge_ingestion_service import Record, RecordError, knowledge_ingestion_service
+
+logger = logging.getLogger(__name__)
+
+STAGE_ROWS = 500   # itens por INSERT ao enfileirar
+MAX_ATTEMPTS = 5   # falhas (erro ou worker morto) até o job ser dado como falho
+
+# (seq, referência, documento)
+Item = Tuple[int, str, Dict[str, Any]]
+
+
+class JobLost(Exception):
+    """O job foi cancelado ou reivindicado por outro worker"""
+
+
+class JobRun:
+    """
+    Estado de um worker processando um job
+    """
+
+    def __init__(self, job: KnowledgeIngestJob, worker_id: str):
+        self.job_id = job.id
+        self.organization_id = job.organization_id
+        self.worker_id = worker_id
+        self.cursor = job.cursor
+        self.errors: List[Dict[str, str]] = json.loads(job.errors) if job.errors else []
+        self.last_checkpoint = time.monotonic()
+
+    def owned(self):
+        """Condição das atualizações: o job ainda é deste worker"""
+        return and_(
+            KnowledgeIngestJob.id == self.job_id,
+            KnowledgeIngestJob.status == "running",
+            KnowledgeIngestJob.worker_id == self.worker_id,
+        )
+
+
+class IngestionJobService:
+    """
+    Serviço para enfileirar e processar jobs de ingestão da knowledge
+    """
+
+    def __init__(self):
+        self.workers = settings.knowledge_job_workers
+        self.poll_seconds = settings.knowledge_job_poll_seconds
+        self.stale_seconds = settings.knowledge_job_stale_seconds
+        self.batch_docs = settings.knowledge_bulk_batch_docs
+        self.max_errors = settings.knowledge_bulk_max_errors
+
+        self.process_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    # -------------------------------------------------
+    # Enfileiramento
+    # -------------------------------------------------
+    async def create_job(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        records: AsyncIterator[Record]
+    ) -> KnowledgeIngestJob:
+        """
+        Validar e enfileirar os registros (sem embeddings) numa única transação
+
+        Registros inválidos já entram como falhas do job; `total` conta só os
+        enfileirados.
+        """
+        job = KnowledgeIngestJob(organization_id=organization_id, status="pending")
+        session.add(job)
+        await session.flush()
+
+        errors: List[Dict[str, str]] = []
+        failed = 0
+        seq = 0
+        rows = []
+
+        async for ref, record in records:
+            if isinstance(record, RecordError):
+                failed += 1
+                if len(errors) < self.max_errors:
+                    errors.append({"row": ref, "error": str(record)})
+                continue
+
+            seq += 1
+            rows.append({
+                "job_id": job.id,
+                "seq": seq,
+                "ref": ref[:255],
+                "payload": json.dumps(record, ensure_ascii=False),
+            })
+            if len(rows) >= STAGE_ROWS:
+                await session.execute(insert(KnowledgeIngestItem), rows)
+                rows = []
+
+        if rows:
+            await session.execute(insert(KnowledgeIngestItem), rows)
+
+        job.total = seq
+        job.failed = failed
+        job.errors = json.dumps(errors, ensure_ascii=False) if errors else None
+        if not seq:
+            job.status = "completed"
+            job.finished_at = func.now()
+
+        await session.commit()
+        await session.refresh(job)
+
+        logger.info(f"Job de ingestão {job.id} (org {organization_id}): {seq} registros enfileirados, {failed} inválidos")
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        return job
+
+    async def cancel_job(self, session: AsyncSession, job: KnowledgeIngestJob) -> bool:
+        """
+        Cancelar um job pendente ou em andamento (o worker para no próximo lote)
+        """
+        result = await session.execute(
+            update(KnowledgeIngestJob)
+            .where(KnowledgeIngestJob.id == job.id, KnowledgeIngestJob.status.in_(("pending", "running")))
+            .values(status="cancelled", finished_at=func.now())
+        )
+        if not result.rowcount:
+            return False
+
+        await session.execute(delete(KnowledgeIngestItem).where(KnowledgeIngestItem.job_id == job.id))
+        await session.commit()
+        await session.refresh(job)
+        return True
+
+    # -------------------------------------------------
+    # Pool de workers
+    # -------------------------------------------------
+    def start(self):
+        """
+        Iniciar os workers deste processo (startup do app)
+        """
+        if self.workers <= 0 or self._tasks:
+            return
+
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker(f"{self.process_id}:{n}"))
+            for n in range(self.workers)
+        ]
+        logger.info(f"Workers de ingestão iniciados: {self.workers}")
+
+    async def stop(self):
+        """
+        Parar os workers e devolver à fila os jobs deste processo
+
+        O lote em andamento é desfeito; o job volta a `pending` com o cursor do
+        último lote confirmado.
+        """
+        if not self._tasks:
+            return
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(KnowledgeIngestJob)
+                    .where(
+                        KnowledgeIngestJob.status == "running",
+                        KnowledgeIngestJob.worker_id.like(f"{self.process_id}:%")
+                    )
+                    .values(status="pending", worker_id=None)
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Erro ao devolver jobs de ingestão à fila: {e}")
+
+    async def _worker(self, worker_id: str):
+        while True:
+            try:
+                job = await self._claim(worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erro ao buscar job de ingestão: {e}")
+                job = None
+
+            if job is None:
+                await self._wait()
+                continue
+
+            try:
+                await self._run(JobRun(job, worker_id))
+            except JobLost:
+                logger.warning(f"Job de ingestão {job.id} cancelado ou retomado por outro worker ({worker_id} parou)")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erro no job de ingestão {job.id}: {e}")
+                await self._release(job.id, worker_id, str(e))
+                await self._wait()
+
+    async def _wait(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _claim(self, worker_id: str) -> Optional[KnowledgeIngestJob]:
+        """
+        Reivindicar o job pendente (ou abandonado) mais antigo
+        """
+        async with AsyncSessionLocal() as session:
+            stale = func.now() - timedelta(seconds=self.stale_seconds)
+            stmt = (
+                select(KnowledgeIngestJob)
+                .where(or_(
+                    KnowledgeIngestJob.status == "pending",
+                    and_(KnowledgeIngestJob.status == "running", KnowledgeIngestJob.heartbeat_at < stale)
+                ))
+                .order_by(KnowledgeIngestJob.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = (await session.execute(stmt)).scalar_one_or_none()
+            if job is None:
+                return None
+
+            if job.status == "running":
+                # Sem heartbeat: o worker morreu no meio do job
+                logger.warning(f"Retomando job de ingestão {job.id} abandonado por {job.worker_id}")
+                job.attempts += 1
+
+            if job.attempts >= MAX_ATTEMPTS:
+                job.status = "failed"
+                job.error = job.error or "número máximo de tentativas excedido"
+                job.finished_at = func.now()
+                await session.execute(delete(KnowledgeIngestItem).where(KnowledgeIngestItem.job_id == job.id))
+                await session.commit()
+                logger.error(f"Job de ingestão {job.id} falhou após {job.attempts} tentativas")
+                return None
+
+            job.status = "running"
+            job.worker_id = worker_id
+            job.heartbeat_at = func.now()
+            if job.started_at is None:
+                job.started_at = func.now()
+
+            await session.commit()
+            await session.refresh(job)
+            return job
+
+    async def _release(self, job_id: int, worker_id: str, error: str):
+        """Devolver o job à fila depois de um erro inesperado"""
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(KnowledgeIngestJob)
+                    .where(KnowledgeIngestJob.id == job_id, KnowledgeIngestJob.worker_id == worker_id,
+                           KnowledgeIngestJob.status == "running")
+                    .values(status="pending", worker_id=None, error=error,
+                            attempts=KnowledgeIngestJob.attempts + 1)
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Erro ao devolver job de ingestão {job_id} à fila: {e}")
+
+    async def _heartbeat(self, run: JobRun):
+        """
+        Renovar heartbeat_at do job enquanto ele é processado (sessão própria)
+        """
+        interval = max(self.stale_seconds / 3, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(
+                        update(KnowledgeIngestJob).where(run.owned()).values(heartbeat_at=func.now())
+                    )
+                    await session.commit()
+                if not result.rowcount:
+                    # Cancelado ou retomado: o próximo checkpoint levanta JobLost
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erro no heartbeat do job de ingestão {run.job_id}: {e}")
+
+    # -------------------------------------------------
+    # Processamento
+    # -------------------------------------------------
+    async def _run(self, run: JobRun):
+        """
+        Processar os itens do job em lotes a partir do cursor
+        """
+        logger.info(f"Job de ingestão {run.job_id}: {run.worker_id} iniciando a partir do item {run.cursor}")
+
+        heartbeat = asyncio.create_task(self._heartbeat(run))
+        try:
+            await self._process(run)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+        logger.info(f"Job de ingestão {run.job_id} concluído")
+
+    async def _process(self, run: JobRun):
+        async with AsyncSessionLocal() as session:
+            await embedding_version_service.pin_space(session, run.organization_id)
+            await session.commit()
+
+            pending = None
+            task = None
+            try:
+                cursor = run.cursor
+                while True:
+                    items = await self._next_items(session, run.job_id, cursor)
+
+                    # Espaço relido a cada lote: um job longo acompanha uma troca de modelo
+                    space = await embedding_version_service.get_space(session, run.organization_id)
+                    task = asyncio.create_task(
+                        knowledge_ingestion_service.embed([(ref, doc) for _, ref, doc in items], space)
+                    ) if items else None
+
+                    if pending is not None:
+                        await self._store_batch(session, run, *pending)
+                    if not items:
+                        break
+
+                    cursor = items[-1][0]
+                    pending, task = (items, task, space), None
+
+                result = await session.execute(
+                    update(KnowledgeIngestJob)
+                    .where(run.owned())
+                    .values(status="completed", finished_at=func.now(), heartbeat_at=func.now())
+                )
+                if not result.rowcount:
+                    raise JobLost()
+                await session.commit()
+
+            finally:
+                for leftover in (task, pending[1] if pending else None):
+                    if leftover is not None and not leftover.done():
+                        leftover.cancel()
+
+    async def _next_items(self, session: AsyncSession, job_id: int, cursor: int) -> List[Item]:
+        rows = (await session.execute(
+            select(KnowledgeIngestItem.seq, KnowledgeIngestItem.ref, KnowledgeIngestItem.payload)
+            .where(KnowledgeIngestItem.job_id == job_id, KnowledgeIngestItem.seq > cursor)
+            .order_by(KnowledgeIngestItem.seq)
+            .limit(self.batch_docs)
+        )).all()
+        return [(seq, ref, json.loads(payload)) for seq, ref, payload in rows]
+
+    async def _store_batch(
+        self,
+        session: AsyncSession,
+        run: JobRun,
+        items: List[Item],
+        embed_task: "asyncio.Future",
+        space: EmbeddingSpace
+    ):
+        """
+        Gravar um lote + checkpoint do job na mesma transação
+        """
+        batch = [(ref, doc) for _, ref, doc in items]
+        try:
+            chunks, embeddings = await embed_task
+            doc_ids, chunk_ids = await knowledge_ingestion_service.write_batch(
+                session, run.organization_id, batch, chunks, embeddings, space
+            )
+            await self._checkpoint(session, run, items, {
+                "inserted": len(doc_ids),
+                "chunks": len(chunk_ids),
+                "tokens": sum(estimate_tokens(text) for doc_chunks in chunks for text in doc_chunks),
+            })
+            await session.commit()
+
+        except (JobLost, asyncio.CancelledError):
+            await session.rollback()
+            raise
+
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Erro ao gravar lote do job de ingestão {run.job_id}: {e}")
+            for ref, _ in batch:
+                if len(run.errors) < self.max_errors:
+                    run.errors.append({"row": ref, "error": f"falha ao gravar lote: {e}"})
+            await self._checkpoint(session, run, items, {"failed": len(items)}, errors_changed=True)
+            await session.commit()
+            return
+
+        knowledge_ingestion_service.update_caches(run.organization_id, batch, chunks, chunk_ids, embeddings, space)
+
+    async def _checkpoint(
+        self,
+        session: AsyncSession,
+        run: JobRun,
+        items: List[Item],
+        counts: Dict[str, int],
+        errors_changed: bool = False
+    ):
+        """
+        Avançar cursor e contagens do job e apagar os itens do lote (sem commit)
+        """
+        now = time.monotonic()
+        cursor = items[-1][0]
+
+        values = {
+            "cursor": cursor,
+            "processed": KnowledgeIngestJob.processed + len(items),
+            "elapsed_seconds": KnowledgeIngestJob.elapsed_seconds + (now - run.last_checkpoint),
+            "heartbeat_at": func.now(),
+        }
+        for column, amount in counts.items():
+            values[column] = getattr(KnowledgeIngestJob, column) + amount
+        if errors_changed:
+            values["errors"] = json.dumps(run.errors, ensure_ascii=False)
+
+        result = await session.execute(update(KnowledgeIngestJob).where(run.owned()).values(**values))
+        if not result.rowcount:
+            raise JobLost()
+
+        await session.execute(
+            delete(KnowledgeIngestItem)
+            .where(KnowledgeIngestItem.job_id == run.job_id, KnowledgeIngestItem.seq <= cursor)
+        )
+
+        run.cursor = cursor
+        run.last_checkpoint = now
+
+    # -------------------------------------------------
+    # Status
+    # -------------------------------------------------
+    @staticmethod
+    def get_status(job: KnowledgeIngestJob) -> Dict[str, Any]:
+        """
+        Progresso, vazão (docs/s, tokens/s) e ETA de um job
+        """
+        elapsed = job.elapsed_seconds or 0.0
+        docs_per_second = job.processed / elapsed if elapsed else 0.0
+        tokens_per_second = job.tokens / elapsed if elapsed else 0.0
+        remaining = max(job.total - job.processed, 0)
+
+        eta = None
+        if job.status in ("pending", "running") and docs_per_second:
+            eta = round(remaining / docs_per_second, 1)
+
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "total": job.total,
+            "processed": job.processed,
+            "remaining": remaining,
+            "progress": round(job.processed / job.total, 4) if job.total else 1.0,
+            "inserted": job.inserted,
+            "failed": job.failed,
+            "chunks": job.chunks,
+            "tokens": job.tokens,
+            "elapsed_seconds": round(elapsed, 3),
+            "docs_per_second": round(docs_per_second, 2),
+            "tokens_per_second": round(tokens_per_second, 1),
+            "eta_seconds": eta,
+            "attempts": job.attempts,
+            "error": job.error,
+            "errors": json.loads(job.errors) if job.errors else [],
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "heartbeat_at": job.heartbeat_at,
+        }
+
+
+# Instância global do serviço
+ingestion_job_service = IngestionJobService()
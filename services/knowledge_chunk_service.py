@@ -0,0 +1,207 @@
+"""
+Ingestão da Knowledge Base em trechos (chunks)
+
+O conteúdo é dividido em parágrafos e frases, agrupados em trechos de até
+KNOWLEDGE_CHUNK_TOKENS tokens estimados, com KNOWLEDGE_CHUNK_OVERLAP tokens
+repetidos do trecho anterior para não cortar o contexto na fronteira. Cada
+trecho recebe a sua embedding (em lote) e vira uma linha de knowledge_chunks
+filha do documento; a busca devolve só os trechos relevantes.
+
+O documento também recebe a média das embeddings dos trechos na coluna legada
+knowledge.embedding, ainda ranqueada pelo knowledge_router_v2 (pgvector).
+"""
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from models.knowledge import Knowledge, KnowledgeChunk
+from services.embedding_service import EmbeddingSpace, embedding_service, encode_embedding, estimate_tokens
+from services.embedding_version_service import embedding_version_service
+
+logger = logging.getLogger(__name__)
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def _split_units(text: str, max_tokens: int) -> List[Tuple[int, str]]:
+    """
+    Unidades (parágrafo, frase); frases maiores que o limite são cortadas por palavras
+    """
+    max_chars = max_tokens * 3
+    units = []
+
+    for paragraph_index, paragraph in enumerate(_PARAGRAPH_RE.split(text)):
+        for sentence in _SENTENCE_RE.split(paragraph.strip()):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+
+            if estimate_tokens(sentence) <= max_tokens:
+                units.append((paragraph_index, sentence))
+                continue
+
+            piece = []
+            size = 0
+            for word in sentence.split():
+                if piece and size + len(word) + 1 > max_chars:
+                    units.append((paragraph_index, " ".join(piece)))
+                    piece, size = [], 0
+                piece.append(word)
+                size += len(word) + 1
+            if piece:
+                units.append((paragraph_index, " ".join(piece)))
+
+    return units
+
+
+def _join_units(units: List[Tuple[int, str]]) -> str:
+    parts = []
+    previous = None
+    for paragraph_index, sentence in units:
+        if parts:
+            parts.append("\n\n" if paragraph_index != previous else " ")
+        parts.append(sentence)
+        previous = paragraph_index
+    return "".join(parts)
+
+
+def chunk_text(
+    text: str,
+    max_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None
+) -> List[str]:
+    """
+    Dividir o texto em trechos de até max_tokens com sobreposição de overlap_tokens
+    """
+    max_tokens = max_tokens or settings.knowledge_chunk_tokens
+    overlap_tokens = settings.knowledge_chunk_overlap if overlap_tokens is None else overlap_tokens
+
+    if not text or not text.strip():
+        return []
+    if estimate_tokens(text) <= max_tokens:
+        return [text.strip()]
+
+    chunks = []
+    current: List[Tuple[int, str]] = []
+    current_tokens = 0
+
+    for unit in _split_units(text, max_tokens):
+        tokens = estimate_tokens(unit[1])
+
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(_join_units(current))
+
+            # Levar para o próximo trecho as últimas frases (até overlap_tokens)
+            tail: List[Tuple[int, str]] = []
+            tail_tokens = 0
+            for previous in reversed(current[1:]):
+                previous_tokens = estimate_tokens(previous[1])
+                if tail_tokens + previous_tokens > overlap_tokens:
+                    break
+                tail.insert(0, previous)
+                tail_tokens += previous_tokens
+
+            if tail_tokens + tokens > max_tokens:
+                tail, tail_tokens = [], 0
+
+            current, current_tokens = tail, tail_tokens
+
+        current.append(unit)
+        current_tokens += tokens
+
+    if current:
+        chunks.append(_join_units(current))
+
+    return chunks
+
+
+def document_embedding(
+    embeddings: List[Optional[List[float]]],
+    space: EmbeddingSpace
+) -> Dict[str, Any]:
+    """
+    Colunas de embedding do documento inteiro (média L2-normalizada dos trechos)
+
+    O knowledge_router_v2 compara knowledge.embedding com consultas do espaço
+    padrão; em outro espaço (modelo, dimensão ou PCA) os vetores não seriam
+    comparáveis e nada é gravado.
+
+    Returns:
+        {"embedding": JSON legado, "embedding_vec": float32} ou {} sem vetor
+    """
+    vectors = [embedding for embedding in embeddings if embedding is not None]
+    if not vectors or space.key != embedding_service.default_space.key:
+        return {}
+
+    mean = np.asarray(vectors, dtype=np.float32).mean(axis=0)
+    norm = float(np.linalg.norm(mean))
+    if norm == 0:
+        return {}
+
+    embedding = (mean / norm).tolist()
+    return {"embedding": json.dumps(embedding), "embedding_vec": encode_embedding(embedding)}
+
+
+class KnowledgeChunkService:
+    """
+    Serviço para dividir documentos da knowledge e gerar as embeddings dos trechos
+    """
+
+    async def create_chunks(
+        self,
+        session: AsyncSession,
+        doc: Knowledge,
+        space: Optional[EmbeddingSpace] = None
+    ) -> List[Tuple[KnowledgeChunk, Optional[List[float]]]]:
+        """
+        Criar os trechos do documento (já com id) na sessão, sem commit
+
+        Args:
+            space: Espaço de embeddings da organização (registrado se omitido)
+
+        Returns:
+            Lista de tuplas (KnowledgeChunk, embedding) na ordem do documento
+        """
+        if space is None:
+            space = await embedding_version_service.pin_space(session, doc.organization_id)
+
+        texts = chunk_text(doc.content)
+        embeddings = await embedding_service.agenerate_embeddings(texts, space=space) if texts else []
+
+        chunks = [
+            KnowledgeChunk(
+                knowledge_id=doc.id,
+                organization_id=doc.organization_id,
+                chunk_index=position,
+                content=text,
+                token_count=estimate_tokens(text),
+                embedding_vec=encode_embedding(embedding),
+                embedding_model=space.tag if embedding is not None else None,
+                embedding_dim=space.dimensions if embedding is not None else None
+            )
+            for position, (text, embedding) in enumerate(zip(texts, embeddings))
+        ]
+
+        for column, value in document_embedding(embeddings, space).items():
+            setattr(doc, column, value)
+
+        missing = sum(1 for embedding in embeddings if embedding is None)
+        if missing:
+            logger.warning(f"Documento {doc.id}: {missing} de {len(chunks)} trechos sem embedding")
+
+        session.add_all(chunks)
+        await session.flush()
+
+        logger.info(f"Documento {doc.id} dividido em {len(chunks)} trechos")
+
+        return list(zip(chunks, embeddings))
+
+
+# Instância global do serviço
+knowledge_chunk_service = KnowledgeChunkService()
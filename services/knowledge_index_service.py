@@ -0,0 +1,380 @@
+"""
+Cache em memória das embeddings da Knowledge Base por organização
+
+Cada organização tem uma matriz float32 contígua (N x D) com as embeddings
+L2-normalizadas e um array paralelo com os ids dos trechos (knowledge_chunks).
+A busca é um único produto matriz-vetor + argpartition, sem reler a tabela a
+cada mensagem. Só entram vetores do espaço de embeddings ativo da organização;
+uma troca de espaço (nova versão) força a recarga.
+"""
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.knowledge import KnowledgeChunk
+from services.embedding_service import EmbeddingSpace, decode_embedding
+from services.embedding_version_service import embedding_version_service, in_space
+from services.org_cache import ChunkSyncedCache
+
+logger = logging.getLogger(__name__)
+
+
+def parse_embedding(raw: Any) -> Optional[np.ndarray]:
+    """
+    Converter a embedding armazenada (bytea float32, JSON string ou lista) em vetor float32
+    """
+    if raw is None:
+        return None
+
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        raw = decode_embedding(raw)
+    elif isinstance(raw, str):
+        raw = json.loads(raw)
+
+    vec = np.asarray(raw, dtype=np.float32)
+    if vec.ndim != 1 or vec.size == 0:
+        return None
+
+    return vec
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalizar as linhas de uma matriz (linhas nulas ficam zeradas)
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def mmr_select(
+    relevance: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    lambda_: float
+) -> List[int]:
+    """
+    Maximal Marginal Relevance: escolher k posições equilibrando relevância e diversidade
+
+    A matriz de similaridade entre candidatos é calculada uma vez (V @ V.T);
+    cada passo só atualiza o vetor com a maior similaridade a um já escolhido.
+
+    Candidatos sem embedding (linha nula, ex. só do BM25) têm redundância
+    desconhecida: recebem a média dos demais candidatos disponíveis, para não
+    parecerem "diversos ao máximo" e competirem só pela relevância.
+
+    Args:
+        relevance: Relevância de cada candidato, em [0, 1]
+        vectors: Embeddings L2-normalizadas dos candidatos (linhas nulas = sem embedding)
+        k: Quantidade a escolher
+        lambda_: 1.0 = só relevância; 0.0 = só diversidade
+
+    Returns:
+        Posições escolhidas, na ordem de escolha
+    """
+    n = relevance.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    similarity = vectors @ vectors.T
+    max_similarity = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    missing = ~vectors.any(axis=1)
+    chosen = []
+
+    for _ in range(k):
+        redundancy = max_similarity
+        if missing.any():
+            known = available & ~missing
+            redundancy = max_similarity.copy()
+            redundancy[missing] = max_similarity[known].mean() if known.any() else 0.0
+
+        scores = lambda_ * relevance - (1.0 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+
+        chosen.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+    return chosen
+
+
+class OrgEmbeddingMatrix:
+    """
+    Matriz de embeddings normalizadas de uma organização
+    """
+
+    def __init__(self, dimension: Optional[int] = None):
+        self.dimension = dimension
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = np.empty((0, dimension or 0), dtype=np.float32)
+        self._sorter: Optional[np.ndarray] = None  # argsort(ids), calculado sob demanda
+
+        # Controle de sincronização com o banco
+        self.space: Optional[EmbeddingSpace] = None
+        self.max_id = 0
+        self.known_rows = 0
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def add(self, ids: Iterable[int], vectors: List[np.ndarray]) -> int:
+        """
+        Adicionar (ou substituir) vetores; retorna quantos foram aceitos
+        """
+        ids = list(ids)
+        if not ids:
+            return 0
+
+        if self.dimension is None:
+            self.dimension = int(vectors[0].shape[0])
+            self.matrix = np.empty((0, self.dimension), dtype=np.float32)
+
+        accepted_ids = []
+        accepted_vecs = []
+        for doc_id, vec in zip(ids, vectors):
+            if vec.shape[0] != self.dimension:
+                logger.warning(
+                    f"Embedding do documento {doc_id} ignorada: dimensão "
+                    f"{vec.shape[0]} != {self.dimension}"
+                )
+                continue
+            accepted_ids.append(doc_id)
+            accepted_vecs.append(vec)
+
+        if not accepted_ids:
+            return 0
+
+        new_ids = np.asarray(accepted_ids, dtype=np.int64)
+        self.remove(new_ids)
+
+        self.ids = np.concatenate([self.ids, new_ids])
+        self._sorter = None
+        self.matrix = np.ascontiguousarray(
+            np.vstack([self.matrix, normalize_rows(np.vstack(accepted_vecs))])
+        )
+
+        return len(accepted_ids)
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """
+        Remover vetores pelos ids; retorna quantos foram removidos
+        """
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if ids.size == 0 or len(self) == 0:
+            return 0
+
+        mask = np.isin(self.ids, ids, invert=True)
+        removed = len(self) - int(mask.sum())
+        if removed:
+            self.ids = self.ids[mask]
+            self.matrix = np.ascontiguousarray(self.matrix[mask])
+            self._sorter = None
+
+        return removed
+
+    def vectors(self, ids: Iterable[int]) -> np.ndarray:
+        """
+        Linhas (normalizadas) dos ids pedidos; ids ausentes viram linhas nulas
+        """
+        ids = np.asarray(list(ids), dtype=np.int64)
+        out = np.zeros((ids.shape[0], self.dimension or 0), dtype=np.float32)
+        if len(self) == 0 or ids.size == 0:
+            return out
+
+        if self._sorter is None:
+            self._sorter = np.argsort(self.ids, kind="stable")
+
+        sorted_ids = self.ids[self._sorter]
+        pos = np.searchsorted(sorted_ids, ids).clip(max=len(self) - 1)
+        found = sorted_ids[pos] == ids
+        out[found] = self.matrix[self._sorter[pos[found]]]
+
+        return out
+
+    def top_k(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """
+        Retornar os k documentos mais similares (id, cosseno)
+        """
+        n = len(self)
+        if n == 0 or k <= 0 or query.shape[0] != self.dimension:
+            return []
+
+        scores = self.matrix @ normalize_rows(query)
+
+        if k < n:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(n)
+
+        order = candidates[np.argsort(-scores[candidates])]
+
+        return [(int(self.ids[i]), float(scores[i])) for i in order]
+
+
+class KnowledgeMatrixCache(ChunkSyncedCache):
+    """
+    Cache por organização das matrizes de embeddings da tabela knowledge_chunks
+
+    Sincronização por COUNT/MAX(id) (ver ChunkSyncedCache), restrita aos
+    trechos do espaço de embeddings ativo; trocar de espaço recarrega a matriz.
+    """
+
+    label = "Matriz"
+
+    def _create(self, space: EmbeddingSpace) -> OrgEmbeddingMatrix:
+        matrix = OrgEmbeddingMatrix()
+        matrix.space = space
+        return matrix
+
+    def _matches(self, matrix: OrgEmbeddingMatrix, space: EmbeddingSpace) -> bool:
+        return matrix.space == space
+
+    async def _load_rows(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        matrix: OrgEmbeddingMatrix,
+        after_id: int = 0
+    ) -> int:
+        """
+        Carregar linhas com id > after_id para a matriz; retorna linhas lidas
+        """
+        stmt = (
+            select(KnowledgeChunk.id, KnowledgeChunk.embedding_vec)
+            .where(
+                KnowledgeChunk.organization_id == organization_id,
+                in_space(matrix.space),
+                KnowledgeChunk.id > after_id
+            )
+            .order_by(KnowledgeChunk.id)
+        )
+        result = await session.execute(stmt)
+        rows = result.all()
+
+        ids = []
+        vectors = []
+        for chunk_id, raw_vec in rows:
+            try:
+                vec = parse_embedding(raw_vec)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Embedding inválida no trecho {chunk_id}: {e}")
+                continue
+            if vec is not None:
+                ids.append(chunk_id)
+                vectors.append(vec)
+
+        matrix.add(ids, vectors)
+
+        return self._track_rows(matrix, rows)
+
+    def _remove(self, matrix: OrgEmbeddingMatrix, chunk_ids: Iterable[int]) -> int:
+        return matrix.remove(chunk_ids)
+
+    def _describe(self, matrix: OrgEmbeddingMatrix) -> str:
+        space = matrix.space
+        return f"{len(matrix)} vetores ({space.model}, dim={matrix.dimension}, versão {space.version})"
+
+    async def get_matrix(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        space: Optional[EmbeddingSpace] = None
+    ) -> OrgEmbeddingMatrix:
+        """
+        Obter a matriz da organização, sincronizada com o banco
+
+        `space` é o espaço ativo da organização (consultado se omitido).
+        """
+        if space is None:
+            space = await embedding_version_service.get_space(session, organization_id)
+
+        return await self._get_entry(session, organization_id, space, [in_space(space)])
+
+    async def search(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        query_embedding: Optional[List[float]],
+        top_k: int = 5,
+        space: Optional[EmbeddingSpace] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Buscar os top_k trechos da organização mais similares à query
+
+        A query tem que ter sido gerada no mesmo `space` (espaço ativo).
+
+        Returns:
+            Lista de tuplas (chunk_id, score) em ordem decrescente de score
+        """
+        query = parse_embedding(query_embedding)
+        if query is None:
+            return []
+
+        matrix = await self.get_matrix(session, organization_id, space)
+        return matrix.top_k(query, top_k)
+
+    def rerank_mmr(
+        self,
+        organization_id: int,
+        ranked: List[Tuple[int, float]],
+        k: int,
+        lambda_: float
+    ) -> List[Tuple[int, float]]:
+        """
+        Reordenar candidatos já ranqueados (id, score) por MMR
+
+        A relevância é o score do ranking normalizado pelo maior; a redundância
+        é o cosseno entre as embeddings da matriz (usar depois de search()).
+        """
+        matrix = self._orgs.get(organization_id)
+        if matrix is None or len(ranked) <= 1 or lambda_ >= 1.0:
+            return ranked[:k]
+
+        scores = np.asarray([score for _, score in ranked], dtype=np.float32)
+        top = float(scores.max())
+        relevance = scores / top if top > 0 else np.ones_like(scores)
+
+        chosen = mmr_select(relevance, matrix.vectors(i for i, _ in ranked), k, lambda_)
+
+        return [ranked[i] for i in chosen]
+
+    def add_chunks(
+        self,
+        organization_id: int,
+        chunks: List[Tuple[int, Optional[List[float]]]],
+        space: EmbeddingSpace
+    ):
+        """
+        Registrar trechos recém-inseridos (id, embedding) e evitar recarga na próxima busca
+        """
+        matrix = self._orgs.get(organization_id)
+        if matrix is None or matrix.space != space:
+            return
+
+        ids = []
+        vectors = []
+        for chunk_id, embedding in self._new_chunks(matrix, (c for c in chunks if c[1] is not None)):
+            vec = parse_embedding(embedding)
+            if vec is not None:
+                ids.append(chunk_id)
+                vectors.append(vec)
+
+        matrix.add(ids, vectors)
+
+    def _stats(self) -> Dict[str, Any]:
+        return {
+            "total_vectors": sum(len(m) for m in self._orgs.values()),
+            "memory_bytes": sum(m.matrix.nbytes + m.ids.nbytes for m in self._orgs.values())
+        }
+
+
+# Instância global do serviço
+knowledge_matrix_cache = KnowledgeMatrixCache()
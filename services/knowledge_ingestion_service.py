@@ -0,0 +1,320 @@
+"""
+Ingestão em massa da Knowledge Base (JSONL / arquivos markdown)
+
+Os registros são lidos do upload aos poucos (linha a linha no JSONL) e
+agrupados em lotes de KNOWLEDGE_BULK_BATCH_DOCS documentos. Para cada lote:
+
+1. os documentos são divididos em trechos (ver knowledge_chunk_service);
+2. as embeddings de todos os trechos saem numa chamada agenerate_embeddings
+   (requisições concorrentes), já em andamento enquanto o lote anterior grava;
+3. documentos (com a média das embeddings dos trechos na coluna legada, ver
+   document_embedding) e trechos entram com INSERT multi-linha (RETURNING id)
+   e o lote é confirmado na sua própria transação.
+
+Erros de um registro (JSON inválido, campos faltando) ou de um lote inteiro
+(falha no banco) são reportados por linha sem interromper o resto.
+"""
+import asyncio
+import json
+import logging
+from pathlib import PurePath
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import UploadFile
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from models.knowledge import Knowledge, KnowledgeChunk
+from services.bm25_index_service import bm25_index_cache
+from services.embedding_service import EmbeddingSpace, embedding_service, encode_embedding, estimate_tokens
+from services.embedding_version_service import embedding_version_service
+from services.knowledge_chunk_service import chunk_text, document_embedding
+from services.knowledge_index_service import knowledge_matrix_cache
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+MARKDOWN_SUFFIXES = (".md", ".markdown", ".txt")
+
+# (referência do registro — "arquivo:linha" —, documento ou mensagem de erro)
+Record = Tuple[str, Any]
+
+
+class RecordError(str):
+    """Mensagem de erro de um registro inválido"""
+
+
+def _validate(obj: Any, default_category: Optional[str]) -> Dict[str, Any]:
+    if not isinstance(obj, dict):
+        raise ValueError("registro deve ser um objeto JSON")
+
+    title = obj.get("title")
+    content = obj.get("content")
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("campo 'title' obrigatório")
+    if not isinstance(content, str) or not content.strip():
+        raise ValueError("campo 'content' obrigatório")
+
+    category = obj.get("category", default_category)
+    return {
+        "title": title.strip()[:255],
+        "category": str(category)[:100] if category else None,
+        "content": content,
+    }
+
+
+async def _iter_lines(upload: UploadFile) -> AsyncIterator[bytes]:
+    """Linhas do upload lidas em blocos (sem carregar o arquivo inteiro)"""
+    pending = b""
+    while True:
+        block = await upload.read(READ_SIZE)
+        if not block:
+            break
+        pending += block
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def iter_jsonl(upload: UploadFile, default_category: Optional[str] = None) -> AsyncIterator[Record]:
+    """Um documento por linha: {"title", "content", "category"?}"""
+    line_number = 0
+    async for line in _iter_lines(upload):
+        line_number += 1
+        ref = f"{upload.filename}:{line_number}"
+        if not line.strip():
+            continue
+        try:
+            yield ref, _validate(json.loads(line.decode("utf-8")), default_category)
+        except (ValueError, UnicodeDecodeError) as e:
+            yield ref, RecordError(str(e))
+
+
+async def iter_markdown(upload: UploadFile, default_category: Optional[str] = None) -> AsyncIterator[Record]:
+    """Um documento por arquivo; título = primeiro cabeçalho `# ` ou nome do arquivo"""
+    ref = upload.filename or "arquivo"
+    parts = []
+    async for line in _iter_lines(upload):
+        parts.append(line)
+
+    try:
+        content = b"\n".join(parts).decode("utf-8")
+    except UnicodeDecodeError as e:
+        yield ref, RecordError(str(e))
+        return
+
+    title = PurePath(ref).stem.replace("_", " ").title()
+    for line in content.splitlines():
+        if line.startswith("# "):
+            title = line[2:].strip() or title
+            break
+
+    try:
+        yield ref, _validate({"title": title, "content": content}, default_category)
+    except ValueError as e:
+        yield ref, RecordError(str(e))
+
+
+async def iter_uploads(files: List[UploadFile], default_category: Optional[str] = None) -> AsyncIterator[Record]:
+    """Registros de todos os arquivos (JSONL ou markdown, pela extensão)"""
+    for upload in files:
+        name = (upload.filename or "").lower()
+        if name.endswith((".jsonl", ".ndjson")):
+            records = iter_jsonl(upload, default_category)
+        elif name.endswith(MARKDOWN_SUFFIXES):
+            records = iter_markdown(upload, default_category)
+        else:
+            yield upload.filename or "arquivo", RecordError("formato não suportado (use .jsonl ou .md)")
+            continue
+
+        async for record in records:
+            yield record
+
+
+class KnowledgeIngestionService:
+    """
+    Serviço para ingestão em lote de documentos na knowledge
+    """
+
+    def __init__(self):
+        self.batch_docs = settings.knowledge_bulk_batch_docs
+        self.max_errors = settings.knowledge_bulk_max_errors
+
+    async def ingest(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        records: AsyncIterator[Record]
+    ) -> Dict[str, Any]:
+        """
+        Ingerir os registros em lotes (embedding do próximo lote em paralelo à gravação)
+
+        Returns:
+            Contagens (documentos, trechos, falhas) e erros por registro
+        """
+        report = {"received": 0, "inserted": 0, "chunks": 0, "chunks_without_embedding": 0,
+                  "failed": 0, "batches": 0, "errors": []}
+
+        batch: List[Tuple[str, Dict[str, Any]]] = []
+        pending = None
+
+        space = await embedding_version_service.pin_space(session, organization_id)
+        await session.commit()
+
+        async for ref, record in records:
+            report["received"] += 1
+            if isinstance(record, RecordError):
+                self._error(report, ref, record)
+                continue
+
+            batch.append((ref, record))
+            if len(batch) >= self.batch_docs:
+                task = asyncio.create_task(self.embed(batch, space))
+                if pending is not None:
+                    await self.store_batch(session, organization_id, *pending, report)
+                pending, batch = (batch, task, space), []
+
+        if batch:
+            task = asyncio.create_task(self.embed(batch, space))
+            if pending is not None:
+                await self.store_batch(session, organization_id, *pending, report)
+            pending = (batch, task, space)
+
+        if pending is not None:
+            await self.store_batch(session, organization_id, *pending, report)
+
+        logger.info(
+            f"Ingestão org {organization_id}: {report['inserted']} documentos, "
+            f"{report['chunks']} trechos, {report['failed']} falhas em {report['batches']} lotes"
+        )
+
+        return report
+
+    @staticmethod
+    async def embed(
+        batch: List[Tuple[str, Dict[str, Any]]],
+        space: EmbeddingSpace
+    ) -> Tuple[List[List[str]], List[Optional[List[float]]]]:
+        """Trechos de cada documento + embeddings de todos os trechos do lote"""
+        chunks = [chunk_text(doc["content"]) for _, doc in batch]
+        texts = [text for doc_chunks in chunks for text in doc_chunks]
+        embeddings = await embedding_service.agenerate_embeddings(texts, space=space) if texts else []
+        return chunks, embeddings
+
+    async def store_batch(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        batch: List[Tuple[str, Dict[str, Any]]],
+        embed_task: "asyncio.Future",
+        space: EmbeddingSpace,
+        report: Dict[str, Any]
+    ):
+        """
+        Gravar um lote (documentos + trechos) numa transação e atualizar os caches
+        """
+        report["batches"] += 1
+        try:
+            chunks, embeddings = await embed_task
+            doc_ids, chunk_ids = await self.write_batch(session, organization_id, batch, chunks, embeddings, space)
+            await session.commit()
+
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Erro ao gravar lote de {len(batch)} documentos: {e}")
+            for ref, _ in batch:
+                self._error(report, ref, f"falha ao gravar lote: {e}")
+            return
+
+        report["inserted"] += len(doc_ids)
+        report["chunks"] += len(chunk_ids)
+        report["chunks_without_embedding"] += sum(1 for embedding in embeddings if embedding is None)
+
+        self.update_caches(organization_id, batch, chunks, chunk_ids, embeddings, space)
+
+    @staticmethod
+    async def write_batch(
+        session: AsyncSession,
+        organization_id: int,
+        batch: List[Tuple[str, Dict[str, Any]]],
+        chunks: List[List[str]],
+        embeddings: List[Optional[List[float]]],
+        space: EmbeddingSpace
+    ) -> Tuple[List[int], List[int]]:
+        """
+        INSERT multi-linha dos documentos e trechos do lote (sem commit)
+
+        Returns:
+            (ids dos documentos, ids dos trechos) na ordem do lote
+        """
+        doc_rows = []
+        position = 0
+        for (_, doc), doc_chunks in zip(batch, chunks):
+            legacy = document_embedding(embeddings[position:position + len(doc_chunks)], space)
+            doc_rows.append({
+                **doc,
+                "organization_id": organization_id,
+                "embedding": legacy.get("embedding"),
+                "embedding_vec": legacy.get("embedding_vec"),
+            })
+            position += len(doc_chunks)
+
+        doc_ids = (await session.execute(
+            insert(Knowledge).returning(Knowledge.id, sort_by_parameter_order=True),
+            doc_rows
+        )).scalars().all()
+
+        chunk_rows = []
+        for doc_id, doc_chunks in zip(doc_ids, chunks):
+            for position, text in enumerate(doc_chunks):
+                embedding = embeddings[len(chunk_rows)]
+                chunk_rows.append({
+                    "knowledge_id": doc_id,
+                    "organization_id": organization_id,
+                    "chunk_index": position,
+                    "content": text,
+                    "token_count": estimate_tokens(text),
+                    "embedding_vec": encode_embedding(embedding),
+                    "embedding_model": space.tag if embedding is not None else None,
+                    "embedding_dim": space.dimensions if embedding is not None else None,
+                })
+
+        chunk_ids = (await session.execute(
+            insert(KnowledgeChunk).returning(KnowledgeChunk.id, sort_by_parameter_order=True),
+            chunk_rows
+        )).scalars().all() if chunk_rows else []
+
+        return doc_ids, chunk_ids
+
+    @staticmethod
+    def update_caches(
+        organization_id: int,
+        batch: List[Tuple[str, Dict[str, Any]]],
+        chunks: List[List[str]],
+        chunk_ids: List[int],
+        embeddings: List[Optional[List[float]]],
+        space: EmbeddingSpace
+    ):
+        """
+        Caches em memória deste worker (os demais sincronizam na próxima busca)
+        """
+        knowledge_matrix_cache.add_chunks(organization_id, list(zip(chunk_ids, embeddings)), space)
+        position = 0
+        for (_, doc), doc_chunks in zip(batch, chunks):
+            ids = chunk_ids[position:position + len(doc_chunks)]
+            bm25_index_cache.add_chunks(
+                organization_id, doc["title"], doc["category"], list(zip(ids, doc_chunks))
+            )
+            position += len(doc_chunks)
+
+    def _error(self, report: Dict[str, Any], ref: str, message: str):
+        report["failed"] += 1
+        if len(report["errors"]) < self.max_errors:
+            report["errors"].append({"row": ref, "error": str(message)})
+
+
+# Instância global do serviço
+knowledge_ingestion_service = KnowledgeIngestionService()
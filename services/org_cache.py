@@ -0,0 +1,180 @@
+"""
+Base dos caches em memória por organização
+
+OrgCache guarda uma entrada por organização, com lock asyncio por
+organização, invalidate e get_stats (usado pelo cache de respostas).
+
+ChunkSyncedCache acrescenta a sincronização com a tabela knowledge_chunks
+usada pela matriz de embeddings e pelo índice BM25: a cada acesso roda apenas
+um COUNT/MAX(id) da organização; trechos novos são carregados de forma
+incremental (id > último id visto) e qualquer divergência restante (ex.:
+remoção feita por outro worker) força recarga completa.
+
+As entradas de um ChunkSyncedCache precisam dos atributos `max_id` e
+`known_rows` (linhas da tabela já vistas, com ou sem dado útil).
+
+chunk_version é o mesmo COUNT/MAX(id), para caches que só precisam saber se
+o conteúdo da organização mudou (ex.: cache de respostas).
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.knowledge import KnowledgeChunk
+
+logger = logging.getLogger(__name__)
+
+
+async def chunk_version(
+    session: AsyncSession,
+    organization_id: int,
+    criteria: Sequence[Any] = ()
+) -> Tuple[int, int]:
+    """
+    (COUNT, MAX(id)) dos trechos da organização: muda a cada inserção,
+    remoção ou redivisão de documento
+    """
+    stmt = select(func.count(KnowledgeChunk.id), func.max(KnowledgeChunk.id)).where(
+        KnowledgeChunk.organization_id == organization_id,
+        *criteria
+    )
+    count, max_id = (await session.execute(stmt)).one()
+    return count or 0, max_id or 0
+
+
+class OrgCache:
+    """
+    Uma entrada por organização + lock por organização
+    """
+
+    def __init__(self):
+        self._orgs: Dict[int, Any] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _lock(self, organization_id: int) -> asyncio.Lock:
+        lock = self._locks.get(organization_id)
+        if lock is None:
+            lock = self._locks[organization_id] = asyncio.Lock()
+        return lock
+
+    def invalidate(self, organization_id: Optional[int] = None):
+        """
+        Descartar a entrada de uma organização (ou de todas)
+        """
+        if organization_id is None:
+            self._orgs.clear()
+        else:
+            self._orgs.pop(organization_id, None)
+
+    def _stats(self) -> Dict[str, Any]:
+        """Estatísticas específicas do cache (somadas às de get_stats)"""
+        return {}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Obter estatísticas do cache
+        """
+        return {"organizations": len(self._orgs), **self._stats()}
+
+
+class ChunkSyncedCache(OrgCache):
+    """
+    Cache por organização derivado de knowledge_chunks, sincronizado por COUNT/MAX(id)
+
+    Subclasses implementam _create, _load_rows, _remove e _describe.
+    """
+
+    # Nome usado nos logs (ex.: "Matriz", "Índice BM25")
+    label = "Cache"
+
+    def _create(self, key: Any) -> Any:
+        """Entrada vazia para a chave de sincronização (ex.: espaço de embeddings)"""
+        raise NotImplementedError
+
+    def _matches(self, entry: Any, key: Any) -> bool:
+        """A entrada residente ainda vale para a chave pedida?"""
+        return True
+
+    async def _load_rows(self, session: AsyncSession, organization_id: int, entry: Any, after_id: int = 0) -> int:
+        """Carregar linhas com id > after_id na entrada; retorna linhas lidas"""
+        raise NotImplementedError
+
+    def _remove(self, entry: Any, chunk_ids: Iterable[int]) -> int:
+        """Remover trechos da entrada; retorna quantos estavam nela"""
+        raise NotImplementedError
+
+    def _describe(self, entry: Any) -> str:
+        """Resumo da entrada para o log de carga completa"""
+        return f"{entry.known_rows} trechos"
+
+    async def _get_entry(
+        self,
+        session: AsyncSession,
+        organization_id: int,
+        key: Any = None,
+        criteria: Sequence[Any] = ()
+    ) -> Any:
+        """
+        Entrada da organização sincronizada com o banco
+
+        `criteria` restringe os trechos contados (deve bater com _load_rows).
+        """
+        async with self._lock(organization_id):
+            count, max_id = await chunk_version(session, organization_id, criteria)
+
+            entry = self._orgs.get(organization_id)
+            if entry is not None and not self._matches(entry, key):
+                entry = None
+
+            if entry is not None and entry.known_rows == count and entry.max_id == max_id:
+                return entry
+
+            if entry is not None and max_id > entry.max_id:
+                loaded = await self._load_rows(session, organization_id, entry, entry.max_id)
+                logger.info(f"{self.label} da org {organization_id}: +{loaded} trechos")
+
+                if entry.known_rows == count and entry.max_id == max_id:
+                    return entry
+
+            # Recarga completa (primeiro acesso ou remoções)
+            entry = self._create(key)
+            await self._load_rows(session, organization_id, entry)
+            self._orgs[organization_id] = entry
+
+            logger.info(f"{self.label} da org {organization_id} carregado: {self._describe(entry)}")
+
+            return entry
+
+    @staticmethod
+    def _track_rows(entry: Any, rows: List[Tuple]) -> int:
+        """Avançar max_id / known_rows com linhas lidas do banco (ordenadas por id)"""
+        if rows:
+            entry.max_id = max(entry.max_id, rows[-1][0])
+        entry.known_rows += len(rows)
+        return len(rows)
+
+    @staticmethod
+    def _new_chunks(entry: Any, chunks: Iterable[Tuple[int, Any]]) -> Iterator[Tuple[int, Any]]:
+        """
+        Trechos recém-inseridos (id, dado) ainda não vistos, em ordem de id;
+        cada um avança max_id / known_rows
+        """
+        for chunk_id, payload in sorted(chunks, key=lambda chunk: chunk[0]):
+            if chunk_id <= entry.max_id:
+                continue
+            entry.max_id = chunk_id
+            entry.known_rows += 1
+            yield chunk_id, payload
+
+    def remove_chunks(self, organization_id: int, chunk_ids: Iterable[int]):
+        """
+        Remover trechos apagados da entrada da organização
+        """
+        entry = self._orgs.get(organization_id)
+        if entry is None:
+            return
+
+        entry.known_rows -= self._remove(entry, chunk_ids)
@@ -3,11 +3,16 @@ Serviço RAG (Retrieval-Augmented Generation)
 """
 from typing import List, Dict, Any, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from database import KnowledgeBase
-from services.embedding_service import embedding_service
+from sqlalchemy import select, bindparam, any_, Integer, String
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import defer
+from config import settings
+from database import KnowledgeBase, KnowledgeTag
+from services.embedding_service import embedding_service, encode_embedding, decode_embedding
 from services.vector_store_service import vector_store_service
+from services.context_assembler import context_assembler
 from openai import OpenAI
+import numpy as np
 import logging
 import json
 
@@ -39,7 +44,7 @@ class RAGService:
         """
         try:
             # Gerar embedding
-            embedding = embedding_service.generate_embedding(content)
+            embedding = await embedding_service.agenerate_embedding(content)
             
             # Salvar no banco de dados
             knowledge = KnowledgeBase(
@@ -49,12 +54,20 @@ class RAGService:
                 source=source,
                 category=category,
                 tags=json.dumps(tags) if tags else None,
-                embedding=json.dumps(embedding)
+                embedding_vec=encode_embedding(embedding),
+                embedding_model=embedding_service.model if embedding is not None else None,
+                embedding_dim=len(embedding) if embedding is not None else None
             )
             
             db.add(knowledge)
             await db.flush()
             
+            # Tags normalizadas (índice organização + tag)
+            db.add_all([
+                KnowledgeTag(knowledge_id=knowledge.id, organization_id=organization_id, tag=tag)
+                for tag in dict.fromkeys(tags or []) if tag
+            ])
+            
             # Adicionar ao vector store
             vector_store_service.add_vector(
                 vector=embedding,
@@ -65,9 +78,7 @@ class RAGService:
                     "category": category
                 }
             )
-            
-            # Salvar índice
-            vector_store_service.save_index()
+            # (gravado no WAL do shard; o checkpoint do índice é periódico)
             
             await db.commit()
             
@@ -105,55 +116,65 @@ class RAGService:
             k = k or self.top_k
             
             # Gerar embedding da query
-            query_embedding = embedding_service.generate_embedding(query)
+            query_embedding = await embedding_service.agenerate_embedding(query)
             
-            # Buscar no vector store
-            results = vector_store_service.search(query_embedding, k=k * 2)
+            # Documentos com alguma das tags (index probe em knowledge_tags)
+            tagged = None
+            if tags_filter:
+                tagged = select(KnowledgeTag.knowledge_id).where(
+                    KnowledgeTag.organization_id == organization_id,
+                    KnowledgeTag.tag == any_(bindparam("tags", list(tags_filter), type_=ARRAY(String)))
+                )
+                
+                knowledge_results = await self._search_tagged(
+                    db, organization_id, query_embedding, k, category_filter, tagged
+                )
+                if knowledge_results is not None:
+                    logger.info(f"Busca por tags realizada: {len(knowledge_results)} resultados")
+                    return knowledge_results
             
-            # Filtrar por organização e buscar detalhes no banco
-            knowledge_results = []
+            # Buscar no shard da organização (folga para os filtros abaixo)
+            fetch = k * 2
+            quantized = vector_store_service.is_quantized(organization_id)
+            if quantized:
+                # Distâncias aproximadas: mais candidatos para o rescoring exato
+                fetch *= vector_store_service.rescore_factor
             
-            for idx, distance, metadata in results:
-                if metadata.get("organization_id") != organization_id:
-                    continue
-                
-                knowledge_id = metadata.get("knowledge_id")
-                if not knowledge_id:
-                    continue
-                
-                # Buscar no banco
-                query_builder = select(KnowledgeBase).where(
-                    KnowledgeBase.id == knowledge_id,
-                    KnowledgeBase.is_active == True
+            results = vector_store_service.search(organization_id, query_embedding, k=fetch)
+            if not results:
+                return []
+            
+            # Rank vetorial (knowledge_id → distância)
+            distances = {knowledge_id: distance for knowledge_id, distance, _ in results}
+            
+            # Uma única consulta para todos os candidatos, com os filtros no SQL
+            query_builder = select(KnowledgeBase).where(
+                KnowledgeBase.id == any_(bindparam("ids", list(distances), type_=ARRAY(Integer))),
+                KnowledgeBase.organization_id == organization_id,
+                KnowledgeBase.is_active == True
+            )
+            
+            if not quantized:
+                query_builder = query_builder.options(
+                    defer(KnowledgeBase.embedding),
+                    defer(KnowledgeBase.embedding_vec)
                 )
-                
-                # Aplicar filtro de categoria se fornecido
-                if category_filter:
-                    query_builder = query_builder.where(KnowledgeBase.category == category_filter)
-                
-                result = await db.execute(query_builder)
-                knowledge = result.scalar_one_or_none()
-                
-                # Aplicar filtro de tags se fornecido
-                if knowledge and tags_filter:
-                    knowledge_tags = json.loads(knowledge.tags) if knowledge.tags else []
-                    # Verificar se alguma tag do filtro está nas tags do conhecimento
-                    if not any(tag in knowledge_tags for tag in tags_filter):
-                        continue
-                
-                if knowledge:
-                    knowledge_results.append({
-                        "id": knowledge.id,
-                        "title": knowledge.title,
-                        "content": knowledge.content,
-                        "source": knowledge.source,
-                        "category": knowledge.category,
-                        "distance": distance,
-                        "similarity": 1 / (1 + distance)  # Converter distância em similaridade
-                    })
-                
-                if len(knowledge_results) >= k:
-                    break
+            
+            # Aplicar filtro de categoria se fornecido
+            if category_filter:
+                query_builder = query_builder.where(KnowledgeBase.category == category_filter)
+            
+            # Aplicar filtro de tags (muitos candidatos para o ranqueamento exato)
+            if tagged is not None:
+                query_builder = query_builder.where(KnowledgeBase.id.in_(tagged))
+            
+            result = await db.execute(query_builder)
+            rows = result.scalars().all()
+            
+            if quantized:
+                distances.update(self._exact_distances(query_embedding, rows))
+            
+            knowledge_results = self._format_results(rows, distances, k)
             
             logger.info(f"Busca realizada: {len(knowledge_results)} resultados")
             
@@ -163,6 +184,140 @@ class RAGService:
             logger.error(f"Erro ao buscar conhecimento: {e}")
             raise
     
+    async def _search_tagged(
+        self,
+        db: AsyncSession,
+        organization_id: int,
+        query_embedding: List[float],
+        k: int,
+        category_filter: Optional[str],
+        tagged
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Ranqueamento exato só entre os documentos com as tags
+        
+        Os candidatos vêm do índice de knowledge_tags, então documentos
+        personalizados (ex.: whitelist:<telefone>) não disputam espaço com o
+        resto da base no top-k do shard. Retorna None se houver mais de
+        RAG_TAG_PREFILTER_MAX candidatos (usar a busca no shard).
+        """
+        limit = settings.rag_tag_prefilter_max
+        
+        query_builder = select(KnowledgeBase.id, KnowledgeBase.embedding_vec).where(
+            KnowledgeBase.id.in_(tagged),
+            KnowledgeBase.organization_id == organization_id,
+            KnowledgeBase.is_active == True,
+            KnowledgeBase.embedding_vec.isnot(None)
+        ).limit(limit + 1)
+        
+        if category_filter:
+            query_builder = query_builder.where(KnowledgeBase.category == category_filter)
+        
+        candidates = (await db.execute(query_builder)).all()
+        if len(candidates) > limit:
+            return None
+        
+        query = np.asarray(query_embedding, dtype=np.float32)
+        candidates = [
+            (knowledge_id, raw) for knowledge_id, raw in candidates
+            if len(raw) == query.nbytes
+        ]
+        if not candidates:
+            return []
+        
+        ids = [knowledge_id for knowledge_id, _ in candidates]
+        vectors = np.vstack([decode_embedding(raw) for _, raw in candidates])
+        scores = ((vectors - query) ** 2).sum(axis=1)
+        top = np.argsort(scores)[:k]
+        distances = {ids[i]: float(scores[i]) for i in top}
+        
+        result = await db.execute(
+            select(KnowledgeBase).where(
+                KnowledgeBase.id == any_(bindparam("ids", list(distances), type_=ARRAY(Integer)))
+            ).options(
+                defer(KnowledgeBase.embedding),
+                defer(KnowledgeBase.embedding_vec)
+            )
+        )
+        
+        return self._format_results(result.scalars().all(), distances, k)
+    
+    @staticmethod
+    def _format_results(
+        rows: List[KnowledgeBase],
+        distances: Dict[int, float],
+        k: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Ordenar pelo rank vetorial e montar os resultados
+        """
+        rows = sorted(rows, key=lambda row: distances[row.id])[:k]
+        
+        return [
+            {
+                "id": knowledge.id,
+                "title": knowledge.title,
+                "content": knowledge.content,
+                "source": knowledge.source,
+                "category": knowledge.category,
+                "distance": distances[knowledge.id],
+                "similarity": 1 / (1 + distances[knowledge.id])  # Converter distância em similaridade
+            }
+            for knowledge in rows
+        ]
+    
+    @staticmethod
+    def _exact_distances(
+        query_embedding: List[float],
+        rows: List[KnowledgeBase]
+    ) -> Dict[int, float]:
+        """
+        Distância L2 exata (vetores float32 completos do banco) para os
+        candidatos vindos de um índice quantizado
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        
+        distances = {}
+        for row in rows:
+            if row.embedding_vec is not None:
+                vec = decode_embedding(row.embedding_vec)
+            elif row.embedding:
+                vec = np.asarray(json.loads(row.embedding), dtype=np.float32)
+            else:
+                continue
+            
+            if vec.shape == query.shape:
+                distances[row.id] = float(((vec - query) ** 2).sum())
+        
+        return distances
+    
+    async def recall_report(
+        self,
+        db: AsyncSession,
+        organization_id: int,
+        k: int = 10,
+        n_queries: int = 100
+    ) -> Dict[str, Any]:
+        """
+        Recall@k do shard (quantizado ou não) contra a busca exata nas embeddings do banco
+        """
+        rows = await db.execute(
+            select(KnowledgeBase.id, KnowledgeBase.embedding_vec).where(
+                KnowledgeBase.organization_id == organization_id,
+                KnowledgeBase.is_active == True,
+                KnowledgeBase.embedding_vec.isnot(None)
+            )
+        )
+        rows = rows.all()
+        
+        ids = np.array([knowledge_id for knowledge_id, _ in rows], dtype=np.int64)
+        vectors = (
+            np.vstack([decode_embedding(raw) for _, raw in rows])
+            if rows else np.empty((0, vector_store_service.dimension), dtype=np.float32)
+        )
+        
+        return vector_store_service.recall_report(organization_id, ids, vectors, k=k, n_queries=n_queries)
+    
     async def generate_with_context(
         self,
         db: AsyncSession,
@@ -182,11 +337,8 @@ class RAGService:
                 query=query
             )
             
-            # Montar contexto
-            context_text = "\n\n".join([
-                f"[{r['title']}]\n{r['content']}"
-                for r in context_results
-            ])
+            # Montar contexto (sem repetição, dentro do orçamento de tokens)
+            context_text = context_assembler.assemble(query, context_results).text()
             
             # Criar prompt enriquecido
             enriched_prompt = f"""Contexto relevante da base de conhecimento:
@@ -249,6 +401,9 @@ Responda baseando-se no contexto fornecido acima. Se o contexto não contiver in
             knowledge.is_active = False
             await db.commit()
             
+            # Tirar do vector store (tombstone até a próxima compactação)
+            vector_store_service.remove_vectors(organization_id, [knowledge_id])
+            
             logger.info(f"Conhecimento deletado: ID {knowledge_id}")
             
             return True
@@ -0,0 +1,104 @@
+"""
+Streaming de respostas do modelo via Server-Sent Events (SSE)
+
+Os tokens são repassados ao cliente à medida que chegam do stream da OpenAI:
+
+    event: token    data: {"content": "..."}        (um por pedaço)
+    event: done     data: {"sources": [...], ...}   (fim, com as fontes usadas)
+    event: error    data: {"detail": "..."}         (falha no meio do stream)
+"""
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi.responses import StreamingResponse
+from openai import AsyncOpenAI
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_async_client: Optional[AsyncOpenAI] = None
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """Cliente OpenAI assíncrono compartilhado (criado no primeiro uso)"""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncOpenAI(api_key=settings.openai_api_key or None)
+    return _async_client
+
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Formatar um evento SSE (data em JSON numa linha)"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """StreamingResponse text/event-stream sem buffer em proxies"""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+
+async def stream_chat_completion(
+    messages: List[Dict[str, str]],
+    model: str,
+    temperature: float,
+    max_tokens: Optional[int] = None
+) -> AsyncIterator[str]:
+    """
+    Gerar os pedaços de texto da resposta conforme o modelo produz
+
+    Se o cliente desconectar, o gerador é fechado e a conexão com a OpenAI
+    é encerrada junto (sem continuar pagando tokens).
+    """
+    params = {"model": model, "messages": messages, "temperature": temperature, "stream": True}
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+
+    stream = await get_async_openai_client().chat.completions.create(**params)
+
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
+    finally:
+        await stream.response.aclose()
+
+
+async def stream_answer_events(
+    tokens: AsyncIterator[str],
+    final: Dict[str, Any],
+    on_complete=None
+) -> AsyncIterator[str]:
+    """
+    Converter os pedaços em eventos SSE, terminando com o evento `done`
+
+    `on_complete(answer)` é chamado com a resposta completa antes do `done`
+    (ex.: guardar no cache); não é chamado se o stream falhar.
+    """
+    parts = []
+    try:
+        async for content in tokens:
+            parts.append(content)
+            yield sse_event({"content": content}, event="token")
+    except Exception as e:
+        logger.error(f"Erro no streaming da resposta: {e}")
+        yield sse_event({"detail": str(e)}, event="error")
+        return
+
+    answer = "".join(parts)
+    if on_complete is not None:
+        on_complete(answer)
+
+    yield sse_event({**final, "answer": answer}, event="done")
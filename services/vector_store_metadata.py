@@ -0,0 +1,232 @@
+"""
+Metadata colunar dos shards FAISS (substitui o pickle de dicts)
+
+Cada checkpoint grava três arquivos por shard:
+
+- `<prefixo>.npy`    array estruturado ordenado por id (knowledge_id,
+                     organization_id, código da categoria, offset/tamanho do título)
+- `<prefixo>.titles` blob UTF-8 com os títulos concatenados
+- `<prefixo>.json`   tabela de categorias + cabeçalho do shard (tombstones, seq)
+
+Os dois primeiros são abertos com np.memmap: a carga é imediata e as páginas
+são compartilhadas entre os workers. Alterações posteriores ao checkpoint
+ficam num overlay em memória até a próxima gravação.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+METADATA_DTYPE = np.dtype([
+    ("knowledge_id", "<i8"),
+    ("organization_id", "<i4"),
+    ("category", "<i2"),  # índice em categories (-1 = sem categoria)
+    ("title_offset", "<i8"),
+    ("title_len", "<i4"),
+])
+
+FIELDS = ("knowledge_id", "organization_id", "title", "category")
+
+
+def metadata_paths(prefix: Path) -> Tuple[Path, Path, Path]:
+    return Path(f"{prefix}.npy"), Path(f"{prefix}.titles"), Path(f"{prefix}.json")
+
+
+class ShardMetadata:
+    """
+    Mapa knowledge_id → metadata sobre as colunas mapeadas em memória
+
+    Interface de dict (get, pop, `in`, atribuição); só os campos em FIELDS
+    são persistidos.
+    """
+
+    def __init__(
+        self,
+        rows: Optional[np.ndarray] = None,
+        titles: Optional[np.ndarray] = None,
+        categories: Optional[List[str]] = None
+    ):
+        self._rows = rows if rows is not None else np.empty(0, dtype=METADATA_DTYPE)
+        self._titles = titles if titles is not None else np.empty(0, dtype=np.uint8)
+        self._categories = categories or []
+
+        # Alterações desde o checkpoint
+        self._overlay: Dict[int, Dict[str, Any]] = {}
+        self._removed: set = set()
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    def _base_position(self, knowledge_id: int) -> int:
+        ids = self._rows["knowledge_id"]
+        pos = int(np.searchsorted(ids, knowledge_id))
+        if pos < len(ids) and int(ids[pos]) == knowledge_id:
+            return pos
+        return -1
+
+    def _base_row(self, pos: int) -> Dict[str, Any]:
+        row = self._rows[pos]
+        start = int(row["title_offset"])
+        title = bytes(self._titles[start:start + int(row["title_len"])]).decode("utf-8")
+        code = int(row["category"])
+
+        return {
+            "knowledge_id": int(row["knowledge_id"]),
+            "organization_id": int(row["organization_id"]),
+            "title": title,
+            "category": self._categories[code] if code >= 0 else None,
+        }
+
+    def get(self, knowledge_id: int, default=None) -> Optional[Dict[str, Any]]:
+        knowledge_id = int(knowledge_id)
+
+        metadata = self._overlay.get(knowledge_id)
+        if metadata is not None:
+            return metadata
+        if knowledge_id in self._removed:
+            return default
+
+        pos = self._base_position(knowledge_id)
+        return self._base_row(pos) if pos >= 0 else default
+
+    def __contains__(self, knowledge_id) -> bool:
+        knowledge_id = int(knowledge_id)
+        if knowledge_id in self._overlay:
+            return True
+        if knowledge_id in self._removed:
+            return False
+        return self._base_position(knowledge_id) >= 0
+
+    def __getitem__(self, knowledge_id: int) -> Dict[str, Any]:
+        metadata = self.get(knowledge_id)
+        if metadata is None:
+            raise KeyError(knowledge_id)
+        return metadata
+
+    def __len__(self) -> int:
+        overlay_only = sum(
+            1 for k in self._overlay
+            if k in self._removed or self._base_position(k) < 0
+        )
+        return len(self._rows) - len(self._removed) + overlay_only
+
+    def keys(self) -> Iterator[int]:
+        for knowledge_id in self._rows["knowledge_id"].tolist():
+            if knowledge_id not in self._removed and knowledge_id not in self._overlay:
+                yield knowledge_id
+        yield from list(self._overlay)
+
+    def items(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for knowledge_id in self.keys():
+            yield knowledge_id, self[knowledge_id]
+
+    # ------------------------------------------------------------------
+    # Escrita (overlay)
+    # ------------------------------------------------------------------
+
+    def __setitem__(self, knowledge_id: int, metadata: Dict[str, Any]):
+        self._overlay[int(knowledge_id)] = {k: metadata.get(k) for k in FIELDS}
+
+    def pop(self, knowledge_id: int, default=None):
+        knowledge_id = int(knowledge_id)
+        metadata = self.get(knowledge_id)
+        if metadata is None:
+            return default
+
+        self._overlay.pop(knowledge_id, None)
+        if self._base_position(knowledge_id) >= 0:
+            self._removed.add(knowledge_id)
+
+        return metadata
+
+    def snapshot(self) -> "ShardMetadata":
+        """
+        Cópia das alterações (o base, somente leitura, é compartilhado) para
+        gravar fora do lock enquanto o shard segue recebendo escritas
+        """
+        copy = ShardMetadata(self._rows, self._titles, list(self._categories))
+        copy._overlay = dict(self._overlay)
+        copy._removed = set(self._removed)
+        return copy
+
+    # ------------------------------------------------------------------
+    # Persistência
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def from_dict(cls, metadata: Dict[int, Dict[str, Any]]) -> "ShardMetadata":
+        shard_metadata = cls()
+        for knowledge_id, meta in metadata.items():
+            shard_metadata[knowledge_id] = meta
+        return shard_metadata
+
+    @classmethod
+    def load(cls, prefix: Path) -> Tuple["ShardMetadata", Dict[str, Any]]:
+        """
+        Abrir as colunas com memmap; retorna (metadata, cabeçalho)
+        """
+        rows_path, titles_path, header_path = metadata_paths(prefix)
+
+        header = json.loads(header_path.read_text())
+        rows = np.load(rows_path, mmap_mode="r")
+        titles = (
+            np.memmap(titles_path, dtype=np.uint8, mode="r")
+            if titles_path.stat().st_size else np.empty(0, dtype=np.uint8)
+        )
+
+        return cls(rows, titles, header.pop("categories", [])), header
+
+    def write(self, prefix: Path, header: Dict[str, Any]):
+        """
+        Gravar base + overlay em arquivos novos (troca atômica)
+
+        As linhas do base são copiadas em bloco; só o overlay passa por Python.
+        """
+        replaced = self._removed.union(self._overlay)
+        keep = np.ones(len(self._rows), dtype=bool)
+        if replaced and len(self._rows):
+            keep = ~np.isin(self._rows["knowledge_id"], np.fromiter(replaced, dtype=np.int64))
+
+        kept = np.array(self._rows[keep], dtype=METADATA_DTYPE)
+
+        # Reempacotar os títulos mantidos (sem os buracos das remoções)
+        lens = kept["title_len"].astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lens)[:-1]]).astype(np.int64)
+        gather = np.repeat(kept["title_offset"] - offsets, lens) + np.arange(int(lens.sum()))
+        chunks = [np.asarray(self._titles)[gather].tobytes()]
+        kept["title_offset"] = offsets
+        offset = int(lens.sum())
+
+        categories = {category: code for code, category in enumerate(self._categories)}
+        added = np.zeros(len(self._overlay), dtype=METADATA_DTYPE)
+
+        for i, (knowledge_id, metadata) in enumerate(self._overlay.items()):
+            title = (metadata.get("title") or "").encode("utf-8")
+            category = metadata.get("category")
+
+            added[i] = (
+                knowledge_id,
+                metadata.get("organization_id") or 0,
+                categories.setdefault(category, len(categories)) if category is not None else -1,
+                offset,
+                len(title),
+            )
+            chunks.append(title)
+            offset += len(title)
+
+        rows = np.concatenate([kept, added])
+        rows = rows[np.argsort(rows["knowledge_id"], kind="stable")]
+
+        rows_path, titles_path, header_path = metadata_paths(prefix)
+        tmp = [Path(f"{p}.tmp") for p in (rows_path, titles_path, header_path)]
+
+        with open(tmp[0], "wb") as f:
+            np.save(f, rows)
+        tmp[1].write_bytes(b"".join(chunks))
+        tmp[2].write_text(json.dumps({**header, "categories": list(categories)}, ensure_ascii=False))
+
+        for src, dst in zip(tmp, (rows_path, titles_path, header_path)):
+            os.replace(src, dst)
@@ -1,222 +1,1522 @@
 """
 Serviço de Vector Store com FAISS
+
+Um índice por organização (shard), criado sob demanda, com metadata própria
+e persistência em disco por shard. Apenas os `max_resident_shards` shards
+usados mais recentemente ficam em memória (LRU).
+
+Os vetores são indexados pelo `knowledge_id` (IndexIDMap2). Remoções entram
+num conjunto de tombstones filtrado na busca; quando os tombstones passam do
+limite, uma compactação em background reconstrói o índice sem eles.
+
+Shards pequenos usam busca exata (Flat). Ao passar de `ann_threshold`
+vetores, o shard é promovido em background para IVF-Flat ou HNSW, treinado
+com uma amostra dos próprios vetores. Os parâmetros de cada shard ficam em
+`org_<id>_params.json`; `nprobe`/`efSearch` podem ser ajustados em runtime.
+A metadata fica em arquivos colunares mapeados em memória (ver
+vector_store_metadata).
+
+Cada shard pode guardar os vetores quantizados (SQ8: 4x menor, PQ: até 16x)
+em vez de float32. Nesse caso a busca devolve candidatos extras para serem
+reordenados com os vetores completos do banco (ver RAGService).
+
+Gerações e múltiplos workers:
+
+- cada checkpoint publica uma geração nova do shard (`org_<id>.g<N>.*`) e
+  troca o ponteiro `org_<id>.current` por rename atômico;
+- o índice base da geração é aberto com mmap somente leitura, então as
+  páginas ficam no page cache e são compartilhadas entre os processos;
+- escritas de qualquer worker são anexadas ao WAL da geração (lock fcntl por
+  shard, ver vector_store_wal) e aplicadas num índice delta (Flat em memória);
+- só o processo que detém `writer.lock` faz checkpoints e reconstruções; os
+  demais percebem a geração nova na próxima operação e trocam sem reiniciar;
+- o writer roda um checkpoint periódico (start_checkpoints) que também
+  publica os shards escritos só por outros workers.
 """
 import faiss
+import fcntl
 import numpy as np
 import pickle
+import json
+import math
 import os
-from typing import List, Tuple, Dict, Any, Optional
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, List, Tuple, Dict, Any, Optional, Set
 from pathlib import Path
 import logging
 
+from config import settings
+from services.vector_store_metadata import ShardMetadata, metadata_paths
+from services.vector_store_wal import (
+    ShardWAL, OP_ADD, OP_DELETE, OP_SPEC,
+    encode_add, decode_add, encode_delete, decode_delete, encode_spec, decode_spec
+)
+
 logger = logging.getLogger(__name__)
 
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+QUANTIZATIONS = ("none", "sq8", "pq")
+
+# Mínimo de vetores de treino do PQ (2^8 centróides por sub-quantizador)
+PQ_MIN_TRAINING = 256
+
+# Leitura do base: códigos mapeados do arquivo, sem cópia (FAISS >= 1.11).
+# Em versões anteriores só as listas invertidas (IVF) ficam mapeadas; Flat/HNSW
+# são copiados para a memória privada de cada worker.
+MMAP_ZERO_COPY = hasattr(faiss, "IO_FLAG_MMAP_IFC")
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# Intervalo entre tentativas de assumir o papel de writer (segundos)
+WRITER_RETRY_INTERVAL = 5.0
+
+# Intervalo máximo entre passadas do checkpoint periódico (segundos)
+CHECKPOINT_TICK = 30.0
+
+# Arquivos de uma geração gravados antes da publicação (ver _stage)
+STAGED_SUFFIX = ".staged"
+
+
+def _index_ids(index) -> np.ndarray:
+    """ids externos de um IndexIDMap2, na ordem interna do índice"""
+    return faiss.vector_to_array(index.id_map).astype(np.int64)
+
+
+def _codes_mapped(index) -> bool:
+    """Os códigos de um base lido com MMAP_FLAGS ficam de fato no arquivo mapeado?"""
+    return MMAP_ZERO_COPY or faiss.try_extract_index_ivf(faiss.downcast_index(index.index)) is not None
+
+
+def _reconstruct(index, start: int, n: int) -> np.ndarray:
+    """Vetores [start, start+n) do índice interno de um IndexIDMap2"""
+    sub = faiss.downcast_index(index.index)
+
+    ivf = faiss.try_extract_index_ivf(sub)
+    if ivf is not None and ivf.direct_map.no():
+        ivf.make_direct_map()
+
+    return sub.reconstruct_n(start, n)
+
+
+class TenantShard:
+    """
+    Índice FAISS + metadata de uma organização
+
+    `base` é o índice da geração (imutável, possivelmente mapeado do disco);
+    `delta` recebe os vetores gravados depois dela. `tombstones` são ids cuja
+    cópia no base não vale mais (removidos ou regravados no delta).
+    """
+
+    def __init__(
+        self,
+        organization_id: int,
+        generation: int,
+        base,
+        metadata: ShardMetadata,
+        spec: Dict[str, Any],
+        tombstones: Optional[Set[int]] = None,
+        seq: int = 0,
+        base_path: Optional[Path] = None
+    ):
+        self.organization_id = organization_id
+        self.generation = generation
+        self.base = base
+        self.base_path = base_path  # arquivo mapeado (None = base em memória)
+        self.mapped = base_path is not None and _codes_mapped(base)
+        self.base_ids = np.sort(_index_ids(base))
+        self.delta = faiss.IndexIDMap2(faiss.IndexFlatL2(base.d))
+        self.delta_ids: Set[int] = set()
+        self.metadata = metadata
+        self.spec = spec
+        self.tombstones: Set[int] = tombstones or set()
+        self.dirty = False
+
+        # WAL da geração: último seq aplicado e bytes já lidos
+        self.wal: Optional[ShardWAL] = None
+        self.wal_offset = 0
+        self.seq = seq
+        self.current_stamp: Optional[Tuple[int, int]] = None
+        self.checkpointed_at = time.monotonic()
+
+        self.rebuilding = False
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.base.ntotal) + int(self.delta.ntotal)
+
+    @property
+    def live_count(self) -> int:
+        return self.ntotal - len(self.tombstones)
+
+    def in_base(self, knowledge_id: int) -> bool:
+        pos = int(np.searchsorted(self.base_ids, knowledge_id))
+        return pos < len(self.base_ids) and int(self.base_ids[pos]) == knowledge_id
+
 
 class VectorStoreService:
     """
-    Serviço para armazenar e buscar vetores usando FAISS
+    Serviço para armazenar e buscar vetores usando FAISS (um shard por organização)
     """
-    
+
     def __init__(
         self,
         dimension: int = 1536,
-        index_path: Optional[str] = None
+        index_dir: Optional[str] = None,
+        max_resident_shards: Optional[int] = None,
+        legacy_index_path: Optional[str] = None,
+        mmap: Optional[bool] = None
     ):
         self.dimension = dimension
-        self.index_path = index_path or "/home/ubuntu/ft9-whatsapp/data/faiss_index"
-        self.metadata_path = f"{self.index_path}_metadata.pkl"
-        
+        self.index_dir = Path(index_dir or settings.vector_store_dir)
+        self.max_resident_shards = max_resident_shards or settings.vector_store_max_shards
+        self.compact_ratio = settings.vector_store_compact_ratio
+        self.compact_min = settings.vector_store_compact_min
+        self.wal_max_bytes = settings.vector_store_wal_max_bytes
+        self.checkpoint_interval = settings.vector_store_checkpoint_interval
+        self.wal_fsync = settings.vector_store_wal_fsync
+        self.use_mmap = settings.vector_store_mmap if mmap is None else mmap
+        if self.use_mmap and not MMAP_ZERO_COPY:
+            logger.warning(
+                f"FAISS {faiss.__version__} sem IO_FLAG_MMAP_IFC: só índices IVF ficam mapeados; "
+                f"Flat/HNSW são lidos na memória de cada worker (requer faiss-cpu >= 1.11)"
+            )
+
+        # Promoção para índice aproximado
+        self.ann_type = settings.vector_store_ann_type
+        self.ann_threshold = settings.vector_store_ann_threshold
+        self.train_sample = settings.vector_store_train_sample
+
+        if self.ann_type not in INDEX_TYPES:
+            logger.warning(f"VECTOR_STORE_ANN_TYPE inválido ({self.ann_type}), usando flat")
+            self.ann_type = "flat"
+
+        # Quantização
+        self.quantization = settings.vector_store_quantization
+        self.quantize_min = settings.vector_store_quantize_min
+        self.pq_m = settings.vector_store_pq_m or self._auto_pq_m(dimension)
+        self.rescore_factor = settings.vector_store_rescore_factor
+
+        if self.quantization not in QUANTIZATIONS:
+            logger.warning(f"VECTOR_STORE_QUANTIZATION inválido ({self.quantization}), usando none")
+            self.quantization = "none"
+
+        self._shards: "OrderedDict[int, TenantShard]" = OrderedDict()
+        self._lock = threading.RLock()
+
+        # Eleição do writer entre processos
+        self._writer_file = None
+        self._writer_retry_at = 0.0
+
+        # Checkpoint periódico (ver start_checkpoints)
+        self._checkpoint_thread: Optional[threading.Thread] = None
+        self._checkpoint_stop = threading.Event()
+
         # Criar diretório se não existir
-        Path(self.index_path).parent.mkdir(parents=True, exist_ok=True)
-        
-        # Inicializar ou carregar índice
-        if os.path.exists(self.index_path):
-            self.load_index()
-        else:
-            self.create_index()
-    
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+
+        # Índice global antigo (antes do sharding) → dividir por organização
+        if self.is_writer:
+            self._migrate_legacy_index(
+                legacy_index_path or "/home/ubuntu/ft9-whatsapp/data/faiss_index"
+            )
+
+    # ------------------------------------------------------------------
+    # Fábrica de índices
+    # ------------------------------------------------------------------
+
+    def default_spec(self, index_type: str = "flat") -> Dict[str, Any]:
+        """
+        Parâmetros padrão de um shard
+        """
+        return {
+            "type": index_type,
+            "nlist": settings.vector_store_ivf_nlist,
+            "nprobe": settings.vector_store_nprobe,
+            "hnsw_m": settings.vector_store_hnsw_m,
+            "ef_construction": settings.vector_store_ef_construction,
+            "ef_search": settings.vector_store_ef_search,
+            "quantization": self.quantization,  # configurado para o shard
+            "codec": "none",                     # efetivamente em uso no índice
+            "pq_m": self.pq_m,
+            "trained_on": 0,
+        }
+
+    @staticmethod
+    def _auto_pq_m(dimension: int) -> int:
+        # 4 dimensões por sub-quantizador → 1 byte a cada 16 bytes float32
+        m = max(1, dimension // 4)
+        while dimension % m:
+            m -= 1
+        return m
+
+    def _effective_codec(self, quantization: str, n: int) -> str:
+        """
+        Codec possível com n vetores (shards pequenos ficam em float32)
+        """
+        if quantization == "none" or n < self.quantize_min:
+            return "none"
+        if quantization == "pq" and n < PQ_MIN_TRAINING:
+            return "sq8"
+        return quantization
+
+    @staticmethod
+    def _auto_nlist(n: int) -> int:
+        # ~4·√n listas, com pelo menos ~39 vetores de treino por centróide
+        return max(1, min(int(4 * math.sqrt(n)), n // 39, 65536))
+
+    def _factory_string(self, spec: Dict[str, Any]) -> str:
+        codec = spec.get("codec", "none")
+        pq = f"PQ{spec.get('pq_m') or self.pq_m}"
+
+        if spec["type"] == "ivf":
+            storage = {"none": "Flat", "sq8": "SQ8", "pq": pq}[codec]
+            return f"IDMap2,IVF{spec['nlist']},{storage}"
+        if spec["type"] == "hnsw":
+            suffix = {"none": "", "sq8": "_SQ8", "pq": f"_{pq}"}[codec]
+            return f"IDMap2,HNSW{spec['hnsw_m']}{suffix}"
+        return {"none": "IDMap2,Flat", "sq8": "IDMap2,SQ8", "pq": f"IDMap2,{pq}"}[codec]
+
+    @staticmethod
+    def is_quantized_spec(spec: Dict[str, Any]) -> bool:
+        return spec.get("codec", "none") != "none"
+
+    @staticmethod
+    def bytes_per_vector(spec: Dict[str, Any], dimension: int) -> int:
+        codec = spec.get("codec", "none")
+        if codec == "sq8":
+            return dimension
+        if codec == "pq":
+            return int(spec.get("pq_m") or dimension // 4)
+        return 4 * dimension
+
+    def build_index(self, spec: Dict[str, Any], training_vectors: Optional[np.ndarray] = None):
+        """
+        Criar índice vazio para o spec, treinado com a amostra se necessário
+        """
+        n = len(training_vectors) if training_vectors is not None else 0
+
+        if spec["type"] == "ivf" and not spec.get("nlist"):
+            spec["nlist"] = self._auto_nlist(n)
+
+        spec["codec"] = self._effective_codec(spec.get("quantization", "none"), n)
+
+        index = faiss.index_factory(self.dimension, self._factory_string(spec), faiss.METRIC_L2)
+
+        sub = faiss.downcast_index(index.index)
+        if spec["type"] == "hnsw":
+            sub.hnsw.efConstruction = spec["ef_construction"]
+
+        if not index.is_trained:
+            if training_vectors is None or len(training_vectors) == 0:
+                raise ValueError(f"Índice {spec['type']} requer vetores de treino")
+            index.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+            spec["trained_on"] = int(len(training_vectors))
+
+        self._apply_search_params(index, spec)
+
+        return index
+
+    @staticmethod
+    def _apply_search_params(index, spec: Dict[str, Any], overrides: Optional[Dict[str, int]] = None):
+        params = {"nprobe": spec.get("nprobe"), "ef_search": spec.get("ef_search")}
+        params.update({k: v for k, v in (overrides or {}).items() if v is not None})
+
+        sub = faiss.downcast_index(index.index)
+
+        ivf = faiss.try_extract_index_ivf(sub)
+        if ivf is not None and params["nprobe"]:
+            ivf.nprobe = int(params["nprobe"])
+
+        if hasattr(sub, "hnsw") and params["ef_search"]:
+            sub.hnsw.efSearch = int(params["ef_search"])
+
     def create_index(self):
         """
-        Criar novo índice FAISS
+        Criar novo índice FAISS (busca exata) indexado por knowledge_id
+        """
+        return self.build_index(self.default_spec())
+
+    def _target_spec(self, shard: TenantShard) -> Optional[Dict[str, Any]]:
+        """
+        Spec para o qual o shard deve ser promovido (None = manter)
+        """
+        live = shard.live_count
+        current = shard.spec["type"]
+
+        # Quantização configurada ainda não aplicada (shards que encolhem mantêm o codec)
+        quantization = shard.spec.get("quantization", "none")
+        codec = self._effective_codec(quantization, live)
+        if codec != shard.spec.get("codec", "none") and (codec != "none" or quantization == "none"):
+            target = dict(shard.spec)
+            if current == "ivf":
+                target.update(nlist=0, trained_on=0)
+            promoted = self._promotion_spec(shard)
+            return {**target, **(promoted or {})}
+
+        return self._promotion_spec(shard)
+
+    def _promotion_spec(self, shard: TenantShard) -> Optional[Dict[str, Any]]:
+        """
+        Spec aproximado para shards que passaram do limite (None = manter)
         """
-        # Usar IndexFlatL2 para busca exata (pode ser otimizado depois)
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.metadata = []
-        
-        logger.info(f"Novo índice FAISS criado com dimensão {self.dimension}")
-    
-    def load_index(self):
+        live = shard.live_count
+        current = shard.spec["type"]
+
+        if self.ann_type == "flat" or live < self.ann_threshold:
+            return None
+
+        if current == "flat":
+            return {**self.default_spec(self.ann_type), "nprobe": shard.spec.get("nprobe"),
+                    "ef_search": shard.spec.get("ef_search"),
+                    "quantization": shard.spec.get("quantization", self.quantization)}
+
+        # IVF treinado com poucos vetores perde qualidade: retreinar ao crescer 4x
+        if current == "ivf" and live >= 4 * max(shard.spec.get("trained_on", 0), 1):
+            return {**shard.spec, "nlist": 0, "trained_on": 0}
+
+        return None
+
+    # ------------------------------------------------------------------
+    # Processos: writer e locks
+    # ------------------------------------------------------------------
+
+    @property
+    def is_writer(self) -> bool:
         """
-        Carregar índice existente
+        Processo responsável por checkpoints/reconstruções (lock em writer.lock)
+
+        Os demais tentam assumir periodicamente, caso o writer termine.
         """
+        if self._writer_file is not None:
+            return True
+
+        now = time.monotonic()
+        if now < self._writer_retry_at:
+            return False
+        self._writer_retry_at = now + WRITER_RETRY_INTERVAL
+
+        f = open(self.index_dir / "writer.lock", "a+")
         try:
-            self.index = faiss.read_index(self.index_path)
-            
-            with open(self.metadata_path, 'rb') as f:
-                self.metadata = pickle.load(f)
-            
-            logger.info(f"Índice FAISS carregado: {self.index.ntotal} vetores")
-        
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+
+        self._writer_file = f
+        logger.info(f"Processo {os.getpid()} assumiu as escritas do vector store")
+
+        return True
+
+    @contextmanager
+    def _shard_lock(self, organization_id: int):
+        """
+        Lock exclusivo do shard entre processos (WAL e publicação de gerações)
+        """
+        with open(self.index_dir / f"org_{organization_id}.lock", "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # ------------------------------------------------------------------
+    # Arquivos / gerações
+    # ------------------------------------------------------------------
+
+    def _gen_paths(self, organization_id: int, generation: int) -> Tuple[Path, Path, Path, Path]:
+        """(índice, prefixo da metadata colunar, parâmetros, WAL) da geração"""
+        # Geração 0 = nomes sem sufixo (formato anterior às gerações)
+        suffix = f".g{generation}" if generation else ""
+        base = self.index_dir / f"org_{organization_id}"
+        return (
+            Path(f"{base}{suffix}.faiss"),
+            Path(f"{base}_meta{suffix}"),
+            Path(f"{base}_params{suffix}.json"),
+            Path(f"{base}{suffix}.wal"),
+        )
+
+    def _current_path(self, organization_id: int) -> Path:
+        return self.index_dir / f"org_{organization_id}.current"
+
+    def _legacy_metadata_path(self, organization_id: int) -> Path:
+        return self.index_dir / f"org_{organization_id}_metadata.pkl"
+
+    def _current_stamp(self, organization_id: int) -> Optional[Tuple[int, int]]:
+        try:
+            st = self._current_path(organization_id).stat()
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _read_current(self, organization_id: int) -> Tuple[int, Optional[Tuple[int, int]]]:
+        """(geração publicada, carimbo do ponteiro)"""
+        stamp = self._current_stamp(organization_id)
+        if stamp is None:
+            return 0, None
+        try:
+            current = json.loads(self._current_path(organization_id).read_text())
+        except FileNotFoundError:
+            return 0, None
+        return int(current["generation"]), stamp
+
+    def _staged_paths(self, organization_id: int, generation: int) -> List[Tuple[Path, Path]]:
+        """(arquivo .staged, destino) do índice, metadata e parâmetros da geração"""
+        index_path, metadata_prefix, params_path, _ = self._gen_paths(organization_id, generation)
+        staged_prefix = Path(f"{metadata_prefix}{STAGED_SUFFIX}")
+        return [
+            (Path(f"{index_path}{STAGED_SUFFIX}"), index_path),
+            *zip(metadata_paths(staged_prefix), metadata_paths(metadata_prefix)),
+            (Path(f"{params_path}{STAGED_SUFFIX}"), params_path),
+        ]
+
+    def _remove_generation(self, organization_id: int, generation: int):
+        if generation < 0:
+            return
+
+        index_path, metadata_prefix, params_path, wal_path = self._gen_paths(organization_id, generation)
+        paths = [index_path, *metadata_paths(metadata_prefix), params_path, wal_path]
+        paths.extend(staged for staged, _ in self._staged_paths(organization_id, generation))
+        if generation == 0:
+            paths.append(self._legacy_metadata_path(organization_id))
+
+        for path in paths:
+            if path.exists():
+                path.unlink()
+
+    # ------------------------------------------------------------------
+    # Carga
+    # ------------------------------------------------------------------
+
+    def _read_base_index(self, path: Path):
+        """
+        Ler o índice base: mmap somente leitura, ou em memória se não suportado
+        """
+        if self.use_mmap:
+            try:
+                return faiss.read_index(str(path), MMAP_FLAGS), path
+            except Exception as e:
+                logger.warning(f"mmap indisponível para {path.name}, lendo em memória: {e}")
+        return faiss.read_index(str(path)), None
+
+    def _load_shard(self, organization_id: int, exclusive: bool = False) -> TenantShard:
+        """
+        Carregar a geração publicada do shard (base + replay do WAL)
+        """
+        for _ in range(3):
+            generation, stamp = self._read_current(organization_id)
+            try:
+                shard = self._load_generation(organization_id, generation)
+            except FileNotFoundError:
+                # Geração substituída durante a leitura → tentar a nova
+                continue
+            except Exception as e:
+                logger.error(f"Erro ao carregar shard da org {organization_id}: {e}")
+                shard = TenantShard(
+                    organization_id, generation, self.create_index(), ShardMetadata(), self.default_spec()
+                )
+                shard.wal = ShardWAL(self._gen_paths(organization_id, generation)[3], fsync=self.wal_fsync)
+
+            shard.current_stamp = stamp
+            if stamp is not None:
+                # Idade da geração publicada (por qualquer processo), não da carga
+                age = max(0.0, time.time() - stamp[1] / 1e9)
+                shard.checkpointed_at = time.monotonic() - age
+            replayed = shard.seq
+            if not self._catch_up(shard, exclusive):
+                logger.warning(f"WAL da org {organization_id} com lacuna de seq; replay interrompido")
+            replayed = shard.seq - replayed
+
+            logger.info(
+                f"Shard FAISS da org {organization_id} carregado (geração {generation}): "
+                f"{shard.live_count} vetores ({shard.spec['type']}), {replayed} operações do WAL"
+            )
+
+            return shard
+
+        raise RuntimeError(f"Não foi possível carregar o shard da org {organization_id}")
+
+    def _load_generation(self, organization_id: int, generation: int) -> TenantShard:
+        index_path, metadata_prefix, params_path, wal_path = self._gen_paths(organization_id, generation)
+
+        if not index_path.exists():
+            if generation:
+                raise FileNotFoundError(index_path)
+
+            logger.info(f"Novo shard FAISS criado para org {organization_id} (dimensão {self.dimension})")
+            shard = TenantShard(organization_id, 0, self.create_index(), ShardMetadata(), self.default_spec())
+
+        else:
+            spec = self.default_spec()
+            if params_path.exists():
+                spec.update(json.loads(params_path.read_text()))
+
+            if metadata_paths(metadata_prefix)[0].exists():
+                base, base_path = self._read_base_index(index_path)
+                metadata, header = ShardMetadata.load(metadata_prefix)
+                shard = TenantShard(
+                    organization_id,
+                    generation,
+                    base,
+                    metadata,
+                    spec,
+                    set(header.get("tombstones", ())),
+                    header.get("seq", 0),
+                    base_path
+                )
+            else:
+                shard = self._load_pickled_shard(organization_id, faiss.read_index(str(index_path)), spec)
+
+            self._apply_search_params(shard.base, shard.spec)
+
+        shard.wal = ShardWAL(wal_path, fsync=self.wal_fsync)
+
+        return shard
+
+    def _load_pickled_shard(self, organization_id: int, index, spec: Dict[str, Any]) -> TenantShard:
+        """
+        Shard salvo com a metadata em pickle (convertido no próximo checkpoint)
+        """
+        with open(self._legacy_metadata_path(organization_id), 'rb') as f:
+            stored = pickle.load(f)
+
+        if isinstance(stored, list):
+            # Formato antigo: ids posicionais + lista de metadata
+            return self._upgrade_positional_shard(organization_id, index, stored)
+
+        shard = TenantShard(
+            organization_id,
+            0,
+            index,
+            ShardMetadata.from_dict(stored["metadata"]),
+            spec,
+            set(stored.get("tombstones", ())),
+            stored.get("seq", 0)
+        )
+        shard.dirty = True
+
+        return shard
+
+    def _upgrade_positional_shard(
+        self,
+        organization_id: int,
+        index,
+        metadata: List[Dict[str, Any]]
+    ) -> TenantShard:
+        """
+        Converter shard com ids posicionais para índice por knowledge_id
+        """
+        base = self.create_index()
+        shard_metadata = ShardMetadata()
+
+        if index.ntotal:
+            vectors = index.reconstruct_n(0, index.ntotal)
+            rows = [
+                (pos, meta) for pos, meta in enumerate(metadata[:index.ntotal])
+                if meta.get("knowledge_id") is not None
+            ]
+            if rows:
+                ids = np.array([meta["knowledge_id"] for _, meta in rows], dtype=np.int64)
+                base.add_with_ids(vectors[[pos for pos, _ in rows]], ids)
+                for _, meta in rows:
+                    shard_metadata[meta["knowledge_id"]] = meta
+
+        shard = TenantShard(organization_id, 0, base, shard_metadata, self.default_spec())
+        shard.dirty = True
+
+        return shard
+
+    def get_shard(self, organization_id: int, exclusive: bool = False) -> TenantShard:
+        """
+        Obter shard da organização (carrega sob demanda, LRU de residentes)
+
+        O shard residente é sincronizado com o disco: operações gravadas por
+        outros workers e gerações novas são aplicadas antes de retornar.
+        """
+        with self._lock:
+            shard = self._shards.get(organization_id)
+
+            if shard is not None:
+                self._shards.move_to_end(organization_id)
+                return self._sync(shard, exclusive)
+
+            shard = self._load_shard(organization_id, exclusive)
+            self._shards[organization_id] = shard
+
+            while len(self._shards) > self.max_resident_shards:
+                evicted_id, evicted = self._shards.popitem(last=False)
+                # Nada se perde: as operações do shard já estão no WAL
+                if evicted.wal is not None:
+                    evicted.wal.close()
+                logger.info(f"Shard da org {evicted_id} descarregado da memória")
+
+            return shard
+
+    def _sync(self, shard: TenantShard, exclusive: bool = False) -> TenantShard:
+        """
+        Aplicar operações novas do WAL ou trocar para a geração publicada
+        """
+        organization_id = shard.organization_id
+
+        if (
+            self._current_stamp(organization_id) == shard.current_stamp
+            and shard.wal.size >= shard.wal_offset
+            and self._catch_up(shard, exclusive)
+        ):
+            return shard
+
+        fresh = self._load_shard(organization_id, exclusive)
+        shard.wal.close()
+        if organization_id in self._shards:
+            self._shards[organization_id] = fresh
+
+        logger.info(f"Shard da org {organization_id} trocado para a geração {fresh.generation}")
+
+        return fresh
+
+    def _catch_up(self, shard: TenantShard, exclusive: bool = False) -> bool:
+        """
+        Aplicar os registros do WAL ainda não vistos (False = lacuna de seq)
+        """
+        records, end = shard.wal.read(shard.wal_offset)
+
+        applied = 0
+        for seq, op, payload in records:
+            if seq <= shard.seq:
+                continue
+            if seq != shard.seq + 1:
+                return False
+
+            self._apply_record(shard, op, payload)
+            shard.seq = seq
+            applied += 1
+
+        shard.wal_offset = end
+        if exclusive:
+            shard.wal.repair(end)
+
+        if applied:
+            shard.dirty = True
+            self._maybe_rebuild(shard)
+
+        return True
+
+    def _migrate_legacy_index(self, legacy_index_path: str):
+        """
+        Dividir o índice global antigo em shards por organização
+        """
+        legacy_metadata_path = f"{legacy_index_path}_metadata.pkl"
+
+        if not os.path.exists(legacy_index_path) or not os.path.exists(legacy_metadata_path):
+            return
+
+        try:
+            index = faiss.read_index(legacy_index_path)
+            with open(legacy_metadata_path, 'rb') as f:
+                metadata = pickle.load(f)
+
+            vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else None
+
+            by_org: Dict[int, List[int]] = {}
+            for pos, meta in enumerate(metadata[:index.ntotal]):
+                org_id = meta.get("organization_id")
+                if org_id is not None and meta.get("knowledge_id") is not None:
+                    by_org.setdefault(org_id, []).append(pos)
+
+            with self._lock:
+                for org_id, positions in by_org.items():
+                    self.add_vectors_batch(
+                        vectors[positions],
+                        [
+                            {k: v for k, v in metadata[pos].items() if k != "id"}
+                            for pos in positions
+                        ]
+                    )
+                    self._checkpoint(self.get_shard(org_id))
+
+            os.replace(legacy_index_path, f"{legacy_index_path}.migrated")
+            os.replace(legacy_metadata_path, f"{legacy_metadata_path}.migrated")
+
+            logger.info(f"Índice global migrado para {len(by_org)} shards por organização")
+
         except Exception as e:
-            logger.error(f"Erro ao carregar índice: {e}")
-            self.create_index()
-    
-    def save_index(self):
+            logger.error(f"Erro ao migrar índice global para shards: {e}")
+
+    # ------------------------------------------------------------------
+    # Persistência (gerações)
+    # ------------------------------------------------------------------
+
+    def save_index(self, organization_id: Optional[int] = None):
         """
-        Salvar índice no disco
+        Checkpoint dos shards alterados (todos, ou só o da organização)
+
+        Só o writer publica gerações; nos demais workers as operações já
+        estão duráveis no WAL.
         """
+        if not self.is_writer:
+            return
+
         try:
-            faiss.write_index(self.index, self.index_path)
-            
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump(self.metadata, f)
-            
-            logger.info(f"Índice FAISS salvo: {self.index.ntotal} vetores")
-        
+            with self._lock:
+                if organization_id is not None:
+                    shard = self._shards.get(organization_id)
+                    shards = [shard] if shard is not None else []
+                else:
+                    shards = list(self._shards.values())
+
+                for shard in shards:
+                    if shard.dirty and not shard.rebuilding:
+                        self._checkpoint(shard)
+
         except Exception as e:
             logger.error(f"Erro ao salvar índice: {e}")
             raise
-    
+
+    def _materialize_base(self, shard: TenantShard):
+        """
+        Cópia do base em memória (o base mapeado é somente leitura)
+        """
+        if shard.base_path is not None:
+            return faiss.read_index(str(shard.base_path))
+        return faiss.clone_index(shard.base)
+
+    def _checkpoint(self, shard: TenantShard) -> TenantShard:
+        """
+        Incorporar o delta num novo índice base e publicar a geração
+        """
+        if shard.spec["type"] != "flat" and shard.tombstones & shard.delta_ids:
+            # IVF/HNSW não removem a cópia antiga de ids regravados → reconstruir
+            self._maybe_rebuild(shard, force=True)
+            return shard
+
+        base = self._materialize_base(shard)
+        tombstones = set(shard.tombstones)
+
+        if shard.spec["type"] == "flat" and tombstones:
+            base.remove_ids(faiss.IDSelectorBatch(np.fromiter(tombstones, dtype=np.int64)))
+            tombstones = set()
+
+        if shard.delta.ntotal:
+            base.add_with_ids(_reconstruct(shard.delta, 0, shard.delta.ntotal), _index_ids(shard.delta))
+
+        return self._publish(shard, base, shard.spec, tombstones, shard.seq)
+
+    def _stage(
+        self,
+        organization_id: int,
+        generation: int,
+        index,
+        metadata: ShardMetadata,
+        spec: Dict[str, Any],
+        tombstones: Set[int],
+        base_seq: int
+    ):
+        """
+        Gravar índice, metadata e parâmetros da geração como `.staged`
+
+        A parte cara da publicação (serializar o índice); os arquivos só
+        ficam visíveis no rename feito por _publish.
+        """
+        (index_tmp, _), _, _, _, (params_tmp, _) = self._staged_paths(organization_id, generation)
+        _, metadata_prefix, _, _ = self._gen_paths(organization_id, generation)
+
+        faiss.write_index(index, str(index_tmp))
+        metadata.write(Path(f"{metadata_prefix}{STAGED_SUFFIX}"), {"tombstones": sorted(tombstones), "seq": base_seq})
+        params_tmp.write_text(json.dumps(spec))
+
+    def _publish(
+        self,
+        shard: TenantShard,
+        index,
+        spec: Dict[str, Any],
+        tombstones: Set[int],
+        base_seq: int,
+        staged: bool = False
+    ) -> TenantShard:
+        """
+        Gravar uma geração nova (base até `base_seq`) e apontar `current` para ela
+
+        As operações do WAL posteriores a `base_seq` são copiadas para o WAL da
+        geração nova. Com staged=True os arquivos já foram gravados por _stage
+        (fora do lock global) e aqui só são renomeados. Retorna o shard
+        recarregado da geração publicada.
+        """
+        organization_id = shard.organization_id
+        expected_generation = shard.generation
+
+        with self._shard_lock(organization_id):
+            shard = self._sync(shard, exclusive=True)
+            if shard.generation != expected_generation:
+                logger.info(f"Publicação da org {organization_id} descartada (geração mudou)")
+                if staged:
+                    for path, _ in self._staged_paths(organization_id, expected_generation + 1):
+                        path.unlink(missing_ok=True)
+                return shard
+
+            generation = shard.generation + 1
+            if not staged:
+                self._stage(organization_id, generation, index, shard.metadata, spec, tombstones, base_seq)
+
+            for path, target in self._staged_paths(organization_id, generation):
+                os.replace(path, target)
+
+            wal_path = self._gen_paths(organization_id, generation)[3]
+            records, _ = shard.wal.read(0)
+            ShardWAL.create(wal_path, [r for r in records if r[0] > base_seq], fsync=self.wal_fsync).close()
+
+            # Ponteiro da geração: a troca é o rename
+            current_path = self._current_path(organization_id)
+            tmp_current = Path(f"{current_path}.tmp")
+            tmp_current.write_text(json.dumps({"generation": generation}))
+            os.replace(tmp_current, current_path)
+
+            # Mantém a geração anterior para leitores que ainda não trocaram
+            self._remove_generation(organization_id, generation - 2)
+
+            fresh = self._sync(shard, exclusive=True)
+
+        logger.info(
+            f"Shard FAISS da org {organization_id} publicado (geração {generation}): "
+            f"{fresh.live_count} vetores"
+        )
+
+        return fresh
+
+    # ------------------------------------------------------------------
+    # Remoção / compactação / promoção
+    # ------------------------------------------------------------------
+
+    def _live_vectors(self, shard: TenantShard) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (ids, vetores) válidos do shard: base sem os tombstones + delta
+        """
+        ids = [np.empty(0, dtype=np.int64)]
+        vectors = [np.empty((0, self.dimension), dtype=np.float32)]
+
+        if shard.base.ntotal:
+            base_ids = _index_ids(shard.base)
+            base_vectors = _reconstruct(shard.base, 0, shard.base.ntotal)
+            if shard.tombstones:
+                tombstones = np.fromiter(shard.tombstones, dtype=np.int64, count=len(shard.tombstones))
+                keep = ~np.isin(base_ids, tombstones)
+                base_ids, base_vectors = base_ids[keep], base_vectors[keep]
+            ids.append(base_ids)
+            vectors.append(base_vectors)
+
+        if shard.delta.ntotal:
+            ids.append(_index_ids(shard.delta))
+            vectors.append(_reconstruct(shard.delta, 0, shard.delta.ntotal))
+
+        return np.concatenate(ids), np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+
+    def _build_from(
+        self,
+        spec: Dict[str, Any],
+        ids: np.ndarray,
+        vectors: np.ndarray
+    ):
+        """
+        Montar índice do spec com os vetores (treina com uma amostra)
+        """
+        training = None
+        needs_training = spec["type"] != "flat" or spec.get("quantization", "none") != "none"
+        if needs_training and len(vectors):
+            if len(vectors) > self.train_sample:
+                rng = np.random.default_rng(0)
+                training = vectors[rng.choice(len(vectors), self.train_sample, replace=False)]
+            else:
+                training = vectors
+
+        index = self.build_index(spec, training)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+
+        return index
+
+    def _maybe_rebuild(self, shard: TenantShard, force: bool = False):
+        """
+        Agendar reconstrução em background (compactação e/ou promoção) — só no writer
+        """
+        if shard.rebuilding or not self.is_writer:
+            return
+
+        target = self._target_spec(shard)
+        threshold = max(self.compact_min, int(self.compact_ratio * shard.ntotal))
+
+        if not force and target is None and len(shard.tombstones) < threshold:
+            return
+
+        shard.rebuilding = True
+        threading.Thread(
+            target=self._rebuild_shard,
+            args=(shard, target or dict(shard.spec)),
+            name=f"faiss-rebuild-org-{shard.organization_id}",
+            daemon=True
+        ).start()
+
+    def _rebuild_shard(self, shard: TenantShard, spec: Dict[str, Any]):
+        """
+        Reconstruir o índice sem os tombstones, no spec indicado (background)
+
+        Só o snapshot (até o seq atual) e a troca da geração usam o lock
+        global. O índice novo é montado e treinado sem lock e gravado só com o
+        lock do shard (_stage). Na troca entram no WAL novo as operações
+        feitas nesse intervalo.
+        """
+        organization_id = shard.organization_id
+        try:
+            with self._lock:
+                generation = shard.generation
+                base_seq = shard.seq
+                ids, vectors = self._live_vectors(shard)
+                metadata = shard.metadata.snapshot()
+                previous_type = f"{shard.spec['type']}/{shard.spec.get('codec', 'none')}"
+
+                # Ajustes de busca/quantização já aplicados (os posteriores vêm do WAL)
+                for key in ("nprobe", "ef_search", "quantization"):
+                    if key in shard.spec:
+                        spec[key] = shard.spec[key]
+
+            new_index = self._build_from(spec, ids, vectors)
+            self._apply_search_params(new_index, spec)
+
+            with self._shard_lock(organization_id):
+                self._stage(organization_id, generation + 1, new_index, metadata, spec, set(), base_seq)
+
+            with self._lock:
+                if shard.generation != generation or self._shards.get(organization_id) is not shard:
+                    for path, _ in self._staged_paths(organization_id, generation + 1):
+                        path.unlink(missing_ok=True)
+                    logger.info(f"Reconstrução da org {organization_id} descartada (shard trocado)")
+                    return
+
+                fresh = self._publish(shard, new_index, spec, set(), base_seq, staged=True)
+
+            logger.info(
+                f"Shard da org {organization_id} reconstruído "
+                f"({previous_type} → {spec['type']}/{spec.get('codec', 'none')}): "
+                f"{fresh.live_count} vetores"
+            )
+
+        except Exception as e:
+            logger.error(f"Erro ao reconstruir shard da org {organization_id}: {e}")
+
+        finally:
+            shard.rebuilding = False
+
+    def _maybe_checkpoint(self, shard: TenantShard) -> TenantShard:
+        """
+        Publicar geração quando o WAL cresce demais ou o intervalo vence (só no writer)
+        """
+        if not shard.dirty or shard.rebuilding or not self.is_writer:
+            return shard
+
+        elapsed = time.monotonic() - shard.checkpointed_at
+        if shard.wal.size >= self.wal_max_bytes or elapsed >= self.checkpoint_interval:
+            return self._checkpoint(shard)
+
+        return shard
+
+    def _pending_wal_orgs(self) -> List[int]:
+        """Organizações cujo WAL da geração publicada tem operações no disco"""
+        orgs = set()
+        for path in self.index_dir.glob("org_*.wal"):
+            try:
+                organization_id = int(path.name[4:].split(".", 1)[0])
+                if path.stat().st_size == 0:
+                    continue
+            except (ValueError, FileNotFoundError):
+                continue
+            if path == self._gen_paths(organization_id, self._read_current(organization_id)[0])[3]:
+                orgs.add(organization_id)
+        return sorted(orgs)
+
+    def run_checkpoints(self) -> int:
+        """
+        Passada do checkpoint periódico (só no writer)
+
+        Cobre os shards residentes e os que só outros workers escreveram: o
+        shard é sincronizado com o WAL e publicado se o WAL passou de
+        VECTOR_STORE_WAL_MAX_BYTES ou a geração de VECTOR_STORE_CHECKPOINT_INTERVAL.
+
+        Returns:
+            Número de shards publicados
+        """
+        if not self.is_writer:
+            return 0
+
+        with self._lock:
+            organization_ids = set(self._shards)
+        organization_ids.update(self._pending_wal_orgs())
+
+        published = 0
+        for organization_id in sorted(organization_ids):
+            try:
+                with self._lock:
+                    shard = self.get_shard(organization_id)
+                    if self._maybe_checkpoint(shard) is not shard:
+                        published += 1
+            except Exception as e:
+                logger.error(f"Erro no checkpoint periódico da org {organization_id}: {e}")
+
+        return published
+
+    def _checkpoint_loop(self):
+        tick = max(1.0, min(float(self.checkpoint_interval), CHECKPOINT_TICK))
+        while not self._checkpoint_stop.wait(tick):
+            try:
+                self.run_checkpoints()
+            except Exception as e:
+                logger.error(f"Erro no checkpoint periódico do vector store: {e}")
+
+    def start_checkpoints(self):
+        """
+        Iniciar a thread do checkpoint periódico (startup do app)
+
+        Roda em todos os processos; só o writer publica, e um processo que
+        assume writer.lock passa a fazer os checkpoints sem precisar escrever.
+        """
+        if self._checkpoint_thread is not None:
+            return
+
+        self._checkpoint_stop.clear()
+        self._checkpoint_thread = threading.Thread(
+            target=self._checkpoint_loop, name="faiss-checkpoint", daemon=True
+        )
+        self._checkpoint_thread.start()
+
+    def stop_checkpoints(self):
+        """Parar a thread do checkpoint periódico"""
+        if self._checkpoint_thread is None:
+            return
+
+        self._checkpoint_stop.set()
+        self._checkpoint_thread.join()
+        self._checkpoint_thread = None
+
+    # ------------------------------------------------------------------
+    # Operações (WAL + aplicação em memória)
+    # ------------------------------------------------------------------
+
+    def _append(self, organization_id: int, op: int, payload: bytes, apply) -> Tuple[TenantShard, Any]:
+        """
+        Anexar a operação ao WAL (com o lock do shard) e aplicá-la no shard
+        """
+        with self._shard_lock(organization_id):
+            shard = self.get_shard(organization_id, exclusive=True)
+
+            shard.seq += 1
+            shard.wal.append(shard.seq, op, payload)
+            shard.wal_offset = shard.wal.size
+            shard.dirty = True
+
+            result = apply(shard)
+
+        return shard, result
+
+    def _write(self, organization_id: int, op: int, payload: bytes, apply) -> Tuple[TenantShard, Any]:
+        """
+        Operação completa: WAL + aplicação + compactação/checkpoint se for a hora
+        """
+        shard, result = self._append(organization_id, op, payload, apply)
+
+        self._maybe_rebuild(shard)
+        shard = self._maybe_checkpoint(shard)
+
+        return shard, result
+
+    def _apply_record(self, shard: TenantShard, op: int, payload: bytes):
+        if op == OP_ADD:
+            self._apply_add(shard, *decode_add(payload, self.dimension))
+        elif op == OP_DELETE:
+            self._apply_delete(shard, decode_delete(payload))
+        elif op == OP_SPEC:
+            shard.spec.update(decode_spec(payload))
+            self._apply_search_params(shard.base, shard.spec)
+
+    @staticmethod
+    def _drop_current(shard: TenantShard, ids: np.ndarray):
+        """
+        Invalidar a cópia atual dos ids (tombstone no base, remoção no delta)
+        """
+        in_delta = [i for i in ids.tolist() if i in shard.delta_ids]
+        if in_delta:
+            shard.delta.remove_ids(faiss.IDSelectorBatch(np.array(in_delta, dtype=np.int64)))
+            shard.delta_ids.difference_update(in_delta)
+
+        for knowledge_id in ids.tolist():
+            if shard.in_base(knowledge_id):
+                shard.tombstones.add(knowledge_id)
+
+    def _apply_add(
+        self,
+        shard: TenantShard,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        metadatas: List[Dict[str, Any]]
+    ):
+        ids = np.asarray(ids, dtype=np.int64)
+        self._drop_current(shard, ids)
+
+        shard.delta.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), ids)
+        shard.delta_ids.update(ids.tolist())
+
+        for knowledge_id, metadata in zip(ids.tolist(), metadatas):
+            shard.metadata[knowledge_id] = metadata
+
+    def _apply_delete(self, shard: TenantShard, ids: np.ndarray) -> int:
+        ids = np.asarray(ids, dtype=np.int64)
+        removed = sum(1 for i in ids.tolist() if shard.metadata.pop(i, None) is not None)
+        self._drop_current(shard, ids)
+        return removed
+
+    def remove_vectors(self, organization_id: int, knowledge_ids: Iterable[int]) -> int:
+        """
+        Marcar vetores como removidos (tombstones) e agendar compactação
+
+        Returns:
+            Quantidade de vetores marcados
+        """
+        try:
+            ids = np.array(list(knowledge_ids), dtype=np.int64)
+            removed = 0
+
+            with self._lock:
+                if ids.size:
+                    _, removed = self._write(
+                        organization_id,
+                        OP_DELETE,
+                        encode_delete(ids),
+                        lambda shard: self._apply_delete(shard, ids)
+                    )
+
+            logger.info(f"{removed} vetores marcados como removidos na org {organization_id}")
+
+            return removed
+
+        except Exception as e:
+            logger.error(f"Erro ao remover vetores: {e}")
+            raise
+
+    # ------------------------------------------------------------------
+    # Escrita / busca
+    # ------------------------------------------------------------------
+
     def add_vector(
         self,
         vector: List[float],
         metadata: Dict[str, Any]
     ) -> int:
         """
-        Adicionar vetor ao índice
+        Adicionar vetor ao shard da organização em metadata["organization_id"]
+
+        metadata["knowledge_id"] é o id do vetor no índice.
         """
-        try:
-            # Converter para numpy array
-            vec = np.array([vector], dtype=np.float32)
-            
-            # Adicionar ao índice
-            idx = self.index.ntotal
-            self.index.add(vec)
-            
-            # Adicionar metadata
-            self.metadata.append({
-                "id": idx,
-                **metadata
-            })
-            
-            logger.info(f"Vetor adicionado ao índice: ID {idx}")
-            
-            return idx
-        
-        except Exception as e:
-            logger.error(f"Erro ao adicionar vetor: {e}")
-            raise
-    
+        return self.add_vectors_batch([vector], [metadata])[0]
+
     def add_vectors_batch(
         self,
         vectors: List[List[float]],
         metadatas: List[Dict[str, Any]]
     ) -> List[int]:
         """
-        Adicionar múltiplos vetores em batch
+        Adicionar múltiplos vetores em batch (agrupados por organização)
+
+        Um knowledge_id já existente no shard é substituído.
         """
         try:
-            # Converter para numpy array
-            vecs = np.array(vectors, dtype=np.float32)
-            
-            # Adicionar ao índice
-            start_idx = self.index.ntotal
-            self.index.add(vecs)
-            
-            # Adicionar metadatas
-            ids = []
+            vecs = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+
+            by_org: Dict[int, List[int]] = {}
             for i, metadata in enumerate(metadatas):
-                idx = start_idx + i
-                self.metadata.append({
-                    "id": idx,
-                    **metadata
-                })
-                ids.append(idx)
-            
-            logger.info(f"{len(vectors)} vetores adicionados ao índice")
-            
-            return ids
-        
+                if metadata.get("knowledge_id") is None:
+                    raise ValueError("metadata sem knowledge_id")
+                by_org.setdefault(metadata["organization_id"], []).append(i)
+
+            with self._lock:
+                for org_id, positions in by_org.items():
+                    ids = np.array(
+                        [metadatas[i]["knowledge_id"] for i in positions],
+                        dtype=np.int64
+                    )
+                    org_vecs = vecs[positions]
+                    org_metas = [dict(metadatas[i]) for i in positions]
+
+                    self._write(
+                        org_id,
+                        OP_ADD,
+                        encode_add(ids, org_vecs, org_metas),
+                        lambda shard: self._apply_add(shard, ids, org_vecs, org_metas)
+                    )
+
+            logger.info(f"{len(metadatas)} vetores adicionados em {len(by_org)} shards")
+
+            return [metadata["knowledge_id"] for metadata in metadatas]
+
         except Exception as e:
             logger.error(f"Erro ao adicionar vetores em batch: {e}")
             raise
-    
+
     def search(
         self,
+        organization_id: int,
         query_vector: List[float],
-        k: int = 5
+        k: int = 5,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None
     ) -> List[Tuple[int, float, Dict[str, Any]]]:
         """
-        Buscar k vetores mais similares
-        
+        Buscar os k vetores mais similares no shard da organização
+
+        nprobe / ef_search sobrescrevem os parâmetros do shard só nesta busca.
+
         Returns:
-            Lista de tuplas (id, distance, metadata)
+            Lista de tuplas (knowledge_id, distance, metadata)
         """
         try:
-            # Converter para numpy array
             query = np.array([query_vector], dtype=np.float32)
-            
-            # Buscar
-            distances, indices = self.index.search(query, k)
-            
-            # Montar resultados
-            results = []
-            for i, (idx, distance) in enumerate(zip(indices[0], distances[0])):
-                if idx < len(self.metadata):
-                    results.append((
-                        int(idx),
-                        float(distance),
-                        self.metadata[idx]
-                    ))
-            
-            logger.info(f"Busca realizada: {len(results)} resultados")
-            
+            overrides = {"nprobe": nprobe, "ef_search": ef_search}
+
+            with self._lock:
+                shard = self.get_shard(organization_id)
+
+                if shard.live_count <= 0:
+                    return []
+
+                candidates = []
+
+                if shard.base.ntotal:
+                    # Folga para os tombstones ainda não compactados
+                    fetch = min(k + len(shard.tombstones), shard.base.ntotal)
+
+                    if nprobe is not None or ef_search is not None:
+                        self._apply_search_params(shard.base, shard.spec, overrides)
+                    try:
+                        distances, ids = shard.base.search(query, fetch)
+                    finally:
+                        if nprobe is not None or ef_search is not None:
+                            self._apply_search_params(shard.base, shard.spec)
+
+                    candidates.extend(
+                        (float(distance), int(knowledge_id))
+                        for knowledge_id, distance in zip(ids[0], distances[0])
+                        if knowledge_id >= 0 and int(knowledge_id) not in shard.tombstones
+                    )
+
+                if shard.delta.ntotal:
+                    distances, ids = shard.delta.search(query, min(k, shard.delta.ntotal))
+                    candidates.extend(
+                        (float(distance), int(knowledge_id))
+                        for knowledge_id, distance in zip(ids[0], distances[0])
+                        if knowledge_id >= 0
+                    )
+
+                candidates.sort()
+
+                results = []
+                for distance, knowledge_id in candidates:
+                    metadata = shard.metadata.get(knowledge_id)
+                    if metadata is None:
+                        continue
+
+                    results.append((knowledge_id, distance, metadata))
+                    if len(results) >= k:
+                        break
+
+            logger.info(f"Busca realizada na org {organization_id}: {len(results)} resultados")
+
             return results
-        
+
         except Exception as e:
             logger.error(f"Erro ao buscar vetores: {e}")
             raise
-    
+
+    def is_quantized(self, organization_id: int) -> bool:
+        """
+        Indica se o shard guarda vetores quantizados (distâncias aproximadas)
+        """
+        with self._lock:
+            return self.is_quantized_spec(self.get_shard(organization_id).spec)
+
+    def set_quantization(
+        self,
+        organization_id: int,
+        quantization: str,
+        wait: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Definir a quantização do shard (none | sq8 | pq) e reconstruir
+
+        Com wait=True a reconstrução roda na thread atual (scripts/relatórios);
+        fora do processo writer a reconstrução fica para o writer.
+        """
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Quantização inválida: {quantization}")
+
+        def apply(shard: TenantShard):
+            shard.spec["quantization"] = quantization
+
+        with self._lock:
+            if wait and self.is_writer:
+                shard, _ = self._append(
+                    organization_id, OP_SPEC, encode_spec({"quantization": quantization}), apply
+                )
+
+                target = None if shard.rebuilding else self._target_spec(shard)
+                if target is not None:
+                    shard.rebuilding = True
+                    self._rebuild_shard(shard, target)
+            else:
+                if wait:
+                    logger.warning("set_quantization(wait=True) fora do writer: reconstrução fica para o writer")
+                self._write(organization_id, OP_SPEC, encode_spec({"quantization": quantization}), apply)
+
+            return dict(self.get_shard(organization_id).spec)
+
+    def recall_report(
+        self,
+        organization_id: int,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        k: int = 10,
+        n_queries: int = 100
+    ) -> Dict[str, Any]:
+        """
+        Comparar a busca do shard com a busca exata sobre os vetores completos
+
+        `ids`/`vectors` são os vetores float32 originais (ex.: lidos do banco);
+        uma amostra deles é usada como query. Reporta recall@k da busca crua e
+        após o rescoring exato de `k * rescore_factor` candidatos.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return {"queries": 0}
+
+        exact = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+        exact.add_with_ids(vectors, ids)
+        by_id = {int(i): pos for pos, i in enumerate(ids)}
+
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(ids), min(n_queries, len(ids)), replace=False)
+
+        raw_hits = rescored_hits = total = 0
+        for pos in sample:
+            query = vectors[pos]
+            _, truth = exact.search(query[None, :], k)
+            truth = set(int(i) for i in truth[0] if i >= 0)
+
+            raw = [kid for kid, _, _ in self.search(organization_id, query, k=k)]
+            candidates = [
+                kid for kid, _, _ in self.search(organization_id, query, k=k * self.rescore_factor)
+                if kid in by_id
+            ]
+            if candidates:
+                exact_dist = ((vectors[[by_id[kid] for kid in candidates]] - query) ** 2).sum(axis=1)
+                rescored = [candidates[i] for i in np.argsort(exact_dist)[:k]]
+            else:
+                rescored = []
+
+            raw_hits += len(truth.intersection(raw))
+            rescored_hits += len(truth.intersection(rescored))
+            total += len(truth)
+
+        with self._lock:
+            spec = dict(self.get_shard(organization_id).spec)
+
+        return {
+            "queries": int(len(sample)),
+            "k": k,
+            "index_type": spec["type"],
+            "codec": spec.get("codec", "none"),
+            "bytes_per_vector": self.bytes_per_vector(spec, self.dimension),
+            "float32_bytes_per_vector": 4 * self.dimension,
+            "recall_at_k": raw_hits / total if total else 0.0,
+            "recall_at_k_rescored": rescored_hits / total if total else 0.0,
+            "rescore_factor": self.rescore_factor,
+        }
+
+    def set_search_params(
+        self,
+        organization_id: int,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Ajustar nprobe (IVF) / efSearch (HNSW) do shard e persistir
+        """
+        changes = {}
+        if nprobe is not None:
+            changes["nprobe"] = int(nprobe)
+        if ef_search is not None:
+            changes["ef_search"] = int(ef_search)
+
+        def apply(shard: TenantShard):
+            shard.spec.update(changes)
+            self._apply_search_params(shard.base, shard.spec)
+
+        with self._lock:
+            if changes:
+                shard, _ = self._write(organization_id, OP_SPEC, encode_spec(changes), apply)
+            else:
+                shard = self.get_shard(organization_id)
+
+            return dict(shard.spec)
+
     def delete_by_organization(self, organization_id: int):
         """
-        Deletar todos os vetores de uma organização
-        (Recria o índice sem os vetores da organização)
+        Deletar todos os vetores de uma organização (remove o shard e as gerações)
         """
         try:
-            # Filtrar metadata
-            new_metadata = [
-                m for m in self.metadata
-                if m.get("organization_id") != organization_id
-            ]
-            
-            if len(new_metadata) == len(self.metadata):
-                logger.info(f"Nenhum vetor encontrado para org {organization_id}")
-                return
-            
-            # Recriar índice
-            self.create_index()
-            
-            # Adicionar vetores filtrados
-            for meta in new_metadata:
-                # Nota: Isso requer ter os vetores salvos no metadata
-                # Em produção, usar um banco de dados vetorial mais robusto
-                pass
-            
+            with self._lock, self._shard_lock(organization_id):
+                shard = self._shards.pop(organization_id, None)
+                if shard is not None and shard.wal is not None:
+                    shard.wal.close()
+
+                for pattern in (f"org_{organization_id}.*", f"org_{organization_id}_*"):
+                    for path in self.index_dir.glob(pattern):
+                        if path.suffix != ".lock":
+                            path.unlink()
+
             logger.info(f"Vetores da org {organization_id} removidos")
-        
+
         except Exception as e:
             logger.error(f"Erro ao deletar vetores: {e}")
             raise
-    
+
     def get_stats(self) -> Dict[str, Any]:
         """
-        Obter estatísticas do índice
+        Obter estatísticas dos shards residentes
         """
-        return {
-            "total_vectors": self.index.ntotal,
-            "dimension": self.dimension,
-            "index_type": type(self.index).__name__
-        }
+        with self._lock:
+            return {
+                "resident_shards": len(self._shards),
+                "max_resident_shards": self.max_resident_shards,
+                "total_vectors": sum(s.live_count for s in self._shards.values()),
+                "dimension": self.dimension,
+                "ann_type": self.ann_type,
+                "ann_threshold": self.ann_threshold,
+                "quantization": self.quantization,
+                "mmap": self.use_mmap,
+                "mmap_zero_copy": MMAP_ZERO_COPY,
+                "writer": self._writer_file is not None,
+                "pid": os.getpid(),
+                "shards": {
+                    org_id: {
+                        "vectors": shard.live_count,
+                        "delta_vectors": int(shard.delta.ntotal),
+                        "tombstones": len(shard.tombstones),
+                        "generation": shard.generation,
+                        "mmapped": shard.mapped,
+                        "wal_bytes": shard.wal.size if shard.wal is not None else 0,
+                        "index_type": type(faiss.downcast_index(shard.base.index)).__name__,
+                        "bytes_per_vector": self.bytes_per_vector(shard.spec, self.dimension),
+                        "spec": dict(shard.spec)
+                    }
+                    for org_id, shard in self._shards.items()
+                }
+            }
 
 
 # Instância global do serviço
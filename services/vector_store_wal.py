@@ -0,0 +1,184 @@
+"""
+Write-ahead log (append-only) dos shards FAISS
+
+Cada shard tem um segmento com as operações feitas depois do último
+checkpoint. Formato de cada registro (little-endian):
+
+    seq (u64) | op (u8) | tamanho do payload (u32) | crc32 do payload (u32) | payload
+
+- ADD:    n (u32) | ids int64[n] | vetores float32[n*d] | metadata JSON (lista)
+- DELETE: n (u32) | ids int64[n]
+- SPEC:   JSON com os parâmetros do shard
+
+Um registro incompleto ou com CRC inválido no fim do arquivo (escrita em
+andamento ou queda) encerra a leitura; o writer corta o resto ao reparar.
+
+Cada geração do shard tem o seu segmento (`org_<id>.g<N>.wal`), com as
+operações posteriores ao índice base daquela geração.
+"""
+import json
+import logging
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+OP_ADD = 1
+OP_DELETE = 2
+OP_SPEC = 3
+
+_HEADER = struct.Struct("<QBII")
+_COUNT = struct.Struct("<I")
+
+
+def pack_record(seq: int, op: int, payload: bytes) -> bytes:
+    return _HEADER.pack(seq, op, len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_add(ids: np.ndarray, vectors: np.ndarray, metadatas: List[Dict[str, Any]]) -> bytes:
+    ids = np.ascontiguousarray(ids, dtype="<i8")
+    vectors = np.ascontiguousarray(vectors, dtype="<f4")
+    return b"".join([
+        _COUNT.pack(len(ids)),
+        ids.tobytes(),
+        vectors.tobytes(),
+        json.dumps(metadatas, ensure_ascii=False).encode("utf-8"),
+    ])
+
+
+def decode_add(payload: bytes, dimension: int) -> Tuple[np.ndarray, np.ndarray, List[Dict[str, Any]]]:
+    (n,) = _COUNT.unpack_from(payload)
+    offset = _COUNT.size
+    ids = np.frombuffer(payload, dtype="<i8", count=n, offset=offset)
+    offset += 8 * n
+    vectors = np.frombuffer(payload, dtype="<f4", count=n * dimension, offset=offset).reshape(n, dimension)
+    offset += 4 * n * dimension
+    metadatas = json.loads(payload[offset:].decode("utf-8"))
+    return ids, vectors, metadatas
+
+
+def encode_delete(ids: np.ndarray) -> bytes:
+    ids = np.ascontiguousarray(ids, dtype="<i8")
+    return _COUNT.pack(len(ids)) + ids.tobytes()
+
+
+def decode_delete(payload: bytes) -> np.ndarray:
+    (n,) = _COUNT.unpack_from(payload)
+    return np.frombuffer(payload, dtype="<i8", count=n, offset=_COUNT.size)
+
+
+def encode_spec(spec: Dict[str, Any]) -> bytes:
+    return json.dumps(spec).encode("utf-8")
+
+
+def decode_spec(payload: bytes) -> Dict[str, Any]:
+    return json.loads(payload.decode("utf-8"))
+
+
+class ShardWAL:
+    """
+    Segmento append-only de um shard
+
+    Vários processos podem ler o mesmo segmento; quem grava deve segurar o
+    lock do shard (ver VectorStoreService._shard_lock).
+    """
+
+    def __init__(self, path: Path, fsync: bool = True):
+        self.path = Path(path)
+        self.fsync = fsync
+        self._file = None
+
+    @property
+    def size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _handle(self):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        return self._file
+
+    def append(self, seq: int, op: int, payload: bytes):
+        """
+        Gravar um registro no fim do segmento (durável se fsync=True)
+        """
+        f = self._handle()
+        f.write(pack_record(seq, op, payload))
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def read(self, offset: int = 0) -> Tuple[List[Tuple[int, int, bytes]], int]:
+        """
+        Ler os registros completos a partir de `offset`
+
+        Returns:
+            (registros (seq, op, payload), offset do fim do último registro válido)
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+
+        records = []
+        pos = 0
+        while pos + _HEADER.size <= len(data):
+            seq, op, length, crc = _HEADER.unpack_from(data, pos)
+            start = pos + _HEADER.size
+            payload = data[start:start + length]
+
+            # Registro incompleto (escrita em andamento ou queda) / corrompido
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+
+            records.append((seq, op, payload))
+            pos = start + length
+
+        return records, offset + pos
+
+    def repair(self, valid_end: int):
+        """
+        Cortar bytes inválidos após o último registro (só com o lock do shard)
+        """
+        size = self.size
+        if size <= valid_end:
+            return
+
+        logger.warning(f"WAL {self.path.name}: {size - valid_end} bytes inválidos no final descartados")
+        self.close()
+        with open(self.path, "r+b") as f:
+            f.truncate(valid_end)
+
+    @classmethod
+    def create(cls, path: Path, records: List[Tuple[int, int, bytes]], fsync: bool = True) -> "ShardWAL":
+        """
+        Criar um segmento novo já com os registros indicados
+        """
+        tmp = Path(f"{path}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(b"".join(pack_record(*record) for record in records))
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+        return cls(path, fsync=fsync)
+
+    def remove(self):
+        self.close()
+        if self.path.exists():
+            self.path.unlink()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
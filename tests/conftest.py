@@ -0,0 +1,16 @@
+"""
+Configuração comum dos testes unitários
+
+Os serviços leem o config na importação; uma chave fictícia basta para as
+funções puras testadas aqui (nenhum teste chama a OpenAI ou o banco).
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+# Instância global do vector store criada na importação
+os.environ.setdefault("VECTOR_STORE_DIR", tempfile.mkdtemp(prefix="ft9-faiss-"))
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,77 @@
+"""
+Testes do cache semântico de respostas (versão do conteúdo e espaço de embeddings)
+"""
+import asyncio
+
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from models.knowledge import Knowledge, KnowledgeChunk
+from services.answer_cache_service import SemanticAnswerCache
+from services.embedding_service import EmbeddingSpace
+from services.org_cache import chunk_version
+
+SPACE = EmbeddingSpace("text-embedding-3-small", 4)
+QUESTION = [1.0, 0.2, 0.0, 0.0]
+
+
+def _store(cache, content, space=SPACE):
+    cache.store(1, QUESTION, "pergunta", "resposta", doc_ids=[7], latency=1.5, space=space, content=content)
+
+
+def test_hit_requires_the_same_content_version():
+    cache = SemanticAnswerCache()
+    _store(cache, (3, 30))
+
+    assert cache.lookup(1, QUESTION, SPACE, (3, 30)).answer == "resposta"
+    # Documento redividido: mesmo COUNT, MAX(id) novo
+    assert cache.lookup(1, QUESTION, SPACE, (3, 33)) is None
+    assert cache.lookup(1, QUESTION, SPACE, (3, 30)) is None
+    assert cache.invalidated == 1
+
+
+def test_embedding_space_version_drops_the_cache():
+    cache = SemanticAnswerCache()
+    _store(cache, (3, 30))
+
+    assert cache.lookup(1, QUESTION, SPACE._replace(version=2), (3, 30)) is None
+    assert cache.invalidated == 1
+
+
+def test_chunk_version_changes_on_rechunk_and_ingestion():
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        metadata = Knowledge.__table__.metadata
+        tables = [metadata.tables["organizations"], Knowledge.__table__, KnowledgeChunk.__table__]
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync: metadata.create_all(sync, tables=tables))
+
+        # ids explícitos: a sequência do Postgres não reaproveita ids (o SQLite sim)
+        def chunk(chunk_id, doc_id, position):
+            return {"id": chunk_id, "knowledge_id": doc_id, "organization_id": 1, "chunk_index": position,
+                    "content": f"trecho {position}", "token_count": 2}
+
+        try:
+            async with AsyncSession(engine) as session:
+                session.add_all([Knowledge(id=1, title="doc", content="x", organization_id=1),
+                                 Knowledge(id=2, title="outro", content="y", organization_id=1)])
+                await session.flush()
+                await session.execute(insert(KnowledgeChunk), [chunk(1, 1, 0), chunk(2, 1, 1)])
+                versions = [await chunk_version(session, 1)]
+
+                # scripts/rechunk_knowledge.py: apaga e recria os trechos
+                await session.execute(delete(KnowledgeChunk).where(KnowledgeChunk.knowledge_id == 1))
+                await session.execute(insert(KnowledgeChunk), [chunk(3, 1, 0), chunk(4, 1, 1)])
+                versions.append(await chunk_version(session, 1))
+
+                # /bulk: documento novo na organização
+                await session.execute(insert(KnowledgeChunk), [chunk(5, 2, 0)])
+                versions.append(await chunk_version(session, 1))
+                return versions
+        finally:
+            await engine.dispose()
+
+    initial, rechunked, ingested = asyncio.run(scenario())
+
+    assert initial[0] == rechunked[0] == 2
+    assert len({initial, rechunked, ingested}) == 3
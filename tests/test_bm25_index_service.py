@@ -0,0 +1,66 @@
+"""
+Testes da fusão RRF e do cache BM25 (contabilidade dos trechos)
+"""
+import pytest
+
+from services.bm25_index_service import BM25IndexCache, reciprocal_rank_fusion, tokenize
+
+
+def test_rrf_scores_by_position():
+    fused = reciprocal_rank_fusion([[(1, 9.0), (2, 5.0)]], k=60)
+
+    assert fused == [(1, pytest.approx(1 / 61)), (2, pytest.approx(1 / 62))]
+
+
+def test_rrf_rewards_documents_in_both_rankings():
+    dense = [(1, 0.9), (2, 0.8), (3, 0.7)]
+    sparse = [(3, 12.0), (4, 11.0), (1, 10.0)]
+
+    fused = dict(reciprocal_rank_fusion([dense, sparse], k=60))
+
+    assert fused[1] == pytest.approx(1 / 61 + 1 / 63)
+    assert fused[3] == pytest.approx(1 / 63 + 1 / 61)
+    assert fused[1] > fused[2]
+    assert fused[3] > fused[4]
+
+
+def test_rrf_ignores_original_scores():
+    a = reciprocal_rank_fusion([[(1, 1000.0), (2, 0.1)]])
+    b = reciprocal_rank_fusion([[(1, 0.2), (2, 0.1)]])
+
+    assert a == b
+
+
+def test_rrf_empty():
+    assert reciprocal_rank_fusion([]) == []
+    assert reciprocal_rank_fusion([[], []]) == []
+
+
+def test_tokenize_folds_accents_and_case():
+    assert tokenize("Ação") == tokenize("acao")
+
+
+def test_add_and_remove_chunks_keep_counters():
+    cache = BM25IndexCache()
+    index = cache._create()
+    cache._orgs[1] = index
+
+    cache.add_chunks(1, "Título", None, [(5, "dor lombar"), (3, "joelho")])
+    assert (index.max_id, index.known_rows, len(index)) == (5, 2, 2)
+
+    # Trechos já vistos (id <= max_id) não são contados de novo
+    cache.add_chunks(1, "Título", None, [(4, "ombro"), (5, "dor lombar")])
+    assert (index.max_id, index.known_rows, len(index)) == (5, 2, 2)
+
+    cache.remove_chunks(1, [3, 99])
+    assert (index.max_id, index.known_rows, len(index)) == (5, 1, 1)
+    assert index.top_k("joelho", 5) == []
+    assert [doc_id for doc_id, _ in index.top_k("lombar", 5)] == [5]
+
+
+def test_add_chunks_without_loaded_org_is_noop():
+    cache = BM25IndexCache()
+    cache.add_chunks(1, None, None, [(1, "texto")])
+    cache.remove_chunks(1, [1])
+
+    assert cache.get_stats()["organizations"] == 0
@@ -0,0 +1,64 @@
+"""
+Testes da montagem do contexto dentro do orçamento de tokens
+"""
+from services.context_assembler import ContextAssembler
+from services.embedding_service import estimate_tokens
+
+
+def _assembler(passage_max_tokens=600, min_tokens=5):
+    assembler = ContextAssembler()
+    assembler.passage_max_tokens = passage_max_tokens
+    assembler.min_tokens = min_tokens
+    return assembler
+
+
+def test_passages_fit_in_order():
+    result = _assembler().assemble("dor", [
+        {"title": "A", "content": "Primeiro trecho."},
+        {"content": "Segundo trecho."},
+    ], budget=200)
+
+    assert result.text() == "[A]\nPrimeiro trecho.\n\nSegundo trecho."
+    assert result.dropped_tokens == 0
+    assert result.stats()["passages_used"] == 2
+
+
+def test_repeated_sentences_are_removed():
+    result = _assembler().assemble("joelho", [
+        {"content": "Alongar o joelho. Aplicar gelo."},
+        {"content": "Aplicar gelo! Repousar."},
+        {"content": "Alongar o joelho."},
+    ], budget=200)
+
+    assert result.blocks == ["Alongar o joelho. Aplicar gelo.", "Repousar."]
+    assert len(result.passages) == 2
+
+
+def test_budget_is_respected_and_overflow_counted():
+    passages = [{"content": f"Trecho {i} " + "texto " * 30 + "."} for i in range(10)]
+    result = _assembler().assemble("texto", passages, budget=150)
+
+    assert 0 < result.tokens <= 150
+    assert sum(estimate_tokens(block) for block in result.blocks) == result.tokens
+    assert result.dropped_tokens == result.input_tokens - result.tokens > 0
+
+
+def test_long_passage_keeps_sentences_matching_query():
+    filler = " ".join(f"Frase de enchimento numero {i}." for i in range(20))
+    passage = {"content": f"{filler} O tratamento da tendinite usa gelo. {filler.replace('numero', 'item')}"}
+
+    result = _assembler(passage_max_tokens=40).assemble("tratamento tendinite", [passage], budget=500)
+
+    assert result.stats()["passages_trimmed"] == 1
+    assert "O tratamento da tendinite usa gelo." in result.text()
+    assert result.tokens <= 40
+
+
+def test_passage_below_min_tokens_is_skipped():
+    result = _assembler(min_tokens=50).assemble("x", [
+        {"content": "a " * 120},
+        {"content": "Outro trecho."},
+    ], budget=100)
+
+    assert len(result.passages) == 1
+    assert result.passages[0]["content"].startswith("a ")
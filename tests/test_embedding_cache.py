@@ -0,0 +1,121 @@
+"""
+Testes da camada persistente do cache de embeddings (SQLite local)
+"""
+import sqlite3
+from datetime import timedelta
+
+import numpy as np
+import sqlalchemy as sa
+
+from services import embedding_cache
+from services.embedding_cache import EmbeddingCache, EmbeddingCacheStore, embedding_cache_table
+
+
+def _store(tmp_path):
+    return EmbeddingCacheStore(f"sqlite:///{tmp_path / 'cache.db'}")
+
+
+def _vec(value):
+    return np.full(4, value, dtype=np.float32)
+
+
+def _last_used(store, key):
+    with store._get_engine().connect() as conn:
+        return conn.execute(
+            sa.select(embedding_cache_table.c.last_used_at).where(embedding_cache_table.c.text_hash == key)
+        ).scalar_one()
+
+
+def _age(store, keys, days):
+    with store._get_engine().begin() as conn:
+        conn.execute(
+            embedding_cache_table.update()
+            .where(embedding_cache_table.c.text_hash.in_(keys))
+            .values(last_used_at=embedding_cache._utcnow() - timedelta(days=days))
+        )
+
+
+def _keys(store):
+    with store._get_engine().connect() as conn:
+        return set(conn.execute(sa.select(embedding_cache_table.c.text_hash)).scalars())
+
+
+def test_put_many_get_many_round_trip(tmp_path):
+    store = _store(tmp_path)
+    store.put_many("m", [("a", _vec(1)), ("b", _vec(2))])
+    store.put_many("m", [("a", _vec(9))])  # já gravada: ignorada
+
+    found = store.get_many("m", ["a", "b", "c"])
+
+    assert set(found) == {"a", "b"}
+    np.testing.assert_array_equal(found["a"], _vec(1))
+    assert store.get("outro", "a") is None
+
+
+def test_hit_refreshes_stale_last_used(tmp_path):
+    store = _store(tmp_path)
+    store.put_many("m", [("a", _vec(1)), ("b", _vec(2))])
+    _age(store, ["a", "b"], 10)
+    before = _last_used(store, "b")
+
+    store.get_many("m", ["a"])
+
+    assert _last_used(store, "a") > before
+    assert _last_used(store, "b") == before
+
+
+def test_prune_by_age(tmp_path):
+    store = _store(tmp_path)
+    store.put_many("m", [("old", _vec(1)), ("new", _vec(2))])
+    _age(store, ["old"], 100)
+
+    assert store.prune(max_age_days=90) == 1
+    assert _keys(store) == {"new"}
+
+
+def test_prune_by_row_cap_keeps_most_recent(tmp_path):
+    store = _store(tmp_path)
+    store.put_many("m", [(f"k{i}", _vec(i)) for i in range(5)])
+    for i in range(5):
+        _age(store, [f"k{i}"], 5 - i)  # k4 é a mais recente
+
+    assert store.prune(max_rows=2) == 3
+    assert _keys(store) == {"k3", "k4"}
+
+
+def test_prune_unused_models(tmp_path):
+    store = _store(tmp_path)
+    store.put_many("text-embedding-ada-002", [("a", _vec(1))])
+    store.put_many("text-embedding-3-small@256", [("b", _vec(2))])
+
+    assert store.prune(keep_models={"text-embedding-3-small@256"}) == 1
+    assert _keys(store) == {"b"}
+
+
+def test_store_created_before_last_used_is_upgraded(tmp_path):
+    path = tmp_path / "cache.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE embedding_cache (model VARCHAR(100), text_hash VARCHAR(64), "
+        "embedding BLOB NOT NULL, created_at TIMESTAMP, PRIMARY KEY (model, text_hash))"
+    )
+    conn.execute("INSERT INTO embedding_cache (model, text_hash, embedding) VALUES ('m', 'a', ?)", (_vec(1).tobytes(),))
+    conn.commit()
+    conn.close()
+
+    store = EmbeddingCacheStore(f"sqlite:///{path}")
+
+    assert set(store.get_many("m", ["a"])) == {"a"}
+    assert store.prune(max_age_days=1) == 0
+    assert store.enabled
+
+
+def test_cache_uses_store_for_misses(tmp_path):
+    cache = EmbeddingCache(max_entries=1, store=_store(tmp_path))
+    cache.put_many("m", [("primeiro texto", [1.0, 0.0]), ("segundo texto", [0.0, 1.0])])
+
+    found = cache.get_many("m", ["primeiro texto", "segundo texto", "terceiro"])
+
+    assert found == {"primeiro texto": [1.0, 0.0], "segundo texto": [0.0, 1.0]}
+    stats = cache.get_stats()
+    assert (stats["memory_hits"], stats["persistent_hits"], stats["misses"]) == (1, 1, 1)
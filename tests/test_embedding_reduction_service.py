@@ -0,0 +1,61 @@
+"""
+Testes do PCA e do recall@k usados na redução de dimensão das embeddings
+"""
+import numpy as np
+import pytest
+
+from services.embedding_reduction_service import fit_pca, recall_at_k
+
+
+def _low_rank(n=200, dimension=32, rank=4, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.normal(size=(n, rank)) @ rng.normal(size=(rank, dimension))).astype(np.float32)
+
+
+def test_fit_pca_shapes_and_orthonormal_components():
+    vectors = _low_rank()
+    mean, components, explained = fit_pca(vectors, 8)
+
+    assert mean.shape == (32,)
+    assert components.shape == (8, 32)
+    assert components.dtype == np.float32
+    np.testing.assert_allclose(components @ components.T, np.eye(8), atol=1e-4)
+    assert 0.0 < explained <= 1.0
+
+
+def test_fit_pca_keeps_all_variance_of_low_rank_data():
+    _, _, explained = fit_pca(_low_rank(rank=4), 4)
+
+    assert explained == pytest.approx(1.0, abs=1e-4)
+
+
+def test_fit_pca_constant_vectors():
+    _, _, explained = fit_pca(np.ones((10, 4), dtype=np.float32), 2)
+
+    assert explained == 0.0
+
+
+def test_recall_is_one_for_same_space():
+    vectors = _low_rank()
+
+    assert recall_at_k(vectors, vectors, 5, 50) == 1.0
+
+
+def test_recall_of_lossless_projection():
+    vectors = _low_rank(rank=4)
+    mean, components, _ = fit_pca(vectors, 4)
+    reduced = (vectors - mean) @ components.T + mean @ components.T
+
+    assert recall_at_k(vectors, reduced, 5, 50) == pytest.approx(1.0)
+
+
+def test_recall_drops_for_random_projection():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(300, 64)).astype(np.float32)
+    reduced = vectors[:, :2]
+
+    assert recall_at_k(vectors, reduced, 10, 50) < 0.5
+
+
+def test_recall_with_too_few_vectors():
+    assert recall_at_k(np.ones((1, 4)), np.ones((1, 2)), 5, 10) == 1.0
@@ -0,0 +1,132 @@
+"""
+Testes do espaço de embeddings por organização (SQLite em memória)
+"""
+import asyncio
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.sql.dml import Update
+
+import services.embedding_version_service as embedding_version_module
+
+from models.knowledge import Knowledge, KnowledgeChunk, KnowledgeEmbeddingVersion
+from services.embedding_service import EmbeddingSpace, decode_embedding, embedding_service, encode_embedding
+from services.embedding_version_service import embedding_version_service
+
+
+def _run(scenario):
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        metadata = Knowledge.__table__.metadata
+        tables = [metadata.tables["organizations"], Knowledge.__table__,
+                  KnowledgeChunk.__table__, KnowledgeEmbeddingVersion.__table__]
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync: metadata.create_all(sync, tables=tables))
+        try:
+            return await scenario(engine)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+def test_cache_models_in_use():
+    async def scenario(engine):
+        async with AsyncSession(engine) as session:
+            session.add_all([
+                KnowledgeEmbeddingVersion(organization_id=1, model="text-embedding-3-small", dimensions=1536),
+                KnowledgeEmbeddingVersion(organization_id=2, model="text-embedding-3-small", dimensions=256,
+                                          status="reembedding", target_model="text-embedding-3-large",
+                                          target_dimensions=3072),
+                # Projeção PCA: o cache guarda os vetores do espaço base
+                KnowledgeEmbeddingVersion(organization_id=3, model="text-embedding-3-large", dimensions=128,
+                                          projection_id=7),
+            ])
+            await session.commit()
+            return await embedding_version_service.cache_models_in_use(session)
+
+    keys = _run(scenario)
+
+    assert keys == {
+        embedding_service.default_space.cache_key,
+        "text-embedding-3-small",
+        "text-embedding-3-small@256",
+        "text-embedding-3-large",
+    }
+
+
+OLD = EmbeddingSpace("text-embedding-3-small", 4)
+NEW = EmbeddingSpace("text-embedding-3-large", 4)
+
+
+def _chunk(chunk_id, vector, shadow=None):
+    row = {"id": chunk_id, "knowledge_id": 1, "organization_id": 1, "chunk_index": chunk_id,
+           "content": f"trecho {chunk_id}", "token_count": 2,
+           "embedding_vec": encode_embedding(vector), "embedding_model": OLD.tag, "embedding_dim": OLD.dimensions}
+    if shadow is not None:
+        row.update(shadow_embedding_vec=encode_embedding(shadow), shadow_embedding_model=NEW.tag,
+                   shadow_embedding_dim=NEW.dimensions)
+    return row
+
+
+def test_switch_keeps_chunks_written_after_the_coverage_check(monkeypatch):
+    """
+    Trecho gravado entre a contagem e o UPDATE da troca (sem sombra) mantém o
+    vetor do espaço antigo e é re-embeddado por _repair
+    """
+    async def agenerate_embeddings(texts, timeout=None, space=None):
+        assert space.key == NEW.key
+        return [[9.0, 0.0, 0.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(embedding_service, "agenerate_embeddings", agenerate_embeddings)
+
+    async def scenario(engine):
+        monkeypatch.setattr(embedding_version_module, "AsyncSessionLocal",
+                            async_sessionmaker(engine, expire_on_commit=False))
+
+        async with AsyncSession(engine) as session:
+            session.add_all([
+                KnowledgeEmbeddingVersion(organization_id=1, model=OLD.model, dimensions=OLD.dimensions,
+                                          status="reembedding", target_model=NEW.model,
+                                          target_dimensions=NEW.dimensions),
+                Knowledge(id=1, title="doc", content="trecho 1 trecho 2", organization_id=1),
+            ])
+            await session.flush()
+            await session.execute(insert(KnowledgeChunk), [_chunk(1, [1, 0, 0, 0], shadow=[0, 1, 0, 0])])
+            await session.commit()
+
+        # Ingestão concorrente: o trecho 2 chega depois da verificação de cobertura
+        execute = AsyncSession.execute
+        late = []
+
+        async def execute_with_late_insert(self, statement, *args, **kwargs):
+            if isinstance(statement, Update) and statement.table.name == "knowledge_chunks" and not late:
+                late.append(True)
+                await execute(self, insert(KnowledgeChunk), [_chunk(2, [0, 0, 1, 0])])
+            return await execute(self, statement, *args, **kwargs)
+
+        monkeypatch.setattr(AsyncSession, "execute", execute_with_late_insert)
+        switched = await embedding_version_service._switch(1, NEW)
+        monkeypatch.setattr(AsyncSession, "execute", execute)
+
+        async with AsyncSession(engine) as session:
+            after_switch = {
+                row.id: (row.embedding_model, row.embedding_vec)
+                for row in (await session.execute(select(KnowledgeChunk))).scalars()
+            }
+
+        await embedding_version_service._repair(1)
+
+        async with AsyncSession(engine) as session:
+            repaired = (await session.get(KnowledgeChunk, 2))
+            return switched, late, after_switch, (repaired.embedding_model, decode_embedding(repaired.embedding_vec))
+
+    switched, late, after_switch, repaired = _run(scenario)
+
+    assert switched and late
+    assert after_switch[1][0] == NEW.tag
+    assert decode_embedding(after_switch[1][1]).tolist() == [0, 1, 0, 0]
+    # Sem o filtro da sombra o UPDATE gravaria NULL no trecho 2
+    assert after_switch[2][0] == OLD.tag
+    assert decode_embedding(after_switch[2][1]).tolist() == [0, 0, 1, 0]
+    assert repaired[0] == NEW.tag and repaired[1].tolist() == [9, 0, 0, 0]
@@ -0,0 +1,56 @@
+"""
+Testes do chunk_text (divisão dos documentos em trechos)
+"""
+from services.embedding_service import estimate_tokens
+from services.knowledge_chunk_service import chunk_text
+
+
+def _sentences(n):
+    return " ".join(f"Frase numero {i} do documento de teste." for i in range(n))
+
+
+def test_empty_text_has_no_chunks():
+    assert chunk_text("") == []
+    assert chunk_text("   \n\n ") == []
+
+
+def test_short_text_is_a_single_chunk():
+    assert chunk_text("  Texto curto.  ", max_tokens=50) == ["Texto curto."]
+
+
+def test_chunks_respect_max_tokens():
+    chunks = chunk_text(_sentences(60), max_tokens=60, overlap_tokens=0)
+
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 60 for chunk in chunks)
+
+
+def test_all_sentences_are_kept_in_order():
+    text = _sentences(40)
+    chunks = chunk_text(text, max_tokens=60, overlap_tokens=0)
+
+    assert " ".join(chunks) == text
+
+
+def test_overlap_repeats_last_sentences():
+    chunks = chunk_text(_sentences(40), max_tokens=60, overlap_tokens=20)
+
+    for previous, current in zip(chunks, chunks[1:]):
+        last_sentence = previous.rsplit(". ", 1)[-1]
+        assert current.startswith(last_sentence.rstrip("."))
+
+
+def test_long_sentence_is_split_by_words():
+    text = " ".join(["palavra"] * 200)
+    chunks = chunk_text(text, max_tokens=30, overlap_tokens=0)
+
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 30 for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
+
+
+def test_paragraphs_are_preserved_inside_a_chunk():
+    text = "Primeiro paragrafo.\n\nSegundo paragrafo. " + _sentences(30)
+    chunks = chunk_text(text, max_tokens=60, overlap_tokens=0)
+
+    assert chunks[0].startswith("Primeiro paragrafo.\n\nSegundo paragrafo.")
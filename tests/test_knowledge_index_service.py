@@ -0,0 +1,105 @@
+"""
+Testes da matriz de embeddings por organização, do seu cache e do MMR
+"""
+import numpy as np
+
+from services.embedding_service import EmbeddingSpace
+from services.knowledge_index_service import KnowledgeMatrixCache, OrgEmbeddingMatrix, mmr_select, normalize_rows
+
+SPACE = EmbeddingSpace("text-embedding-3-small", 2)
+
+
+def test_normalize_rows_keeps_zero_rows():
+    vectors = normalize_rows(np.array([[3.0, 4.0], [0.0, 0.0]]))
+
+    np.testing.assert_allclose(vectors, [[0.6, 0.8], [0.0, 0.0]], rtol=1e-6)
+    assert vectors.dtype == np.float32
+
+
+def test_matrix_top_k_by_cosine():
+    matrix = OrgEmbeddingMatrix()
+    matrix.add([1, 2, 3], [np.array([1.0, 0.0]), np.array([0.0, 5.0]), np.array([1.0, 1.0])])
+
+    ranked = matrix.top_k(np.array([2.0, 0.1]), 2)
+
+    assert [doc_id for doc_id, _ in ranked] == [1, 3]
+    assert ranked[0][1] > ranked[1][1]
+    assert matrix.top_k(np.array([1.0, 0.0, 0.0]), 2) == []
+
+
+def test_matrix_add_replaces_and_skips_wrong_dimension():
+    matrix = OrgEmbeddingMatrix()
+    matrix.add([1, 2], [np.array([1.0, 0.0]), np.array([0.0, 1.0])])
+
+    assert matrix.add([1, 3], [np.array([0.0, 2.0]), np.array([1.0, 1.0, 1.0])]) == 1
+    assert len(matrix) == 2
+    np.testing.assert_allclose(matrix.vectors([1, 99]), [[0.0, 1.0], [0.0, 0.0]])
+
+
+def test_matrix_remove():
+    matrix = OrgEmbeddingMatrix()
+    matrix.add([1, 2, 3], [np.eye(2)[0], np.eye(2)[1], np.eye(2)[0]])
+
+    assert matrix.remove([2, 42]) == 1
+    assert sorted(doc_id for doc_id, _ in matrix.top_k(np.array([0.0, 1.0]), 5)) == [1, 3]
+
+
+def test_cache_add_and_remove_chunks_keep_counters():
+    cache = KnowledgeMatrixCache()
+    matrix = cache._create(SPACE)
+    cache._orgs[1] = matrix
+
+    # Trechos sem embedding ficam fora do espaço (e da contagem do COUNT/MAX)
+    cache.add_chunks(1, [(4, [1.0, 0.0]), (2, [0.0, 1.0]), (3, None)], SPACE)
+    assert (matrix.max_id, matrix.known_rows, len(matrix)) == (4, 2, 2)
+
+    # Ids já vistos não contam de novo; outro espaço é ignorado
+    cache.add_chunks(1, [(4, [1.0, 0.0])], SPACE)
+    cache.add_chunks(1, [(9, [1.0, 0.0])], SPACE._replace(version=1))
+    assert (matrix.max_id, matrix.known_rows, len(matrix)) == (4, 2, 2)
+
+    cache.remove_chunks(1, [2])
+    assert (matrix.known_rows, len(matrix)) == (1, 1)
+    assert cache.get_stats()["total_vectors"] == 1
+
+    cache.invalidate(1)
+    assert cache.get_stats()["organizations"] == 0
+
+
+def test_lambda_one_is_pure_relevance():
+    relevance = np.array([0.2, 0.9, 0.5], dtype=np.float32)
+    vectors = normalize_rows(np.eye(3))
+
+    assert mmr_select(relevance, vectors, 3, 1.0) == [1, 2, 0]
+
+
+def test_duplicates_are_demoted():
+    # 0 e 1 são o mesmo vetor; 2 é diferente e um pouco menos relevante
+    relevance = np.array([1.0, 0.95, 0.8], dtype=np.float32)
+    vectors = normalize_rows(np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]]))
+
+    assert mmr_select(relevance, vectors, 2, 0.5) == [0, 2]
+
+
+def test_k_is_capped():
+    relevance = np.array([0.5, 0.4], dtype=np.float32)
+    vectors = normalize_rows(np.eye(2))
+
+    assert mmr_select(relevance, vectors, 10, 0.7) == [0, 1]
+    assert mmr_select(relevance, vectors, 0, 0.7) == []
+
+
+def test_vectorless_candidate_gets_no_diversity_bonus():
+    # 2 não tem embedding (ex.: só do BM25); não deve passar à frente de 1
+    # só por parecer "totalmente diverso"
+    relevance = np.array([1.0, 0.9, 0.7], dtype=np.float32)
+    vectors = normalize_rows(np.array([[1.0, 0.0], [0.6, 0.8], [0.0, 0.0]]))
+
+    assert mmr_select(relevance, vectors, 3, 0.5) == [0, 1, 2]
+
+
+def test_all_vectorless_falls_back_to_relevance():
+    relevance = np.array([0.3, 0.8, 0.5], dtype=np.float32)
+    vectors = np.zeros((3, 4), dtype=np.float32)
+
+    assert mmr_select(relevance, vectors, 3, 0.5) == [1, 2, 0]
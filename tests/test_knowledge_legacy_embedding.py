@@ -0,0 +1,145 @@
+"""
+Documentos gravados pelo /knowledge (v1) e pelo /bulk precisam da coluna legada
+knowledge.embedding, que o knowledge_router_v2 ranqueia com pgvector
+"""
+import asyncio
+import io
+import json
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi import UploadFile
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+import routers.knowledge_router  # noqa: F401
+from models.knowledge import Knowledge, KnowledgeChunk, KnowledgeEmbeddingVersion
+from schemas.knowledge_schemas import KnowledgeCreate
+from services.embedding_service import embedding_service
+from services.knowledge_chunk_service import document_embedding
+from services.knowledge_ingestion_service import iter_uploads, knowledge_ingestion_service
+
+# routers/__init__ reexporta o APIRouter com o mesmo nome do módulo
+knowledge_router = sys.modules["routers.knowledge_router"]
+
+TOPICS = ("joelho", "ombro", "coluna")
+
+
+def _fake_vector(text):
+    """Um eixo por tema + ruído fixo"""
+    vec = np.full(embedding_service.default_space.dimensions, 0.01, dtype=np.float32)
+    for axis, topic in enumerate(TOPICS):
+        vec[axis] += text.lower().count(topic)
+    return vec.tolist()
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    async def agenerate_embeddings(texts, timeout=None, space=None):
+        return [_fake_vector(text) for text in texts]
+
+    monkeypatch.setattr(embedding_service, "agenerate_embeddings", agenerate_embeddings)
+
+
+def _run(coro_factory):
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        metadata = Knowledge.__table__.metadata
+        tables = [metadata.tables["organizations"], Knowledge.__table__,
+                  KnowledgeChunk.__table__, KnowledgeEmbeddingVersion.__table__]
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync: metadata.create_all(sync, tables=tables))
+        try:
+            async with AsyncSession(engine, expire_on_commit=False) as session:
+                return await coro_factory(session)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+async def _v2_search(session, organization_id, query, limit=5):
+    """
+    Mesmo ranking do knowledge_router_v2: ORDER BY embedding <=> :query_emb::vector
+    (distância de cosseno do pgvector sobre knowledge.embedding)
+    """
+    rows = (await session.execute(
+        select(Knowledge.id, Knowledge.embedding).where(
+            Knowledge.organization_id == organization_id,
+            Knowledge.embedding.isnot(None)
+        )
+    )).all()
+
+    q = np.asarray(_fake_vector(query), dtype=np.float32)
+    distances = []
+    for doc_id, raw in rows:
+        vec = np.asarray(json.loads(raw), dtype=np.float32)
+        distances.append((1 - float(vec @ q / (np.linalg.norm(vec) * np.linalg.norm(q))), doc_id))
+
+    return [doc_id for _, doc_id in sorted(distances)[:limit]]
+
+
+def test_v1_document_is_found_by_v2_search(fake_embeddings):
+    user = SimpleNamespace(organization_id=1)
+    long_text = " ".join(["Exercícios para o joelho com carga progressiva."] * 200)
+
+    async def scenario(session):
+        docs = []
+        for title, content in (("Joelho", long_text), ("Ombro", "Mobilidade do ombro. Ombro rígido."),
+                               ("Coluna", "Postura da coluna.")):
+            docs.append(await knowledge_router.add_knowledge(
+                KnowledgeCreate(title=title, content=content), user, session
+            ))
+
+        chunks = (await session.execute(
+            select(KnowledgeChunk.id).where(KnowledgeChunk.knowledge_id == docs[0].id)
+        )).all()
+        assert len(chunks) > 1
+
+        return [doc.id for doc in docs], await _v2_search(session, 1, "dor no joelho")
+
+    doc_ids, found = _run(scenario)
+
+    assert sorted(found) == sorted(doc_ids)
+    assert found[0] == doc_ids[0]
+
+
+def test_bulk_document_is_found_by_v2_search(fake_embeddings):
+    lines = b"\n".join([
+        json.dumps({"title": "Ombro", "content": "Alongamento do ombro."}).encode(),
+        json.dumps({"title": "Coluna", "content": "Fortalecer a coluna. Coluna neutra."}).encode(),
+    ])
+
+    async def scenario(session):
+        report = await knowledge_ingestion_service.ingest(
+            session, 1, iter_uploads([UploadFile(io.BytesIO(lines), filename="docs.jsonl")])
+        )
+        assert report["inserted"] == 2
+
+        titles = dict((await session.execute(select(Knowledge.id, Knowledge.title))).all())
+        return titles, await _v2_search(session, 1, "coluna")
+
+    titles, found = _run(scenario)
+
+    assert [titles[doc_id] for doc_id in found] == ["Coluna", "Ombro"]
+
+
+def test_document_embedding_is_normalized_mean():
+    space = embedding_service.default_space
+    a = [1.0] + [0.0] * (space.dimensions - 1)
+    b = [0.0, 1.0] + [0.0] * (space.dimensions - 2)
+
+    columns = document_embedding([a, None, b], space)
+    vec = json.loads(columns["embedding"])
+
+    np.testing.assert_allclose(vec[:2], [2 ** -0.5, 2 ** -0.5], rtol=1e-6)
+    np.testing.assert_allclose(np.frombuffer(columns["embedding_vec"], dtype="<f4"), vec, rtol=1e-6)
+
+
+def test_document_embedding_only_in_default_space():
+    space = embedding_service.default_space
+
+    assert document_embedding([None], space) == {}
+    assert document_embedding([[1.0, 0.0]], space._replace(dimensions=2)) == {}
@@ -0,0 +1,32 @@
+"""
+Testes do cursor de paginação do /knowledge/list
+"""
+import sys
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import routers.knowledge_router  # noqa: F401
+
+# routers/__init__ reexporta o APIRouter com o mesmo nome do módulo
+knowledge_router = sys.modules["routers.knowledge_router"]
+
+
+@pytest.mark.parametrize("created_at", [
+    datetime(2026, 10, 17, 12, 30, 45, 123456),
+    datetime(2026, 10, 17, 12, 30, 45, tzinfo=timezone.utc),
+])
+def test_cursor_round_trip(created_at):
+    cursor = knowledge_router._encode_cursor(created_at, 42)
+
+    assert "=" not in cursor
+    assert knowledge_router._decode_cursor(cursor) == (created_at, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "nao-e-cursor", "MjAyNi0xMC0xNw", "!!!"])
+def test_invalid_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        knowledge_router._decode_cursor(cursor)
+
+    assert error.value.status_code == 400
@@ -0,0 +1,42 @@
+"""
+Testes da metadata colunar dos shards FAISS
+"""
+from services.vector_store_metadata import ShardMetadata
+
+
+def _meta(knowledge_id, title, category=None):
+    return {"knowledge_id": knowledge_id, "organization_id": 1, "title": title, "category": category}
+
+
+def test_write_and_load_round_trip(tmp_path):
+    metadata = ShardMetadata.from_dict({
+        3: _meta(3, "Joelho — reabilitação", "ortopedia"),
+        1: _meta(1, "Ombro"),
+        2: _meta(2, "Coluna", "ortopedia"),
+    })
+    metadata.write(tmp_path / "org_1", {"tombstones": [7], "seq": 12})
+
+    loaded, header = ShardMetadata.load(tmp_path / "org_1")
+
+    assert header == {"tombstones": [7], "seq": 12}
+    assert list(loaded.keys()) == [1, 2, 3]
+    assert loaded[3] == _meta(3, "Joelho — reabilitação", "ortopedia")
+    assert loaded.get(1)["category"] is None
+
+
+def test_overlay_changes_survive_the_next_checkpoint(tmp_path):
+    ShardMetadata.from_dict({i: _meta(i, f"doc {i}") for i in range(1, 5)}).write(tmp_path / "g0", {"seq": 0})
+    metadata, _ = ShardMetadata.load(tmp_path / "g0")
+
+    metadata.pop(2)
+    metadata[3] = _meta(3, "doc 3 (editado)", "nova")
+    metadata[9] = _meta(9, "doc 9")
+    assert len(metadata) == 4 and 2 not in metadata
+
+    metadata.write(tmp_path / "g1", {"seq": 5})
+    reloaded, _ = ShardMetadata.load(tmp_path / "g1")
+
+    assert sorted(reloaded.keys()) == [1, 3, 4, 9]
+    assert reloaded[1]["title"] == "doc 1" and reloaded[4]["title"] == "doc 4"
+    assert reloaded[3] == _meta(3, "doc 3 (editado)", "nova")
+    assert 2 not in reloaded
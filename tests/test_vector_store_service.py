@@ -0,0 +1,131 @@
+"""
+Testes do VectorStoreService (shards por organização, gerações e reconstrução)
+"""
+import threading
+
+import numpy as np
+import pytest
+
+from services.vector_store_service import VectorStoreService
+
+DIMENSION = 8
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = VectorStoreService(
+        dimension=DIMENSION,
+        index_dir=str(tmp_path / "shards"),
+        legacy_index_path=str(tmp_path / "legacy"),
+        mmap=False
+    )
+    service.wal_fsync = False
+    service.compact_min = 10 ** 6  # reconstrução só quando o teste pedir
+    yield service
+    service.stop_checkpoints()
+
+
+def _vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, DIMENSION)).astype(np.float32)
+
+
+def _add(service, organization_id, ids, vectors):
+    service.add_vectors_batch(
+        vectors,
+        [{"knowledge_id": i, "organization_id": organization_id, "title": f"doc {i}"} for i in ids]
+    )
+
+
+def _rebuild(service, organization_id):
+    shard = service.get_shard(organization_id)
+    shard.rebuilding = True
+    service._rebuild_shard(shard, dict(shard.spec))
+    return service.get_shard(organization_id)
+
+
+def test_shards_are_isolated_per_organization(service):
+    vectors = _vectors(4)
+    _add(service, 1, [10, 11], vectors[:2])
+    _add(service, 2, [20, 21], vectors[2:])
+
+    assert [hit[0] for hit in service.search(1, vectors[0], k=5)] == [10, 11]
+    assert {hit[0] for hit in service.search(2, vectors[0], k=5)} == {20, 21}
+
+
+def test_rebuild_drops_tombstones_and_keeps_metadata(service):
+    vectors = _vectors(20)
+    _add(service, 1, range(20), vectors)
+    service.remove_vectors(1, range(15))
+
+    shard = _rebuild(service, 1)
+
+    assert shard.base.ntotal == 5
+    assert not shard.tombstones
+    hits = service.search(1, vectors[17], k=1)
+    assert hits[0][0] == 17 and hits[0][2]["title"] == "doc 17"
+
+
+def test_rebuild_writes_the_generation_outside_the_global_lock(service, monkeypatch):
+    _add(service, 1, range(10), _vectors(10))
+    service.remove_vectors(1, [0, 1])
+
+    stage = service._stage
+    lock_free = []
+
+    def checked_stage(*args, **kwargs):
+        # Outra thread (ex.: busca de outra organização) consegue o lock global
+        acquired = []
+
+        def probe():
+            acquired.append(service._lock.acquire(timeout=2))
+            if acquired[0]:
+                service._lock.release()
+
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+        lock_free.append(acquired[0])
+        return stage(*args, **kwargs)
+
+    monkeypatch.setattr(service, "_stage", checked_stage)
+    shard = _rebuild(service, 1)
+
+    assert lock_free == [True]
+    assert shard.generation == 1
+    assert not list(service.index_dir.glob("*.staged*"))
+
+
+def test_writes_during_rebuild_survive_in_the_new_generation(service, monkeypatch):
+    vectors = _vectors(12)
+    _add(service, 1, range(10), vectors[:10])
+    service.remove_vectors(1, [0, 1, 2])
+
+    build = service._build_from
+
+    def build_and_write(*args, **kwargs):
+        index = build(*args, **kwargs)
+        _add(service, 1, [100], vectors[10:11])
+        service.remove_vectors(1, [5])
+        return index
+
+    monkeypatch.setattr(service, "_build_from", build_and_write)
+    shard = _rebuild(service, 1)
+
+    assert shard.generation == 1
+    assert service.search(1, vectors[10], k=1)[0][0] == 100
+    assert 5 not in {hit[0] for hit in service.search(1, vectors[5], k=20)}
+    assert shard.live_count == 7
+
+
+def test_published_generation_is_loaded_by_another_worker(service, tmp_path):
+    vectors = _vectors(6)
+    _add(service, 1, range(6), vectors)
+    service.save_index()
+
+    other = VectorStoreService(
+        dimension=DIMENSION, index_dir=str(service.index_dir),
+        legacy_index_path=str(tmp_path / "legacy"), mmap=False
+    )
+
+    assert other.get_shard(1).generation == 1
+    assert other.search(1, vectors[3], k=1)[0][0] == 3
@@ -0,0 +1,98 @@
+"""
+Testes do write-ahead log dos shards FAISS
+"""
+import numpy as np
+
+from services.vector_store_wal import (
+    OP_ADD, OP_DELETE, OP_SPEC, ShardWAL,
+    decode_add, decode_delete, decode_spec, encode_add, encode_delete, encode_spec,
+)
+
+
+def test_add_payload_round_trip():
+    ids = np.array([7, 8], dtype=np.int64)
+    vectors = np.arange(6, dtype=np.float32).reshape(2, 3)
+    metadatas = [{"title": "Ação"}, {}]
+
+    got_ids, got_vectors, got_metadatas = decode_add(encode_add(ids, vectors, metadatas), 3)
+
+    np.testing.assert_array_equal(got_ids, ids)
+    np.testing.assert_array_equal(got_vectors, vectors)
+    assert got_metadatas == metadatas
+
+
+def test_delete_and_spec_round_trip():
+    np.testing.assert_array_equal(decode_delete(encode_delete(np.array([1, 2, 3]))), [1, 2, 3])
+    assert decode_spec(encode_spec({"dimension": 3, "type": "flat"})) == {"dimension": 3, "type": "flat"}
+
+
+def test_append_and_read(tmp_path):
+    wal = ShardWAL(tmp_path / "org_1.g1.wal", fsync=False)
+    wal.append(1, OP_SPEC, encode_spec({"dimension": 2}))
+    wal.append(2, OP_ADD, encode_add(np.array([5]), np.ones((1, 2)), [{"a": 1}]))
+    wal.append(3, OP_DELETE, encode_delete(np.array([5])))
+    wal.close()
+
+    records, end = wal.read()
+
+    assert [(seq, op) for seq, op, _ in records] == [(1, OP_SPEC), (2, OP_ADD), (3, OP_DELETE)]
+    assert end == wal.size
+
+    # Leitura incremental a partir de um offset já lido
+    wal.append(4, OP_DELETE, encode_delete(np.array([6])))
+    more, new_end = wal.read(end)
+    wal.close()
+
+    assert [seq for seq, _, _ in more] == [4]
+    assert new_end == wal.size
+
+
+def test_torn_tail_is_ignored_and_repaired(tmp_path):
+    path = tmp_path / "org_1.g1.wal"
+    wal = ShardWAL(path, fsync=False)
+    wal.append(1, OP_DELETE, encode_delete(np.array([1])))
+    wal.append(2, OP_DELETE, encode_delete(np.array([2])))
+    wal.close()
+
+    _, valid_end = wal.read()
+    with open(path, "ab") as f:
+        f.write(b"\x03\x00\x00")  # registro cortado no meio do cabeçalho
+
+    records, end = wal.read()
+    assert [seq for seq, _, _ in records] == [1, 2]
+    assert end == valid_end
+
+    wal.repair(end)
+    assert wal.size == valid_end
+
+
+def test_corrupted_record_stops_reading(tmp_path):
+    path = tmp_path / "org_1.g1.wal"
+    wal = ShardWAL(path, fsync=False)
+    wal.append(1, OP_DELETE, encode_delete(np.array([1])))
+    first_end = wal.size
+    wal.append(2, OP_DELETE, encode_delete(np.array([2])))
+    wal.close()
+
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    records, end = wal.read()
+    assert [seq for seq, _, _ in records] == [1]
+    assert end == first_end
+
+
+def test_create_replaces_segment(tmp_path):
+    path = tmp_path / "org_1.g2.wal"
+    path.write_bytes(b"lixo")
+
+    wal = ShardWAL.create(path, [(9, OP_DELETE, encode_delete(np.array([3])))], fsync=False)
+    records, _ = wal.read()
+
+    assert [(seq, op) for seq, op, _ in records] == [(9, OP_DELETE)]
+    assert not (tmp_path / "org_1.g2.wal.tmp").exists()
+
+    wal.remove()
+    assert not path.exists()
+    assert wal.read() == ([], 0)